@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+"""
+Compares the registered session codecs on a few realistic session shapes.
+
+Run from the repository root with::
+
+    python benchmarks/bench_codecs.py [--number N] [--compress-threshold B]
+
+For each shape and codec it prints the encoded size in bytes and the time to
+encode and decode one session in microseconds.
+"""
+
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from pyramid_redis_sessions.codec import (  # noqa: E402
+    _codecs_by_name,
+    decode,
+    encoder,
+    )
+
+
+def _session(managed_dict):
+    return {
+        'managed_dict': managed_dict,
+        'created': 1476601234.123456,
+        'timeout': 1200,
+        }
+
+def anonymous():
+    return _session({'_csrft_': 'a3f1c9d2e4b5a6c7d8e9f0a1b2c3d4e5f6a7b8c9'})
+
+def logged_in():
+    managed_dict = anonymous()['managed_dict']
+    managed_dict.update({
+        'auth.userid': 1234567,
+        'auth.principals': ['group:editors', 'group:staff'],
+        'locale': 'en_US',
+        'last_seen': 1476601234.5,
+        '_f_': ['Welcome back!'],
+        })
+    return _session(managed_dict)
+
+def cart():
+    managed_dict = logged_in()['managed_dict']
+    managed_dict['cart'] = [
+        {'sku': 'SKU-%06d' % i, 'qty': i % 3 + 1, 'price': 19.99 + i,
+         'title': 'Product number %d' % i}
+        for i in range(50)
+        ]
+    return _session(managed_dict)
+
+def large():
+    managed_dict = cart()['managed_dict']
+    managed_dict['search_cache'] = dict(
+        ('query %d' % i, ['result-%d-%d' % (i, j) for j in range(20)])
+        for i in range(40)
+        )
+    return _session(managed_dict)
+
+
+SHAPES = [
+    ('anonymous', anonymous),
+    ('logged_in', logged_in),
+    ('cart', cart),
+    ('large', large),
+    ]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--number', type=int, default=2000,
+                        help='iterations per measurement')
+    parser.add_argument('--compress-threshold', type=int, default=None,
+                        help='compress payloads of at least this many bytes')
+    args = parser.parse_args(argv)
+
+    print('%-10s %-8s %8s %12s %12s' % (
+        'shape', 'codec', 'bytes', 'encode us', 'decode us'))
+    for shape_name, make_shape in SHAPES:
+        data = make_shape()
+        for codec_name in sorted(_codecs_by_name):
+            serialize = encoder(codec_name,
+                                compress_threshold=args.compress_threshold)
+            payload = serialize(data)
+            encode_time = timeit.timeit(lambda: serialize(data),
+                                        number=args.number)
+            decode_time = timeit.timeit(lambda: decode(payload),
+                                        number=args.number)
+            print('%-10s %-8s %8d %12.2f %12.2f' % (
+                shape_name,
+                codec_name,
+                len(payload),
+                encode_time / args.number * 1e6,
+                decode_time / args.number * 1e6,
+                ))
+
+
+if __name__ == '__main__':
+    main()
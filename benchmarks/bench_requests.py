@@ -0,0 +1,420 @@
+# -*- coding: utf-8 -*-
+
+"""
+Measures what sessions cost per request, end to end through
+``RedisSessionFactory``, against an in-process Redis stand-in.
+
+Run from the repository root with::
+
+    python benchmarks/bench_requests.py [--number N] [--scenario NAME]
+        [--setting NAME=VALUE] [--baseline]
+
+Each scenario is a request (or, for ``anonymous``, a first visit) as a
+typical view would make it:
+
+``anonymous``
+    No cookie. The view asks for a CSRF token, creating the session.
+``read_only``
+    A logged in user. The view reads the user id and CSRF token.
+``login``
+    An anonymous session logs in: it is invalidated, and the user id,
+    principals and a flash message are stored in a new one.
+``cart_update``
+    A logged in user with 50 items in their cart changes one of them.
+``large``
+    A logged in user with a large session (a cart and cached searches)
+    reads it and updates a timestamp.
+
+Each request sends the cookie set by the previous one, as a browser would.
+For every scenario the benchmark prints requests per second, Redis round
+trips, commands and bytes (sent and received) per request, the size of the
+cookie sent, and the peak memory allocated during a request.
+
+``--setting`` passes a ``redis.sessions.*`` setting to the factory, as it
+would appear in an ini file (``--setting write_back=true``), and may be given
+several times. ``--baseline`` also runs every scenario with Pyramid's
+``SignedCookieSessionFactory``, which keeps the whole session in the cookie.
+"""
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from pyramid.request import Request  # noqa: E402
+from pyramid.response import Response  # noqa: E402
+from pyramid.session import SignedCookieSessionFactory  # noqa: E402
+
+from pyramid_redis_sessions import RedisSessionFactory  # noqa: E402
+from pyramid_redis_sessions.util import _parse_settings  # noqa: E402
+
+SECRET = 'benchmark secret'
+
+
+def _size(value):
+    if isinstance(value, (bytes, str)):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(_size(k) + _size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sum(_size(v) for v in value)
+    return 0
+
+
+class MemoryRedis(object):
+    """
+    Keeps keys in a dict and counts the round trips, commands and bytes that
+    a real server would have handled. Expire times are recorded but keys
+    never expire.
+    """
+
+    def __init__(self):
+        self.data = {}
+        self.ttls = {}
+        self.reset_counters()
+
+    def reset_counters(self):
+        self.round_trips = 0
+        self.commands = 0
+        self.bytes = 0
+
+    def _record(self, name, arg, kw):
+        result = getattr(self, '_' + name)(*arg, **kw)
+        self.commands += 1
+        self.bytes += _size(arg) + _size(result)
+        return result
+
+    def pipeline(self, transaction=True):
+        return MemoryPipeline(self)
+
+    # commands, as executed on the server
+
+    def _get(self, key):
+        return self.data.get(key)
+
+    def _getex(self, key, ex=None):
+        if ex is not None and key in self.data:
+            self.ttls[key] = ex
+        return self.data.get(key)
+
+    def _set(self, key, value, ex=None, nx=False):
+        if nx and key in self.data:
+            return None
+        self.data[key] = value
+        if ex is not None:
+            self.ttls[key] = ex
+        return True
+
+    def _expire(self, key, timeout):
+        self.ttls[key] = timeout
+        return key in self.data
+
+    def _ttl(self, key):
+        return self.ttls.get(key, -2)
+
+    def _delete(self, *keys):
+        deleted = 0
+        for key in keys:
+            self.ttls.pop(key, None)
+            if self.data.pop(key, None) is not None:
+                deleted += 1
+        return deleted
+
+    def _exists(self, *keys):
+        return sum(1 for key in keys if key in self.data)
+
+    def _incr(self, key):
+        self.data[key] = int(self.data.get(key, 0)) + 1
+        return self.data[key]
+
+    def _hset(self, key, field=None, value=None, mapping=None):
+        fields = self.data.setdefault(key, {})
+        if field is not None:
+            fields[field] = value
+        fields.update(mapping or {})
+
+    def _hgetall(self, key):
+        return dict(self.data.get(key, {}))
+
+    def _hdel(self, key, *fields):
+        for field in fields:
+            self.data.get(key, {}).pop(field, None)
+
+
+def _direct_command(name):
+    def command(self, *arg, **kw):
+        self.round_trips += 1
+        return self._record(name, arg, kw)
+    command.__name__ = name
+    return command
+
+COMMANDS = ('get', 'getex', 'set', 'expire', 'ttl', 'delete', 'exists',
+            'incr', 'hset', 'hgetall', 'hdel')
+
+for _name in COMMANDS:
+    setattr(MemoryRedis, _name, _direct_command(_name))
+
+
+class MemoryPipeline(object):
+    """
+    Queues commands until ``execute``, which is one round trip. After
+    ``watch`` and until ``multi``, commands run straight away, as they do
+    with redis-py.
+    """
+
+    def __init__(self, redis):
+        self.redis = redis
+        self.queue = []
+        self.immediate = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *arg):
+        self.queue = []
+
+    def __getattr__(self, name):
+        if name not in COMMANDS:
+            raise AttributeError(name)
+
+        def command(*arg, **kw):
+            if self.immediate:
+                return getattr(self.redis, name)(*arg, **kw)
+            self.queue.append((name, arg, kw))
+            return self
+        return command
+
+    def watch(self, *keys):
+        self.redis.round_trips += 1
+        self.redis.commands += 1
+        self.immediate = True
+
+    def multi(self):
+        self.immediate = False
+
+    def execute(self):
+        queue, self.queue = self.queue, []
+        if not queue:
+            return []
+        self.redis.round_trips += 1
+        return [self.redis._record(name, arg, kw) for name, arg, kw in queue]
+
+
+class Browser(object):
+    """
+    Sends requests through a session factory with the cookies set by the
+    previous responses.
+    """
+
+    def __init__(self, factory):
+        self.factory = factory
+        self.cookies = {}
+
+    def cookie_header(self):
+        return '; '.join('%s=%s' % item for item in self.cookies.items())
+
+    def request(self, view):
+        headers = {}
+        if self.cookies:
+            headers['Cookie'] = self.cookie_header()
+        request = Request.blank('/', headers=headers)
+        request.session = self.factory(request)
+        view(request)
+        response = Response()
+        request._process_response_callbacks(response)
+        for name, value in _set_cookies(response):
+            if value:
+                self.cookies[name] = value
+            else:
+                self.cookies.pop(name, None)
+
+
+def _set_cookies(response):
+    for header in response.headers.getall('Set-Cookie'):
+        name, _, rest = header.partition('=')
+        value = rest.split(';', 1)[0]
+        if 'Max-Age=0' in header:
+            value = ''
+        yield name, value
+
+
+# session contents
+
+USER = {
+    'auth.userid': 1234567,
+    'auth.principals': ['group:editors', 'group:staff'],
+    'locale': 'en_US',
+    'last_seen': 1476601234.5,
+    }
+
+def _cart(size=50):
+    return [
+        {'sku': 'SKU-%06d' % i, 'qty': i % 3 + 1, 'price': 19.99 + i,
+         'title': 'Product number %d' % i}
+        for i in range(size)
+        ]
+
+def _searches():
+    return dict(
+        ('query %d' % i, ['result-%d-%d' % (i, j) for j in range(20)])
+        for i in range(40)
+        )
+
+
+# views, and the requests that set up the session they expect
+
+def anonymous_setup(request):
+    pass
+
+def anonymous_view(request):
+    request.session.get_csrf_token()
+
+def logged_in_setup(request):
+    request.session.update(USER)
+    request.session.get_csrf_token()
+
+def read_only_view(request):
+    request.session.get('auth.userid')
+    request.session.get_csrf_token()
+
+def login_setup(request):
+    request.session.get_csrf_token()
+
+def login_view(request):
+    request.session.invalidate()
+    request.session.update(USER)
+    request.session.flash('Welcome back!')
+
+def cart_setup(request):
+    logged_in_setup(request)
+    request.session['cart'] = _cart()
+
+def cart_update_view(request):
+    cart = list(request.session['cart'])
+    cart[7] = dict(cart[7], qty=cart[7]['qty'] % 5 + 1)
+    request.session['cart'] = cart
+
+def large_setup(request):
+    cart_setup(request)
+    request.session['search_cache'] = _searches()
+
+def large_view(request):
+    request.session.get('search_cache')
+    request.session['last_seen'] = time.time()
+
+
+SCENARIOS = [
+    # name, setup, view, whether each request starts without a cookie
+    ('anonymous', anonymous_setup, anonymous_view, True),
+    ('read_only', logged_in_setup, read_only_view, False),
+    ('login', login_setup, login_view, False),
+    ('cart_update', cart_setup, cart_update_view, False),
+    ('large', large_setup, large_view, False),
+    ]
+
+
+def run(factory, setup, view, fresh, number, redis=None):
+    """
+    Returns ``(seconds, cookie bytes, peak bytes, counters)`` for
+    ``number`` requests made with ``view``, after one made with ``setup``.
+    ``counters`` are the round trips, commands and bytes counted by
+    ``redis``, or ``None`` without it.
+    """
+    browser = Browser(factory)
+    browser.request(setup)
+
+    def one_request():
+        if fresh:
+            browser.cookies = {}
+        browser.request(view)
+
+    # warm up, then take the steady state cookie as the one that is sent
+    one_request()
+    cookie_bytes = len(browser.cookie_header())
+    if redis is not None:
+        redis.reset_counters()
+
+    start = time.perf_counter()
+    for _ in range(number):
+        one_request()
+    seconds = time.perf_counter() - start
+
+    counters = None
+    if redis is not None:
+        counters = (redis.round_trips, redis.commands, redis.bytes)
+
+    tracemalloc.start()
+    peak = 0
+    for _ in range(min(number, 50)):
+        tracemalloc.reset_peak()
+        one_request()
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+    tracemalloc.stop()
+    return seconds, cookie_bytes, peak, counters
+
+
+def redis_factory(settings):
+    options = _parse_settings(dict(
+        ('redis.sessions.%s' % name, value)
+        for name, value in dict(settings, secret=SECRET).items()
+        ))
+    redis = MemoryRedis()
+    options['client_callable'] = lambda request, **redis_options: redis
+    return RedisSessionFactory(**options), redis
+
+def baseline_factory():
+    return SignedCookieSessionFactory(SECRET)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--number', type=int, default=2000,
+                        help='requests per scenario')
+    parser.add_argument('--scenario', action='append',
+                        choices=[name for name, _, _, _ in SCENARIOS],
+                        help='run only this scenario (repeatable)')
+    parser.add_argument('--setting', action='append', default=[],
+                        metavar='NAME=VALUE',
+                        help='a redis.sessions setting (repeatable)')
+    parser.add_argument('--baseline', action='store_true',
+                        help="also run Pyramid's SignedCookieSessionFactory")
+    args = parser.parse_args(argv)
+    settings = dict(setting.split('=', 1) for setting in args.setting)
+
+    print('%-12s %-8s %10s %8s %8s %10s %8s %9s' % (
+        'scenario', 'factory', 'req/s', 'trips', 'cmds', 'redis B',
+        'cookie B', 'peak KiB'))
+    for name, setup, view, fresh in SCENARIOS:
+        if args.scenario and name not in args.scenario:
+            continue
+        runs = [('redis',) + redis_factory(settings)]
+        if args.baseline:
+            runs.append(('cookie', baseline_factory(), None))
+        for label, factory, redis in runs:
+            try:
+                seconds, cookie_bytes, peak, counters = run(
+                    factory, setup, view, fresh, args.number, redis)
+            except ValueError as e:
+                # the session doesn't fit in a cookie
+                print('%-12s %-8s %s' % (name, label, e))
+                continue
+            trips = cmds = size = 0.0
+            if counters is not None:
+                trips, cmds, size = [c / float(args.number) for c in counters]
+            print('%-12s %-8s %10.0f %8.2f %8.2f %10.0f %8d %9.1f' % (
+                name,
+                label,
+                args.number / seconds,
+                trips,
+                cmds,
+                size,
+                cookie_bytes,
+                peak / 1024.0,
+                ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,344 @@
+# -*- coding: utf-8 -*-
+
+"""
+An asyncio counterpart to the session factory, for services outside of
+Pyramid (websocket gateways, task workers and the like) that need to read and
+change the same sessions as the web application. Requires Python 3.5 or
+later and a ``redis.asyncio.Redis`` client (redis-py 4.2 or later, which the
+``async`` extra installs).
+
+Sessions use the same payload format, storage layouts and id generation as
+``RedisSessionFactory``, so pass the same ``serialize``/``deserialize``
+functions (or codec ``encoder``/``decoder``) and ``storage`` as the web
+application uses. Cookies are signed with the same scheme, so a session id
+can be taken straight from the web application's session cookie::
+
+    from redis.asyncio import Redis
+    from pyramid_redis_sessions.aio import load_session, session_id_from_cookie
+
+    redis = Redis()
+    session_id = session_id_from_cookie(cookieval, secret)
+    session = await load_session(redis, session_id)
+    if session is not None:
+        session['seen'] = True
+        await session.save()
+
+Unlike ``RedisSession``, an ``AsyncRedisSession`` never talks to Redis from
+its dict methods: changes and reads are only recorded, and ``save`` writes
+them (or resets the expire time) in one go. Since every call is a coroutine,
+many sessions can be loaded or saved concurrently on one event loop, for
+instance with ``asyncio.gather``.
+"""
+
+import time
+
+try:
+    import redis.asyncio
+except ImportError:
+    raise ImportError(
+        'pyramid_redis_sessions.aio requires redis-py 4.2 or later, install '
+        'it with pip install pyramid_redis_sessions[async]')
+from pyramid.decorator import reify
+from pyramid.interfaces import ISession
+from redis.exceptions import WatchError
+from zope.interface import implementer
+
+from .compat import cPickle
+from .cookie import serialize_cookie
+from .framing import encode_framed
+from .session import (
+    _FramedSessionDict,
+    _HashSessionDict,
+    _SessionDict,
+    encode_hash_fields,
+    )
+from .util import (
+    _generate_session_id,
+    session_id_from_cookie,
+    )
+
+
+@implementer(ISession)
+class AsyncRedisSession(_SessionDict):
+    """
+    A session for ``redis.asyncio`` clients, with the same dict and session
+    methods as ``RedisSession``. Mutations and reads behave as in write-back
+    mode with deferred refreshes, and ``await session.save()`` writes the
+    changes (or resets the expire time of a session that was only read).
+    ``invalidate`` is deferred to ``save`` too, and a session created after
+    it is only stored in Redis once something is stored in it.
+
+    Use ``load_session`` and ``create_session`` rather than the constructor,
+    which never fetches anything from Redis itself.
+    """
+
+    write_back = True
+    defer_refresh = True
+
+    def __init__(
+        self,
+        redis,
+        session_id,
+        new,
+        serialize=cPickle.dumps,
+        deserialize=cPickle.loads,
+        timeout=1200,
+        serialized=None,
+        id_generator=_generate_session_id,
+        ):
+        self.redis = redis
+        self.serialize = serialize
+        self.deserialize = deserialize
+        self.default_timeout = timeout
+        self.id_generator = id_generator
+        self._invalidated_ids = []
+        self._reset_changes()
+        self._session_state = self._make_session_state(
+            session_id=session_id,
+            new=new,
+            serialized=serialized,
+            )
+
+    @reify
+    def _session_state(self):
+        # sessions created after invalidate are stored by save
+        return self._make_session_state(session_id=None, new=True)
+
+    def invalidate(self):
+        """Invalidate the session. It is deleted from Redis by the next call
+        to ``save``."""
+        if self.session_id is not None:
+            self._invalidated_ids.append(self.session_id)
+        del self._session_state
+        self._reset_changes()
+
+    async def save(self):
+        """Write this session to Redis if it changed, or reset its expire
+        time if it was read, and delete any sessions it was invalidated
+        from."""
+        if self._invalidated_ids:
+            await self.redis.delete(*self._invalidated_ids)
+            self._invalidated_ids = []
+        if self._invalidated:
+            return
+        if self.session_id is None:
+            if self._dirty:
+                value = self.to_redis()
+                self._session_state.session_id = await get_unique_session_id(
+                    self.redis,
+                    timeout=self.timeout,
+                    serialize=self.serialize,
+                    generator=self.id_generator,
+                    value=value,
+                    )
+                self._session_state.persisted = value
+            self._reset_changes()
+            return
+        written = self._dirty and await self._write_changes_async()
+        if not written and (self._dirty or self._touched):
+            # unchanged, so only reset the expire time like a read would
+            await self.redis.expire(self.session_id, self.timeout)
+        self._reset_changes()
+
+    async def refresh(self):
+        """Reset the expire time for this session's key in Redis."""
+        if self.session_id is not None:
+            await self.redis.expire(self.session_id, self.timeout)
+        self._touched = False
+
+    async def _write_changes_async(self):
+        value = self.to_redis()
+        if value == self._session_state.persisted:
+            return False
+        await self.redis.set(self.session_id, value, ex=self.timeout)
+        self._session_state.persisted = value
+        return True
+
+
+class AsyncRedisHashSession(_HashSessionDict, AsyncRedisSession):
+    """
+    An ``AsyncRedisSession`` stored as a Redis hash, in the same layout as
+    ``RedisHashSession``.
+    """
+
+    async def _write_changes_async(self):
+        diff = self._diff_fields()
+        if diff is None:
+            return False
+        fields, deleted = diff
+        async with self.redis.pipeline() as pipe:
+            self._queue_field_writes(pipe, fields, deleted)
+            await pipe.execute()
+        self._update_persisted(fields, deleted)
+        return True
+
+
+class AsyncRedisFramedSession(_FramedSessionDict, AsyncRedisSession):
+    """
+    An ``AsyncRedisSession`` stored in the framed format of
+    ``RedisFramedSession``.
+    """
+
+
+_session_classes = {
+    'string': AsyncRedisSession,
+    'hash': AsyncRedisHashSession,
+    'framed': AsyncRedisFramedSession,
+    }
+
+def _session_class(storage):
+    try:
+        return _session_classes[storage]
+    except KeyError:
+        raise ValueError('storage must be string, hash or framed')
+
+
+async def load_session(
+    redis,
+    session_id,
+    serialize=cPickle.dumps,
+    deserialize=cPickle.loads,
+    storage='string',
+    timeout=1200,
+    id_generator=_generate_session_id,
+    touch=False,
+    ):
+    """
+    Loads the session ``session_id`` in a single round trip, and returns an
+    ``AsyncRedisSession`` (or an ``AsyncRedisHashSession`` if ``storage`` is
+    ``hash``, or an ``AsyncRedisFramedSession`` if it is ``framed``), or
+    ``None`` if the session does not exist. If ``touch`` is ``True`` the
+    session's expire time is reset while loading it.
+    """
+    session_class = _session_class(storage)
+    if session_id is None:
+        return None
+    async with redis.pipeline(transaction=False) as pipe:
+        session_class.queue_read(pipe, session_id)
+        if touch:
+            pipe.expire(session_id, timeout)
+        results = await pipe.execute()
+    serialized = session_class.read_result(results[0])
+    if serialized is None:
+        return None
+    session = session_class(
+        redis=redis,
+        session_id=session_id,
+        new=False,
+        serialize=serialize,
+        deserialize=deserialize,
+        timeout=timeout,
+        serialized=serialized,
+        id_generator=id_generator,
+        )
+    if touch and session.timeout != timeout:
+        # keep the timeout set with adjust_timeout_for_session
+        await session.refresh()
+    return session
+
+async def create_session(
+    redis,
+    serialize=cPickle.dumps,
+    deserialize=cPickle.loads,
+    storage='string',
+    timeout=1200,
+    id_generator=_generate_session_id,
+    lazy=False,
+    ):
+    """
+    Creates a new, empty session under a new unique id and returns it. If
+    ``lazy`` is ``True``, the session is only stored in Redis (and given an
+    id) when it is saved with something stored in it.
+    """
+    session_class = _session_class(storage)
+    if lazy:
+        session_id = serialized = None
+    else:
+        persisted = {
+            'managed_dict': {},
+            'created': time.time(),
+            'timeout': timeout,
+            }
+        if storage == 'hash':
+            serialized = encode_hash_fields(persisted, serialize)
+        elif storage == 'framed':
+            serialized = encode_framed(persisted, serialize)
+        else:
+            serialized = serialize(persisted)
+        session_id = await get_unique_session_id(
+            redis,
+            timeout=timeout,
+            serialize=serialize,
+            generator=id_generator,
+            value=serialized,
+            )
+    return session_class(
+        redis=redis,
+        session_id=session_id,
+        new=True,
+        serialize=serialize,
+        deserialize=deserialize,
+        timeout=timeout,
+        serialized=serialized,
+        id_generator=id_generator,
+        )
+
+async def get_unique_session_id(
+    redis,
+    timeout,
+    serialize,
+    generator=_generate_session_id,
+    value=None,
+    ):
+    """
+    The coroutine counterpart of ``util.get_unique_session_id``.
+    """
+    while 1:
+        session_id = generator()
+        attempt = await _insert_session_id_if_unique(
+            redis,
+            timeout,
+            session_id,
+            serialize,
+            value,
+            )
+        if attempt is not None:
+            return attempt
+
+async def _insert_session_id_if_unique(
+    redis,
+    timeout,
+    session_id,
+    serialize,
+    value=None,
+    ):
+    if value is None:
+        value = serialize({
+            'managed_dict': {},
+            'created': time.time(),
+            'timeout': timeout,
+            })
+    if not isinstance(value, dict):
+        if await redis.set(session_id, value, ex=timeout, nx=True):
+            return session_id
+        return None
+    async with redis.pipeline() as pipe:
+        try:
+            await pipe.watch(session_id)
+            if await pipe.exists(session_id):
+                return None
+            pipe.multi()
+            pipe.hset(session_id, mapping=value)
+            pipe.expire(session_id, timeout)
+            await pipe.execute()
+            return session_id
+        except WatchError:
+            return None
+
+
+def cookie_value(session, secret, format='legacy'):
+    """
+    Returns the signed session cookie value for ``session``, as set by
+    ``RedisSessionFactory`` with the same ``cookie_format``.
+    """
+    return serialize_cookie(session.session_id, secret, format)
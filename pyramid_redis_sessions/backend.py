@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+
+"""
+The storage operations sessions need, behind a narrow interface.
+
+A backend stores serialized sessions under their ids, each with a time to
+live in seconds. ``RedisBackend`` is what sessions use by default.
+``MemoryBackend`` keeps sessions in the current process instead, for
+single-process deployments, tests and benchmarks::
+
+    redis.sessions.backend = memory
+
+or pass any ``SessionBackend`` as the ``backend`` argument of
+``RedisSessionFactory``. With a backend other than Redis, sessions are
+stored as strings: ``storage = hash``, ``local_cache``, ``use_scripts``,
+``shards`` and ``replica_urls`` are Redis features and can't be used, and
+the ``threshold`` refresh policy refreshes on every request that reads the
+session, as the remaining time to live isn't known.
+"""
+
+from heapq import (
+    heapify,
+    heappop,
+    heappush,
+    )
+import threading
+import time
+
+from .util import (
+    _generate_session_id,
+    _insert_session_id_if_unique,
+    )
+
+
+class SessionBackend(object):
+    """
+    The interface of a session backend. Timeouts are in seconds.
+    """
+
+    def load(self, session_id, touch_timeout=None):
+        """Return the serialized session ``session_id``, or ``None`` if it
+        doesn't exist. If ``touch_timeout`` is given, its time to live is
+        reset to it in the same step."""
+        raise NotImplementedError
+
+    def create(self, session_id, value, timeout, replace=None):
+        """Store ``value`` as ``session_id`` only if there is no such
+        session yet, and return whether it was stored. The sessions in
+        ``replace`` are deleted in the same step."""
+        raise NotImplementedError
+
+    def save(self, session_id, value, timeout):
+        """Store ``value`` as ``session_id``, replacing any previous value,
+        and reset its time to live."""
+        raise NotImplementedError
+
+    def touch(self, session_id, timeout):
+        """Reset the time to live of ``session_id``, if it exists."""
+        raise NotImplementedError
+
+    def delete(self, *session_ids):
+        """Delete the sessions ``session_ids``."""
+        raise NotImplementedError
+
+
+class RedisBackend(SessionBackend):
+    """
+    Stores sessions as Redis strings with an expire time, using ``redis``
+    (a ``StrictRedis`` or compatible client).
+    """
+
+    def __init__(self, redis):
+        self.redis = redis
+
+    def load(self, session_id, touch_timeout=None):
+        if touch_timeout is not None:
+            return self.redis.getex(session_id, ex=touch_timeout)
+        return self.redis.get(session_id)
+
+    def create(self, session_id, value, timeout, replace=None):
+        # SET NX, in a transaction with the deletes if there are any
+        return _insert_session_id_if_unique(
+            self.redis, timeout, session_id, None, value, replace) is not None
+
+    def save(self, session_id, value, timeout):
+        self.redis.set(session_id, value, ex=timeout)
+
+    def touch(self, session_id, timeout):
+        self.redis.expire(session_id, timeout)
+
+    def delete(self, *session_ids):
+        self.redis.delete(*session_ids)
+
+
+class MemoryBackend(SessionBackend):
+    """
+    Keeps sessions in a dict, in the current process. Expired sessions are
+    removed in ``O(log n)`` each, from a heap ordered by expiry time, as
+    later calls come in.
+
+    Parameters:
+
+    ``clock``
+    A function returning the current time in seconds. Default:
+    ``time.time``.
+    """
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        # session_id -> (value, expires)
+        self._sessions = {}
+        # (expires, session_id), including entries made stale by later
+        # writes or touches, which are skipped when they come up
+        self._expiry = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            self._expire(self.clock())
+            return len(self._sessions)
+
+    def __contains__(self, session_id):
+        return self.load(session_id) is not None
+
+    def _expire(self, now):
+        expiry = self._expiry
+        while expiry and expiry[0][0] <= now:
+            expires, session_id = heappop(expiry)
+            entry = self._sessions.get(session_id)
+            if entry is not None and entry[1] == expires:
+                del self._sessions[session_id]
+
+    def _set(self, session_id, value, timeout, now):
+        expires = now + timeout
+        self._sessions[session_id] = (value, expires)
+        heappush(self._expiry, (expires, session_id))
+        if len(self._expiry) > 2 * len(self._sessions) + 64:
+            # drop the stale entries left by frequent touches
+            self._expiry = [(e, sid) for sid, (_, e) in self._sessions.items()]
+            heapify(self._expiry)
+
+    def load(self, session_id, touch_timeout=None):
+        with self._lock:
+            now = self.clock()
+            self._expire(now)
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return None
+            if touch_timeout is not None:
+                self._set(session_id, entry[0], touch_timeout, now)
+            return entry[0]
+
+    def create(self, session_id, value, timeout, replace=None):
+        with self._lock:
+            now = self.clock()
+            self._expire(now)
+            for replaced in replace or ():
+                self._sessions.pop(replaced, None)
+            if session_id in self._sessions:
+                return False
+            self._set(session_id, value, timeout, now)
+            return True
+
+    def save(self, session_id, value, timeout):
+        with self._lock:
+            now = self.clock()
+            self._expire(now)
+            self._set(session_id, value, timeout, now)
+
+    def touch(self, session_id, timeout):
+        with self._lock:
+            now = self.clock()
+            self._expire(now)
+            entry = self._sessions.get(session_id)
+            if entry is not None:
+                self._set(session_id, entry[0], timeout, now)
+
+    def delete(self, *session_ids):
+        with self._lock:
+            for session_id in session_ids:
+                self._sessions.pop(session_id, None)
+
+
+def get_unique_session_id(
+    backend,
+    timeout,
+    serialize,
+    generator=_generate_session_id,
+    value=None,
+    replace=None,
+    metrics=None,
+    ):
+    """
+    The counterpart of ``util.get_unique_session_id`` for a
+    ``SessionBackend``. The sessions in ``replace`` are deleted along with
+    creating the new one.
+    """
+    if value is None:
+        value = serialize({
+            'managed_dict': {},
+            'created': time.time(),
+            'timeout': timeout,
+            })
+    while 1:
+        session_id = generator()
+        if backend.create(session_id, value, timeout, replace):
+            return session_id
+        if metrics is not None:
+            metrics.session_id_collision()
@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+
+"""
+Working with all sessions at once, for auditing, exporting or purging them
+from a script.
+
+``iter_sessions`` streams every session stored in Redis::
+
+    from pyramid_redis_sessions.bulk import iter_sessions
+
+    for session_id, session in iter_sessions(redis, prefix='session:'):
+        print(session_id, session['created'], session['managed_dict'])
+
+Keys are found with ``SCAN`` rather than ``KEYS``, so the server is never
+blocked, and fetched with one ``MGET`` (or one ``HGETALL`` per key, for
+sessions stored as hashes) per batch, pipelined with the next ``SCAN``. Only
+one batch is held in memory at a time. Run it against a replica to keep the
+load off the primary.
+
+Keys with the default prefixes of the activity buckets and user indexes
+(``COMPANION_PREFIXES``) are skipped, since they live next to sessions when
+those have no prefix. Pass ``exclude_prefixes`` if you changed them.
+
+``SCAN`` may return a key more than once, and sessions created or deleted
+while iterating may or may not be seen. Sessions that expire between being
+found and being fetched are skipped.
+"""
+
+from .codec import decoder
+from .cache import version_key
+from . import framing
+from .session import decode_hash_fields
+
+# the suffix of the version counters stored next to versioned sessions
+_VERSION_SUFFIX = version_key('')
+
+# the default prefixes of the keys of activity.ActivityTracker and
+# index.UserIndex
+COMPANION_PREFIXES = ('session_activity:', 'user_sessions:')
+
+
+def _text(key):
+    if isinstance(key, bytes):
+        return key.decode('utf-8')
+    return key
+
+def _is_session_key(key, exclude_prefixes):
+    return not (key.endswith(_VERSION_SUFFIX) or
+                key.startswith(tuple(exclude_prefixes)))
+
+# a ShardedRedis (possibly wrapped in a metrics.InstrumentedRedis) is
+# recognised by its nodes
+def _nodes(redis):
+    if getattr(redis, 'node_name', None) is not None:
+        return list(redis.nodes.values())
+    return [redis]
+
+def _groups(redis, session_ids):
+    """Returns a list of ``(node, session_ids)`` with the ids stored on
+    each node."""
+    if getattr(redis, 'node_name', None) is not None:
+        return redis._group(session_ids)
+    return [(redis, session_ids)]
+
+
+def _queue_fetch(pipe, session_ids, storage):
+    if storage == 'hash':
+        for session_id in session_ids:
+            pipe.hgetall(session_id)
+    else:
+        pipe.mget(session_ids)
+
+def _fetched(results, session_ids, storage):
+    """Returns the raw values queued by ``_queue_fetch`` from ``results``,
+    and the rest of the results."""
+    if storage == 'hash':
+        count = len(session_ids)
+        return results[:count], results[count:]
+    return results[0], results[1:]
+
+def _decode(value, storage, deserialize):
+    if storage == 'hash':
+        if not value:
+            return None
+        return decode_hash_fields(value, deserialize)
+    if value is None:
+        return None
+    if storage == 'framed':
+        return framing.decode(value, deserialize)
+    return deserialize(value)
+
+
+def scan_session_ids(redis, prefix='', count=1000,
+                     exclude_prefixes=COMPANION_PREFIXES):
+    """
+    Yields the id of every session whose key starts with ``prefix``, with
+    ``SCAN``. ``count`` is the number of keys each ``SCAN`` looks at. Keys
+    starting with one of ``exclude_prefixes`` are skipped.
+    """
+    for node in _nodes(redis):
+        cursor = 0
+        while 1:
+            cursor, keys = node.scan(cursor, match=prefix + '*', count=count)
+            for key in keys:
+                key = _text(key)
+                if _is_session_key(key, exclude_prefixes):
+                    yield key
+            if not int(cursor):
+                break
+
+def fetch_sessions(redis, session_ids, deserialize=None, storage='string'):
+    """
+    Fetches the sessions ``session_ids`` in a single round trip per node,
+    and returns a list of ``(session_id, session)``, with ``None`` for the
+    sessions that don't exist. ``session`` is the stored dict of ``managed_dict``,
+    ``created`` and ``timeout``.
+
+    ``deserialize`` defaults to decoding any of the built in codecs, with
+    pickle for payloads without a codec header. ``storage`` is ``string``,
+    ``hash`` or ``framed``, as set on the session factory.
+    """
+    if deserialize is None:
+        deserialize = decoder()
+    session_ids = list(session_ids)
+    if not session_ids:
+        return []
+    sessions = {}
+    for node, node_ids in _groups(redis, session_ids):
+        with node.pipeline(transaction=False) as pipe:
+            _queue_fetch(pipe, node_ids, storage)
+            values, _ = _fetched(pipe.execute(), node_ids, storage)
+        for session_id, value in zip(node_ids, values):
+            sessions[session_id] = _decode(value, storage, deserialize)
+    return [(session_id, sessions[session_id]) for session_id in session_ids]
+
+def iter_sessions(
+    redis,
+    prefix='',
+    deserialize=None,
+    storage='string',
+    batch_size=1000,
+    created_before=None,
+    created_after=None,
+    min_timeout=None,
+    max_timeout=None,
+    exclude_prefixes=COMPANION_PREFIXES,
+    ):
+    """
+    Yields ``(session_id, session)`` for every session whose key starts
+    with ``prefix``. ``session`` is the stored dict of ``managed_dict``,
+    ``created`` and ``timeout``.
+
+    Parameters:
+
+    ``redis``
+    A ``StrictRedis`` client, or a ``sharding.ShardedRedis`` to go through
+    each of its nodes in turn.
+
+    ``prefix``
+    The ``prefix`` setting of the session factory. With the default of no
+    prefix every key in the database is looked at, so keys of other types
+    are skipped, but values that don't deserialize raise an error.
+
+    ``deserialize``
+    The ``deserialize`` setting of the session factory. Default: decoding
+    any of the built in codecs, with pickle for payloads without a codec
+    header.
+
+    ``storage``
+    The ``storage`` setting of the session factory. Default: ``string``.
+
+    ``batch_size``
+    The number of keys each ``SCAN`` looks at and each round trip fetches.
+    Default: ``1000``.
+
+    ``created_before``, ``created_after``
+    Only yield sessions created before or after these times, in seconds
+    since the epoch. Default: ``None``.
+
+    ``min_timeout``, ``max_timeout``
+    Only yield sessions whose timeout is at least or at most these numbers
+    of seconds. Default: ``None``.
+
+    ``exclude_prefixes``
+    Skip the keys starting with these prefixes. Default: the default
+    prefixes of the keys of ``activity.ActivityTracker`` and
+    ``index.UserIndex``.
+    """
+    if deserialize is None:
+        deserialize = decoder()
+
+    def wanted(session):
+        if session is None:
+            return False
+        created = session.get('created')
+        timeout = session.get('timeout')
+        return not (
+            (created_before is not None and created >= created_before) or
+            (created_after is not None and created <= created_after) or
+            (min_timeout is not None and timeout < min_timeout) or
+            (max_timeout is not None and timeout > max_timeout)
+            )
+
+    match = prefix + '*'
+    for node in _nodes(redis):
+        cursor, keys = node.scan(0, match=match, count=batch_size)
+        while 1:
+            session_ids = [key for key in map(_text, keys)
+                           if _is_session_key(key, exclude_prefixes)]
+            done = not int(cursor)
+            if done and not session_ids:
+                break
+            # fetch this batch and scan for the next one in one round trip
+            with node.pipeline(transaction=False) as pipe:
+                if session_ids:
+                    _queue_fetch(pipe, session_ids, storage)
+                if not done:
+                    pipe.scan(cursor, match=match, count=batch_size)
+                results = pipe.execute()
+            if session_ids:
+                values, results = _fetched(results, session_ids, storage)
+                for session_id, value in zip(session_ids, values):
+                    session = _decode(value, storage, deserialize)
+                    if wanted(session):
+                        yield session_id, session
+            if done:
+                break
+            cursor, keys = results[0]
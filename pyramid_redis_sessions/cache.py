@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+
+"""
+A process-local cache of decoded sessions.
+
+With the cache enabled, sessions are versioned: every write increments a
+counter stored in Redis under ``<session_id>:version``, in the same
+transaction as the write. When a request arrives for a session this process
+has cached, only the small version key is read from Redis. If it matches the
+cached version, the cached session is used as is, saving the transfer and
+deserialization of the whole payload.
+
+Cached sessions are checked out for the duration of a request, and only put
+back at the end of the request if their data still matches what is stored in
+Redis (so changes that were never saved can't leak into later requests).
+"""
+
+from collections import OrderedDict
+import threading
+
+from . import scripts
+
+
+def version_key(session_id):
+    """
+    Returns the key of the version counter for ``session_id``.
+    """
+    return session_id + ':version'
+
+
+class _CacheEntry(object):
+    def __init__(self, version, state, size):
+        self.version = version
+        self.state = state
+        self.size = size
+
+
+class SessionCache(object):
+    """
+    A thread safe LRU cache of session states, bounded both by the number of
+    entries and by the total size of their serialized data.
+
+    Parameters:
+
+    ``max_entries``
+    The maximum number of sessions to keep. Default: ``1024``.
+
+    ``max_bytes``
+    The maximum total size of the cached sessions' serialized data, in
+    bytes. Default: ``16777216`` (16 MB).
+    """
+
+    def __init__(self, max_entries=1024, max_bytes=16 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, session_id):
+        return session_id in self._entries
+
+    def put(self, session_id, version, state, size):
+        """
+        Caches ``state`` (a session state) at ``version``, evicting the least
+        recently used sessions as needed to stay within bounds.
+        """
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._remove(session_id)
+            self._entries[session_id] = _CacheEntry(version, state, size)
+            self.size += size
+            while len(self._entries) > self.max_entries or \
+                    self.size > self.max_bytes:
+                _, entry = self._entries.popitem(last=False)
+                self.size -= entry.size
+
+    def checkout(self, session_id):
+        """
+        Removes and returns the cached entry for ``session_id``, or ``None``.
+        """
+        with self._lock:
+            return self._remove(session_id)
+
+    def discard(self, session_id):
+        with self._lock:
+            self._remove(session_id)
+
+    def _remove(self, session_id):
+        entry = self._entries.pop(session_id, None)
+        if entry is not None:
+            self.size -= entry.size
+        return entry
+
+
+def _payload_size(persisted):
+    if isinstance(persisted, dict):
+        return sum(len(value) for value in persisted.values())
+    return len(persisted)
+
+def _as_version(value):
+    return None if value is None else int(value)
+
+
+def _resumed(entry):
+    # the state may have been cached by the request that created the
+    # session, but it is stored in Redis now
+    state = entry.state
+    state.new = False
+    return state
+
+def load_versioned(
+    cache,
+    session_class,
+    redis,
+    session_id,
+    touch_timeout=None,
+    with_ttl=False,
+    use_scripts=False,
+    ):
+    """
+    Loads ``session_id`` for a versioned session, using ``cache`` when its
+    copy is current. The expire time is reset to ``touch_timeout`` if it is
+    given, and the remaining time to live is fetched if ``with_ttl`` is
+    ``True``. With ``use_scripts``, the version check and the load happen in
+    a single server-side script.
+
+    Returns a ``(state, serialized, version, ttl)`` tuple. ``state`` is the
+    cached session state if it could be used (and ``serialized`` is then
+    ``None``). Otherwise ``serialized`` is the data read from Redis, or
+    ``None`` if the session does not exist.
+    """
+    vkey = version_key(session_id)
+    entry = cache.checkout(session_id)
+
+    if use_scripts:
+        serialized, version, ttl, current = scripts.load_session(
+            redis,
+            session_id,
+            storage=session_class.storage,
+            version_key=vkey,
+            touch_timeout=touch_timeout,
+            with_ttl=with_ttl,
+            cached_version=entry.version if entry is not None else None,
+            )
+        if current:
+            return _resumed(entry), None, version, ttl
+        return None, serialized, version, ttl
+
+    def queue_extras(pipe):
+        if touch_timeout is not None:
+            pipe.expire(session_id, touch_timeout)
+            pipe.expire(vkey, touch_timeout)
+        elif with_ttl:
+            pipe.ttl(session_id)
+
+    def ttl_from(results):
+        return results[-1] if with_ttl and touch_timeout is None else None
+
+    if entry is not None:
+        with redis.pipeline(transaction=False) as pipe:
+            pipe.get(vkey)
+            queue_extras(pipe)
+            results = pipe.execute()
+        version = _as_version(results[0])
+        # a missing version key never matches, since the session may be gone
+        if version is not None and version == entry.version:
+            return _resumed(entry), None, version, ttl_from(results)
+
+    # read the data and its version in one transaction so that they match
+    with redis.pipeline() as pipe:
+        session_class.queue_read(pipe, session_id)
+        pipe.get(vkey)
+        queue_extras(pipe)
+        results = pipe.execute()
+    serialized = session_class.read_result(results[0])
+    return None, serialized, _as_version(results[1]), ttl_from(results)
+
+def release(cache, session):
+    """
+    Puts ``session``'s state back in ``cache`` at the end of a request, if it
+    has a version and its data matches what is stored in Redis.
+    """
+    if session._invalidated or session.session_id is None:
+        return
+    state = session._session_state
+    if state.version is None or state.persisted is None:
+        return
+    if session.to_redis() != state.persisted:
+        # changed in place without being saved
+        return
+    cache.put(session.session_id, state.version, state,
+              _payload_size(state.persisted))
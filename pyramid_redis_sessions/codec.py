@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+
+"""
+A registry of codecs for serializing sessions, with a small header that
+records which codec encoded each payload.
+
+Every payload written by a registered codec starts with a two byte header:
+a ``\\x00`` marker followed by the codec's one byte tag. Reading a payload
+dispatches on that tag, so data written with different codecs can live side
+by side in Redis and you can switch codecs without flushing every session.
+Payloads without the header (for instance those written by earlier versions
+of `pyramid_redis_sessions`) are handed to a legacy deserializer, which
+defaults to ``cPickle.loads``.
+
+Built in codecs::
+
+    name      tag   notes
+    pickle    p     highest pickle protocol, any pickleable object
+    marshal   m     only builtin types, never constructs arbitrary objects
+    json      j     portable, but tuples come back as lists and keys as strings
+    msgpack   g     compact and fast, only if `msgpack` is installed
+
+To choose a codec, use the ``codec`` setting::
+
+    redis.sessions.codec = json
+
+You can register your own codec with ``register_codec``.
+
+Payloads can also be compressed with zlib, optionally with a preset
+dictionary trained from sample sessions (see ``train_dictionary``).
+Compressed payloads start with a ``\\x01`` marker instead of ``\\x00``,
+followed by the codec tag and the zlib stream. The zlib stream records the
+checksum of the dictionary it was compressed with, and the matching
+dictionary is looked up among those passed to ``register_dictionary``.
+"""
+
+from collections import defaultdict
+import json
+import marshal
+import struct
+import zlib
+
+from .compat import (
+    cPickle,
+    msgpack,
+    )
+
+
+MARKER = b'\x00'
+COMPRESSED_MARKER = b'\x01'
+
+_codecs_by_name = {}
+_codecs_by_tag = {}
+_dictionaries = {}
+
+
+class Codec(object):
+    def __init__(self, name, tag, dumps, loads):
+        self.name = name
+        self.tag = tag
+        self.dumps = dumps
+        self.loads = loads
+        self.header = MARKER + tag
+
+    def encode(self, obj):
+        return self.header + self.dumps(obj)
+
+
+def register_codec(name, tag, dumps, loads):
+    """
+    Registers a codec under ``name``. ``tag`` is a single byte (as a bytes
+    object) stored at the start of every payload the codec encodes, so it
+    must never change once data has been written with it.
+
+    ``dumps`` takes a python object and returns bytes, and ``loads`` is its
+    dual.
+    """
+    if not isinstance(tag, bytes) or len(tag) != 1:
+        raise ValueError('codec tag must be a single byte')
+    existing = _codecs_by_tag.get(tag)
+    if existing is not None and existing.name != name:
+        raise ValueError('codec tag %r is already used by %s' %
+                         (tag, existing.name))
+    codec = Codec(name, tag, dumps, loads)
+    _codecs_by_name[name] = codec
+    _codecs_by_tag[tag] = codec
+    return codec
+
+def get_codec(name):
+    """
+    Returns the registered codec called ``name``, or raises ``ValueError``.
+    """
+    try:
+        return _codecs_by_name[name]
+    except KeyError:
+        if name == 'msgpack':
+            raise ValueError('the msgpack codec requires the msgpack package')
+        raise ValueError('unknown codec: %s' % name)
+
+def encoder(name, compress_threshold=None, compress_level=6, zdict=None):
+    """
+    Returns a ``serialize`` function that encodes with the codec called
+    ``name`` and prefixes its header.
+
+    If ``compress_threshold`` is given, encoded payloads of at least that
+    many bytes are compressed with zlib at ``compress_level``, using the
+    preset dictionary ``zdict`` if given. Payloads that don't get smaller are
+    stored uncompressed.
+    """
+    codec = get_codec(name)
+    if compress_threshold is None:
+        return codec.encode
+    if zdict is not None:
+        register_dictionary(zdict)
+
+    compressed_header = COMPRESSED_MARKER + codec.tag
+
+    def encode(obj):
+        data = codec.dumps(obj)
+        if len(data) >= compress_threshold:
+            compressed = _compress(data, compress_level, zdict)
+            if len(compressed) < len(data):
+                return compressed_header + compressed
+        return codec.header + data
+
+    return encode
+
+def decode(payload, legacy=cPickle.loads):
+    """
+    Decodes ``payload`` with the codec named in its header, or with
+    ``legacy`` if it has no header.
+    """
+    marker = payload[:1]
+    if marker == MARKER:
+        return _codec_for_tag(payload[1:2]).loads(payload[2:])
+    if marker == COMPRESSED_MARKER:
+        codec = _codec_for_tag(payload[1:2])
+        return codec.loads(_decompress(payload[2:]))
+    return legacy(payload)
+
+def _codec_for_tag(tag):
+    try:
+        return _codecs_by_tag[tag]
+    except KeyError:
+        raise ValueError('unknown codec tag: %r' % tag)
+
+def decoder(legacy=cPickle.loads):
+    """
+    Returns a ``deserialize`` function that decodes payloads written by any
+    registered codec, and falls back to ``legacy`` for payloads without a
+    header.
+    """
+    def deserialize(payload):
+        return decode(payload, legacy)
+    return deserialize
+
+
+def register_dictionary(zdict):
+    """
+    Registers a zlib preset dictionary so that payloads compressed with it
+    can be decompressed. Keep old dictionaries registered for as long as
+    sessions compressed with them may still be in Redis.
+    """
+    _dictionaries[zlib.adler32(zdict) & 0xffffffff] = zdict
+
+def _compress(data, level, zdict):
+    if zdict is None:
+        compressor = zlib.compressobj(level)
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS,
+                                      9, zlib.Z_DEFAULT_STRATEGY, zdict)
+    return compressor.compress(data) + compressor.flush()
+
+def _decompress(data):
+    flags = bytearray(data[1:2])[0]
+    if flags & 0x20:
+        # FDICT is set, so the stream header is followed by the checksum of
+        # the preset dictionary
+        dictid = struct.unpack('>I', data[2:6])[0]
+        try:
+            zdict = _dictionaries[dictid]
+        except KeyError:
+            raise ValueError('unknown compression dictionary: %08x' % dictid)
+        decompressor = zlib.decompressobj(zlib.MAX_WBITS, zdict)
+    else:
+        decompressor = zlib.decompressobj()
+    return decompressor.decompress(data) + decompressor.flush()
+
+def train_dictionary(samples, size=16384, ngram=8):
+    """
+    Builds a zlib preset dictionary of up to ``size`` bytes from a list of
+    sample payloads (for instance, sessions encoded with the codec you use).
+
+    Substrings of ``ngram`` bytes that appear in more than one sample are
+    extended to the longest common run, ranked by how many bytes they would
+    save, and the most valuable ones are placed at the end of the dictionary
+    where zlib can reach them with the shortest distances.
+    """
+    counts = defaultdict(int)
+    for sample in samples:
+        seen = set()
+        for i in range(0, max(len(sample) - ngram + 1, 0)):
+            seen.add(sample[i:i + ngram])
+        for gram in seen:
+            counts[gram] += 1
+
+    common = set(gram for gram, count in counts.items() if count > 1)
+    segments = defaultdict(int)
+    for sample in samples:
+        i = 0
+        while i <= len(sample) - ngram:
+            if sample[i:i + ngram] not in common:
+                i += 1
+                continue
+            end = i + ngram
+            while end < len(sample) and \
+                    sample[end - ngram + 1:end + 1] in common:
+                end += 1
+            segments[sample[i:end]] += 1
+            i = end
+
+    ranked = sorted(segments.items(),
+                    key=lambda item: item[1] * len(item[0]),
+                    reverse=True)
+    chosen = []
+    total = 0
+    for segment, count in ranked:
+        if count < 2 or total + len(segment) > size:
+            continue
+        if any(segment in existing for existing in chosen):
+            continue
+        chosen.append(segment)
+        total += len(segment)
+    # most valuable last
+    return b''.join(reversed(chosen))
+
+
+def _pickle_dumps(obj):
+    return cPickle.dumps(obj, cPickle.HIGHEST_PROTOCOL)
+
+def _json_dumps(obj):
+    return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+def _json_loads(data):
+    return json.loads(data.decode('utf-8'))
+
+
+register_codec('pickle', b'p', _pickle_dumps, cPickle.loads)
+register_codec('marshal', b'm', marshal.dumps, marshal.loads)
+register_codec('json', b'j', _json_dumps, _json_loads)
+
+if msgpack is not None:
+    register_codec(
+        'msgpack',
+        b'g',
+        lambda obj: msgpack.packb(obj, use_bin_type=True),
+        lambda data: msgpack.unpackb(data, raw=False),
+        )
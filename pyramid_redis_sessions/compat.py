@@ -10,3 +10,9 @@ try:
 except ImportError: # pragma: no cover
     # python 3 pickle module
     import pickle as cPickle
+
+try:
+    import msgpack
+except ImportError: # pragma: no cover
+    # optional dependency for the msgpack codec
+    msgpack = None
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+
+"""
+Signed session cookie values.
+
+The ``compact`` format stores the session id's raw bytes and an
+HMAC-SHA256 of them, both url-safe base64 encoded and separated by a dot::
+
+    <base64 payload>.<base64 signature>
+
+Default ids (64 hex characters) are stored as the 32 bytes they encode, so
+a compact cookie is about 90 characters long instead of about 150 for the
+``legacy`` format. Verifying one is a single HMAC and a constant-time
+comparison, and nothing sent by the client is ever unpickled.
+
+The ``legacy`` format is the one written by ``pyramid.session``'s
+``signed_serialize`` (a pickled id with an HMAC-SHA1). It contains no dot,
+so values in both formats can be told apart and read side by side while
+cookies are being migrated::
+
+    redis.sessions.cookie_format = compact
+    # once every legacy cookie has expired
+    redis.sessions.cookie_accept_legacy = False
+"""
+
+import base64
+import binascii
+from collections import OrderedDict
+import hashlib
+import hmac
+import threading
+
+from pyramid.session import (
+    signed_deserialize,
+    signed_serialize,
+    )
+
+COOKIE_FORMATS = ('legacy', 'compact')
+
+# the first payload byte tells how the rest of it encodes the session id
+_HEX_ID = b'\x00'
+_TEXT_ID = b'\x01'
+
+
+def _to_bytes(value):
+    if isinstance(value, bytes):
+        return value
+    return value.encode('utf-8')
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+def _b64decode(value):
+    value = _to_bytes(value)
+    return base64.urlsafe_b64decode(value + b'=' * (-len(value) % 4))
+
+def _signature(payload, secret):
+    return hmac.new(_to_bytes(secret), payload, hashlib.sha256).digest()
+
+def _encode_id(session_id):
+    raw = _to_bytes(session_id)
+    if len(raw) % 2 == 0:
+        try:
+            decoded = binascii.unhexlify(raw)
+        except (TypeError, ValueError):
+            pass
+        else:
+            # only lowercase hex survives the round trip
+            if binascii.hexlify(decoded) == raw:
+                return _HEX_ID + decoded
+    return _TEXT_ID + raw
+
+def _decode_id(payload):
+    kind, raw = payload[:1], payload[1:]
+    if kind == _HEX_ID:
+        return binascii.hexlify(raw).decode('ascii')
+    if kind == _TEXT_ID:
+        return raw.decode('utf-8')
+    raise ValueError('unknown session id encoding')
+
+
+def serialize_cookie(session_id, secret, format='legacy'):
+    """
+    Returns the signed cookie value for ``session_id`` in ``format``
+    (``legacy`` or ``compact``). Compact cookies require string ids.
+    """
+    if format == 'compact':
+        payload = _encode_id(session_id)
+        return '%s.%s' % (_b64encode(payload),
+                          _b64encode(_signature(payload, secret)))
+    if format == 'legacy':
+        return signed_serialize(session_id, secret)
+    raise ValueError('cookie format must be legacy or compact')
+
+def deserialize_cookie(cookieval, secret, accept_legacy=True):
+    """
+    Returns the session id in the signed cookie value ``cookieval``, in
+    either format. Raises ``ValueError`` if it cannot be verified, or if it
+    is in the legacy format and ``accept_legacy`` is ``False``.
+    """
+    if '.' not in cookieval:
+        if not accept_legacy:
+            raise ValueError('legacy cookies are not accepted')
+        return signed_deserialize(cookieval, secret)
+    encoded, _, signature = cookieval.partition('.')
+    try:
+        payload = _b64decode(encoded)
+        signature = _b64decode(signature)
+    except (TypeError, ValueError):
+        raise ValueError('invalid cookie encoding')
+    if not hmac.compare_digest(signature, _signature(payload, secret)):
+        raise ValueError('invalid cookie signature')
+    return _decode_id(payload)
+
+
+class VerifiedCookieCache(object):
+    """
+    A thread safe LRU cache of cookie values that have already been
+    verified, mapped to their session ids, so that a client sending the
+    same cookie again skips the signature check. Only values that passed
+    verification are cached, and a value always maps to the same id, so
+    entries never go stale.
+
+    Parameters:
+
+    ``max_entries``
+    The maximum number of cookie values to keep. Default: ``1024``.
+    """
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, cookieval):
+        """Returns the session id of ``cookieval``, or ``None``."""
+        with self._lock:
+            session_id = self._entries.pop(cookieval, None)
+            if session_id is not None:
+                # most recently used entries are kept last
+                self._entries[cookieval] = session_id
+            return session_id
+
+    def put(self, cookieval, session_id):
+        with self._lock:
+            self._entries.pop(cookieval, None)
+            self._entries[cookieval] = session_id
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+
+"""
+The payload format of the ``framed`` storage layout, where each top-level
+session value is serialized on its own and the frames are stored in one
+Redis string behind an index of keys.
+
+Loading a framed session only parses the index. Each value is deserialized
+the first time it is read, so a request that only looks at the CSRF token
+doesn't pay for the large objects cached in the session. When the session
+is written back, values that were never read are copied over as they are,
+without being deserialized and serialized again.
+
+The layout is::
+
+    MAGIC
+    number of keys (4 bytes)
+    for each key: key length (2 bytes), key (UTF-8), frame length (4 bytes)
+    length of the metadata frame (4 bytes), metadata frame
+    the frames of the values, in the order of the keys
+
+with big-endian lengths. The metadata frame is ``serialize((created,
+timeout))``. Session keys must be strings.
+
+``decode`` reads both framed payloads and plain ones written by
+``serialize``, so switching a deployment from ``string`` to ``framed``
+storage keeps its sessions.
+"""
+
+from collections import OrderedDict
+import struct
+
+try:
+    from collections.abc import MutableMapping
+except ImportError: # pragma: no cover
+    from collections import MutableMapping
+
+from pyramid.compat import text_type
+
+MAGIC = b'\x02F'
+
+_COUNT = struct.Struct('>I')
+_KEY_LENGTH = struct.Struct('>H')
+_FRAME_LENGTH = struct.Struct('>I')
+
+
+class LazyDict(MutableMapping):
+    """
+    The ``managed_dict`` of a framed session. Values are deserialized from
+    their frames the first time they are read. Checking for a key, or
+    listing the keys, doesn't deserialize anything. Keys keep the order of
+    the payload, so a session that was only read encodes to the same bytes.
+    """
+
+    def __init__(self, frames, deserialize):
+        # key -> frame or value, in the order of the payload
+        self._entries = OrderedDict(frames)
+        # the keys whose entry is still a frame
+        self._unread = set(self._entries)
+        self._deserialize = deserialize
+
+    def __getitem__(self, key):
+        value = self._entries[key]
+        if key in self._unread:
+            value = self._entries[key] = self._deserialize(value.tobytes())
+            self._unread.discard(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self._entries[key] = value
+        self._unread.discard(key)
+
+    def __delitem__(self, key):
+        del self._entries[key]
+        self._unread.discard(key)
+
+    def __iter__(self):
+        return iter(list(self._entries))
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def clear(self):
+        self._entries = OrderedDict()
+        self._unread = set()
+
+    def copy(self):
+        return dict(self.items())
+
+    def __repr__(self):
+        return '<LazyDict %d keys, %d decoded>' % (
+            len(self), len(self) - len(self._unread))
+
+    def encoded_items(self, serialize):
+        """Yields each key with its frame, in order, serializing only the
+        values that have been read."""
+        for key, value in self._entries.items():
+            if key in self._unread:
+                # memoryview.tobytes, since bytes() of a memoryview is its
+                # repr on Python 2
+                yield key, value.tobytes()
+            else:
+                yield key, serialize(value)
+
+
+def encode_framed(persisted, serialize):
+    """
+    Converts the ``persisted`` dict (``managed_dict``, ``created`` and
+    ``timeout``) to a framed payload.
+    """
+    managed = persisted['managed_dict']
+    if isinstance(managed, LazyDict):
+        items = list(managed.encoded_items(serialize))
+    else:
+        items = [(key, serialize(value)) for key, value in managed.items()]
+    meta = serialize((persisted['created'], persisted['timeout']))
+    parts = [MAGIC, _COUNT.pack(len(items))]
+    for key, frame in items:
+        if not isinstance(key, text_type):
+            key = key.decode('utf-8') if isinstance(key, bytes) else None
+        if key is None:
+            raise TypeError('framed session keys must be strings')
+        key = key.encode('utf-8')
+        parts.append(_KEY_LENGTH.pack(len(key)))
+        parts.append(key)
+        parts.append(_FRAME_LENGTH.pack(len(frame)))
+    parts.append(_FRAME_LENGTH.pack(len(meta)))
+    parts.append(meta)
+    parts.extend(frame for _, frame in items)
+    return b''.join(parts)
+
+def decode(payload, deserialize):
+    """
+    Decodes a framed payload with ``decode_framed``, or a plain one with
+    ``deserialize``, with every value deserialized.
+    """
+    if not is_framed(payload):
+        return deserialize(payload)
+    persisted = decode_framed(payload, deserialize)
+    persisted['managed_dict'] = dict(persisted['managed_dict'].items())
+    return persisted
+
+def is_framed(payload):
+    """Returns whether ``payload`` is in the framed format."""
+    return payload[:len(MAGIC)] == MAGIC
+
+def decode_framed(payload, deserialize):
+    """
+    The dual of ``encode_framed``. Only the index and the metadata are
+    deserialized, and ``managed_dict`` is a ``LazyDict``.
+    """
+    if not is_framed(payload):
+        raise ValueError('not a framed session payload')
+    view = memoryview(payload)
+    offset = len(MAGIC)
+    count, = _COUNT.unpack_from(view, offset)
+    offset += _COUNT.size
+    index = []
+    for _ in range(count):
+        length, = _KEY_LENGTH.unpack_from(view, offset)
+        offset += _KEY_LENGTH.size
+        key = view[offset:offset + length].tobytes().decode('utf-8')
+        offset += length
+        length, = _FRAME_LENGTH.unpack_from(view, offset)
+        offset += _FRAME_LENGTH.size
+        index.append((key, length))
+    length, = _FRAME_LENGTH.unpack_from(view, offset)
+    offset += _FRAME_LENGTH.size
+    created, timeout = deserialize(view[offset:offset + length].tobytes())
+    offset += length
+    frames = []
+    for key, length in index:
+        frames.append((key, view[offset:offset + length]))
+        offset += length
+    return {
+        'managed_dict': LazyDict(frames, deserialize),
+        'created': created,
+        'timeout': timeout,
+        }
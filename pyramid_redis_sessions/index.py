@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+
+"""
+An index of the sessions of each user, for logging a user out everywhere
+and capping how many sessions a user can have.
+
+Enable it by naming the session key that holds the user id, such as the one
+Pyramid's ``SessionAuthenticationPolicy`` uses::
+
+    redis.sessions.user_key = auth.userid
+    redis.sessions.max_sessions_per_user = 5
+
+When a session is persisted with a different user id than it was loaded
+with, as happens when a user logs in or out, its id is moved to the index of
+the new user: a Redis sorted set of session ids, scored by the time they
+were added. Requests that don't change the user id don't touch the index.
+Invalidating a session removes it from its user's index.
+
+Then, after a password change::
+
+    from pyramid_redis_sessions.index import UserIndex
+
+    UserIndex(redis, 'auth.userid').invalidate_user(userid)
+
+deletes every session of ``userid``, at the cost of one round trip to find
+them and one to delete them, however many sessions there are in Redis.
+With ``max_sessions_per_user``, logging in evicts the user's oldest
+sessions beyond the limit.
+
+Sessions that expire are removed from the index the next time it is read
+or added to. Only sessions persisted after the index was enabled are in it.
+Each index expires along with the sessions in it: binding a session, and
+refreshing the expire time of a session that has a user, reset the expire
+time of its user's index to the session's timeout.
+"""
+
+import time
+
+from .cache import version_key
+
+
+def _text(value):
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    return value
+
+
+class UserIndex(object):
+    """
+    The per-user index of sessions stored in ``redis``.
+
+    Parameters:
+
+    ``redis``
+    A ``StrictRedis`` client, or a ``sharding.ShardedRedis``.
+
+    ``user_key``
+    The session key that holds the id of the user a session belongs to.
+
+    ``prefix``
+    The prefix of the key of each user's index. Default:
+    ``user_sessions:``.
+
+    ``max_sessions``
+    The number of sessions a user can have, or ``None`` for no limit.
+    Default: ``None``.
+    """
+
+    def __init__(self, redis, user_key, prefix='user_sessions:',
+                 max_sessions=None):
+        self.redis = redis
+        self.user_key = user_key
+        self.prefix = prefix
+        self.max_sessions = max_sessions
+
+    def key(self, userid):
+        """Returns the key of the index of ``userid``."""
+        return '%s%s' % (self.prefix, userid)
+
+    def bind(self, session_id, userid, previous=None, timeout=None):
+        """
+        Adds ``session_id`` to the index of ``userid``, after removing it
+        from the index of ``previous`` if given, and resets the expire time
+        of the index to ``timeout`` if given. Sessions that no longer exist
+        are removed from the index, and with ``max_sessions`` the oldest
+        sessions beyond it are deleted. Returns the ids of the deleted
+        sessions.
+        """
+        if previous is not None:
+            self.unbind(session_id, previous)
+        key = self.key(userid)
+        with self.redis.pipeline(transaction=False) as pipe:
+            pipe.zadd(key, {session_id: time.time()})
+            if timeout is not None:
+                pipe.expire(key, timeout)
+            pipe.zrange(key, 0, -1)
+            members = pipe.execute()[-1]
+        others = [sid for sid in map(_text, members) if sid != session_id]
+        if not others:
+            return []
+        live = self._existing(others)
+        stale = [sid for sid in others if sid not in live]
+        evicted = []
+        if self.max_sessions is not None:
+            # the newest sessions are at the end, next to this one
+            live = [sid for sid in others if sid in live]
+            evicted = live[:max(len(live) + 1 - self.max_sessions, 0)]
+        if evicted:
+            self._delete_sessions(evicted)
+        if stale or evicted:
+            self.redis.zrem(key, *(stale + evicted))
+        return evicted
+
+    def touch(self, userid, timeout):
+        """Resets the expire time of the index of ``userid``."""
+        self.redis.expire(self.key(userid), timeout)
+
+    def queue_touch(self, pipe, userid, timeout):
+        """Queues ``touch`` on a pipeline."""
+        pipe.expire(self.key(userid), timeout)
+
+    def unbind(self, session_id, userid):
+        """Removes ``session_id`` from the index of ``userid``."""
+        self.redis.zrem(self.key(userid), session_id)
+
+    def session_ids(self, userid):
+        """
+        Returns the ids of the sessions of ``userid``, oldest first,
+        removing the ones that no longer exist from the index.
+        """
+        key = self.key(userid)
+        members = [_text(sid) for sid in self.redis.zrange(key, 0, -1)]
+        if not members:
+            return []
+        live = self._existing(members)
+        stale = [sid for sid in members if sid not in live]
+        if stale:
+            self.redis.zrem(key, *stale)
+        return [sid for sid in members if sid in live]
+
+    def invalidate_user(self, userid):
+        """
+        Deletes every session of ``userid``, and its index. Returns the
+        number of session ids that were in the index.
+        """
+        key = self.key(userid)
+        members = [_text(sid) for sid in self.redis.zrange(key, 0, -1)]
+        if members:
+            self._delete_sessions(members)
+        self.redis.delete(key)
+        return len(members)
+
+    def _existing(self, session_ids):
+        """Returns the set of ``session_ids`` that exist, checking each
+        node once."""
+        # a ShardedRedis, possibly wrapped in a metrics.InstrumentedRedis
+        if getattr(self.redis, 'node_name', None) is not None:
+            groups = self.redis._group(session_ids)
+        else:
+            groups = [(self.redis, session_ids)]
+        existing = set()
+        for node, node_ids in groups:
+            with node.pipeline(transaction=False) as pipe:
+                for session_id in node_ids:
+                    pipe.exists(session_id)
+                results = pipe.execute()
+            existing.update(
+                session_id for session_id, found in zip(node_ids, results)
+                if found
+                )
+        return existing
+
+    def _delete_sessions(self, session_ids):
+        keys = []
+        for session_id in session_ids:
+            # along with the version counters of versioned sessions
+            keys.extend([session_id, version_key(session_id)])
+        self.redis.delete(*keys)
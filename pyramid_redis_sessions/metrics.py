@@ -0,0 +1,356 @@
+# -*- coding: utf-8 -*-
+
+"""
+Hooks for measuring what sessions cost.
+
+Pass an object implementing ``SessionMetrics`` as the ``metrics`` argument
+of ``RedisSessionFactory`` (or the dotted name of one as the
+``redis.sessions.metrics`` setting), and it is told about every Redis call,
+every payload serialized or deserialized, and every session that is started,
+loaded, persisted, refreshed or invalidated. Subclass ``SessionMetrics`` and
+override the methods you need, and forward the numbers to your metrics
+system (StatsD, Prometheus and the like)::
+
+    from pyramid_redis_sessions.metrics import SessionMetrics
+
+    class StatsdSessionMetrics(SessionMetrics):
+        def redis_call(self, commands, seconds, sent, received):
+            statsd.timing('sessions.redis', seconds * 1000)
+            statsd.incr('sessions.redis.commands', len(commands))
+
+        def session_started(self, new):
+            statsd.incr('sessions.new' if new else 'sessions.resumed')
+
+    session_metrics = StatsdSessionMetrics()
+
+``MetricsCollector`` is a ready made implementation that keeps counters and
+histograms in memory, for exporting periodically or inspecting in tests.
+
+Without ``metrics`` nothing is measured, and sessions pay no overhead.
+Listeners are called synchronously on the request's thread, so they should
+be quick and thread safe.
+"""
+
+from bisect import bisect_left
+import threading
+from timeit import default_timer
+
+from pyramid.compat import (
+    binary_type,
+    text_type,
+    )
+
+
+class SessionMetrics(object):
+    """
+    The listener interface. Every method does nothing, so subclasses only
+    need to implement the events they are interested in.
+    """
+
+    def redis_call(self, commands, seconds, sent, received):
+        """A round trip to Redis: a single command, or a pipeline.
+        ``commands`` is the list of command names, ``sent`` and ``received``
+        the approximate payload bytes of the arguments and results."""
+
+    def serialized(self, seconds, size):
+        """A payload of ``size`` bytes was serialized (one per field for
+        sessions stored as hashes)."""
+
+    def deserialized(self, seconds, size):
+        """A payload of ``size`` bytes was deserialized."""
+
+    def session_started(self, new):
+        """The factory returned a session for a request. ``new`` is ``False``
+        if it was resumed from a valid cookie."""
+
+    def loaded(self, seconds):
+        """A session was fetched from Redis."""
+
+    def persisted(self, seconds):
+        """A session was persisted (written, or only refreshed if it had not
+        changed)."""
+
+    def refreshed(self, seconds):
+        """A session's expire time was reset."""
+
+    def invalidated(self, seconds):
+        """A session was invalidated."""
+
+    def session_id_collision(self):
+        """A newly generated session id already existed, and another one is
+        being tried."""
+
+
+def timed(event):
+    """
+    Decorator for session methods that reports the time they take to the
+    ``event`` method of the session's ``metrics``, if it has any.
+    """
+    def decorator(wrapped):
+        def wrapped_timed(session, *arg, **kw):
+            metrics = session.metrics
+            if metrics is None:
+                return wrapped(session, *arg, **kw)
+            start = default_timer()
+            try:
+                return wrapped(session, *arg, **kw)
+            finally:
+                getattr(metrics, event)(default_timer() - start)
+        wrapped_timed.__name__ = wrapped.__name__
+        wrapped_timed.__doc__ = wrapped.__doc__
+        return wrapped_timed
+    return decorator
+
+
+def payload_size(value):
+    """
+    Returns the number of bytes in the strings contained in ``value``, an
+    approximation of its size on the wire.
+    """
+    if isinstance(value, (binary_type, text_type)):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(payload_size(k) + payload_size(v)
+                   for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sum(payload_size(v) for v in value)
+    return 0
+
+def timed_serializer(serialize, metrics):
+    """Wraps ``serialize`` to report its time and output size."""
+    def serialize_timed(data):
+        start = default_timer()
+        payload = serialize(data)
+        metrics.serialized(default_timer() - start, payload_size(payload))
+        return payload
+    return serialize_timed
+
+def timed_deserializer(deserialize, metrics):
+    """Wraps ``deserialize`` to report its time and input size."""
+    def deserialize_timed(payload):
+        start = default_timer()
+        data = deserialize(payload)
+        metrics.deserialized(default_timer() - start, payload_size(payload))
+        return data
+    return deserialize_timed
+
+
+# the Redis commands sessions send outside of pipelines, which are timed
+COMMANDS = frozenset([
+    'delete',
+    'evalsha',
+    'exists',
+    'expire',
+    'get',
+    'getex',
+    'hdel',
+    'hget',
+    'hgetall',
+    'hmget',
+    'hset',
+    'incr',
+    'mget',
+    'persist',
+    'pexpire',
+    'pfadd',
+    'pfcount',
+    'pttl',
+    'scan',
+    'script_load',
+    'set',
+    'ttl',
+    'type',
+    'zadd',
+    'zcount',
+    'zrange',
+    'zrem',
+    'zremrangebyscore',
+    'zscore',
+    ])
+
+
+class InstrumentedRedis(object):
+    """
+    Wraps a Redis client and reports each command in ``COMMANDS``, and each
+    pipeline, to ``metrics.redis_call``. Everything else, such as the
+    helpers of ``sharding.ShardedRedis``, is passed through untimed. The
+    wrapped client is ``redis``.
+    """
+
+    def __init__(self, redis, metrics):
+        self.redis = redis
+        self.metrics = metrics
+
+    def pipeline(self, *arg, **kw):
+        return InstrumentedPipeline(self.redis.pipeline(*arg, **kw),
+                                    self.metrics)
+
+    def __getattr__(self, name):
+        attr = getattr(self.redis, name)
+        if name not in COMMANDS or not callable(attr):
+            return attr
+        return _timed_call(attr, name, self.metrics)
+
+
+def _timed_call(command, name, metrics):
+    def call(*arg, **kw):
+        start = default_timer()
+        result = None
+        try:
+            result = command(*arg, **kw)
+            return result
+        finally:
+            metrics.redis_call([name], default_timer() - start,
+                               payload_size((arg, kw)), payload_size(result))
+    return call
+
+
+class InstrumentedPipeline(object):
+    """
+    The pipeline of an ``InstrumentedRedis``. Queued commands are reported
+    together when the pipeline is executed. Commands issued between
+    ``watch`` and ``multi`` run straight away, and are reported one by one.
+    """
+
+    def __init__(self, pipe, metrics):
+        self.pipe = pipe
+        self.metrics = metrics
+        self.immediate = False
+        self.queued = []
+        self.sent = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *arg):
+        return self.pipe.__exit__(*arg)
+
+    def watch(self, *keys):
+        self.immediate = True
+        return _timed_call(self.pipe.watch, 'watch', self.metrics)(*keys)
+
+    def multi(self):
+        self.immediate = False
+        return self.pipe.multi()
+
+    def execute(self, *arg, **kw):
+        queued, self.queued = self.queued, []
+        sent, self.sent = self.sent, 0
+        start = default_timer()
+        results = None
+        try:
+            results = self.pipe.execute(*arg, **kw)
+            return results
+        finally:
+            if queued:
+                self.metrics.redis_call(queued, default_timer() - start,
+                                        sent, payload_size(results))
+
+    def __getattr__(self, name):
+        attr = getattr(self.pipe, name)
+        if not callable(attr):
+            return attr
+        if self.immediate:
+            return _timed_call(attr, name, self.metrics)
+
+        def queue(*arg, **kw):
+            self.queued.append(name)
+            self.sent += payload_size((arg, kw))
+            return attr(*arg, **kw)
+        return queue
+
+
+class Histogram(object):
+    """
+    Counts observed values in buckets with the given upper bounds, plus one
+    for values above the last bound.
+    """
+
+    def __init__(self, bounds):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+
+# upper bounds of the collector's histogram buckets
+LATENCY_BOUNDS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                  0.25, 0.5, 1.0)
+SIZE_BOUNDS = (128, 512, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+
+class MetricsCollector(SessionMetrics):
+    """
+    Keeps counters and histograms of all events in memory.
+
+    ``counters`` maps ``round_trips``, ``commands``, ``bytes_sent``,
+    ``bytes_received``, ``sessions_new``, ``sessions_resumed`` and
+    ``session_id_collisions`` to their counts. ``histograms`` maps
+    ``redis_seconds``, ``serialize_seconds``, ``deserialize_seconds``,
+    ``payload_bytes``, ``load_seconds``, ``persist_seconds``,
+    ``refresh_seconds`` and ``invalidate_seconds`` to a ``Histogram``.
+    """
+
+    COUNTERS = ('round_trips', 'commands', 'bytes_sent', 'bytes_received',
+                'sessions_new', 'sessions_resumed', 'session_id_collisions')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.counters = dict((name, 0) for name in self.COUNTERS)
+            self.histograms = dict(
+                (name, Histogram(LATENCY_BOUNDS)) for name in (
+                    'redis_seconds', 'serialize_seconds',
+                    'deserialize_seconds', 'load_seconds', 'persist_seconds',
+                    'refresh_seconds', 'invalidate_seconds'))
+            self.histograms['payload_bytes'] = Histogram(SIZE_BOUNDS)
+
+    def _count(self, name, value=1):
+        with self._lock:
+            self.counters[name] += value
+
+    def _observe(self, name, value):
+        with self._lock:
+            self.histograms[name].observe(value)
+
+    def redis_call(self, commands, seconds, sent, received):
+        with self._lock:
+            self.counters['round_trips'] += 1
+            self.counters['commands'] += len(commands)
+            self.counters['bytes_sent'] += sent
+            self.counters['bytes_received'] += received
+            self.histograms['redis_seconds'].observe(seconds)
+
+    def serialized(self, seconds, size):
+        with self._lock:
+            self.histograms['serialize_seconds'].observe(seconds)
+            self.histograms['payload_bytes'].observe(size)
+
+    def deserialized(self, seconds, size):
+        self._observe('deserialize_seconds', seconds)
+
+    def session_started(self, new):
+        self._count('sessions_new' if new else 'sessions_resumed')
+
+    def loaded(self, seconds):
+        self._observe('load_seconds', seconds)
+
+    def persisted(self, seconds):
+        self._observe('persist_seconds', seconds)
+
+    def refreshed(self, seconds):
+        self._observe('refresh_seconds', seconds)
+
+    def invalidated(self, seconds):
+        self._observe('invalidate_seconds', seconds)
+
+    def session_id_collision(self):
+        self._count('session_id_collisions')
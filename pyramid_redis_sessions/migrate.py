@@ -0,0 +1,365 @@
+# -*- coding: utf-8 -*-
+
+"""
+Re-encodes the sessions stored in Redis with a new codec, in place, so that
+changing the ``codec`` or ``serialize`` setting doesn't log everyone out.
+
+Deploy the application with the new settings first. Sessions written by
+``codec.decoder`` (the ``deserialize`` used with any ``codec``) can be read
+whatever codec wrote them, so old and new payloads coexist while the
+migration runs. Then convert the old ones from the command line::
+
+    python -m pyramid_redis_sessions.migrate --url redis://localhost:6379/0 \\
+        --prefix session: --codec msgpack --processes 8 --rate 20000
+
+or from Python with ``migrate_sessions``. Keys are found with ``SCAN`` and
+converted a batch at a time: one round trip fetches the batch, the payloads
+are decoded and re-encoded in a worker process, and one round trip writes
+them back with the ``REPLACE_IF_EQUAL`` script. The script only replaces a
+payload that is still the one that was read, and keeps its time to live,
+so a request that writes a session in the meantime always wins. Those
+sessions are counted as conflicts; the request wrote them with the new
+settings anyway.
+
+``--rate`` limits the number of keys converted per second across all
+processes, to keep the load on a production server in check.
+``--dry-run`` only counts the sessions that would be converted. With
+``shards``, run the migration against each node.
+"""
+
+import argparse
+from functools import partial
+import multiprocessing
+import threading
+import time
+
+from . import codec as codecs
+from . import framing
+from . import scripts
+from .bulk import (
+    COMPANION_PREFIXES,
+    _fetched,
+    _queue_fetch,
+    scan_session_ids,
+    )
+
+
+class MigrationStats(object):
+    """
+    The number of sessions that were ``migrated``, already ``unchanged``
+    by re-encoding, written concurrently (``conflicts``) or gone
+    (``missing``) by the time they were converted.
+    """
+
+    FIELDS = ('migrated', 'unchanged', 'conflicts', 'missing')
+
+    def __init__(self, migrated=0, unchanged=0, conflicts=0, missing=0):
+        self.migrated = migrated
+        self.unchanged = unchanged
+        self.conflicts = conflicts
+        self.missing = missing
+
+    def add(self, other):
+        for name in self.FIELDS:
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+
+    @property
+    def total(self):
+        return sum(getattr(self, name) for name in self.FIELDS)
+
+    def __repr__(self):
+        return '<MigrationStats %s>' % ' '.join(
+            '%s=%d' % (name, getattr(self, name)) for name in self.FIELDS)
+
+
+class SessionMigrator(object):
+    """
+    Re-encodes batches of sessions in ``redis``.
+
+    Parameters:
+
+    ``redis``
+    A ``StrictRedis`` client.
+
+    ``serialize``
+    The new ``serialize`` function.
+
+    ``deserialize``
+    A function that reads the old payloads. Default: decoding any of the
+    built in codecs, with pickle for payloads without a codec header.
+
+    ``storage``
+    The ``storage`` setting of the session factory. Default: ``string``.
+
+    ``dry_run``
+    Boolean. If ``True``, nothing is written, and the sessions that would be
+    converted are counted as migrated. Default: ``False``.
+    """
+
+    def __init__(self, redis, serialize, deserialize=None, storage='string',
+                 dry_run=False):
+        if deserialize is None:
+            deserialize = codecs.decoder()
+        self.redis = redis
+        self.serialize = serialize
+        self.deserialize = deserialize
+        self.storage = storage
+        self.dry_run = dry_run
+        self._script_loaded = False
+
+    def _replacements(self, value):
+        """Returns a list of ``(field, value, replacement)`` for the
+        payloads of a session that change when re-encoded."""
+        if self.storage == 'hash':
+            payloads = value.items()
+        else:
+            payloads = [('', value)]
+        replacements = []
+        for field, payload in payloads:
+            if self.storage == 'framed':
+                # every frame is re-encoded
+                replacement = framing.encode_framed(
+                    framing.decode(payload, self.deserialize),
+                    self.serialize,
+                    )
+            else:
+                replacement = self.serialize(self.deserialize(payload))
+            if replacement != payload:
+                replacements.append((field, payload, replacement))
+        return replacements
+
+    def migrate(self, session_ids):
+        """
+        Re-encodes the sessions ``session_ids`` in two round trips, and
+        returns the ``MigrationStats`` of the batch.
+        """
+        stats = MigrationStats()
+        session_ids = list(session_ids)
+        if not session_ids:
+            return stats
+        with self.redis.pipeline(transaction=False) as pipe:
+            _queue_fetch(pipe, session_ids, self.storage)
+            values, _ = _fetched(pipe.execute(), session_ids, self.storage)
+
+        pending = []
+        for session_id, value in zip(session_ids, values):
+            if not value:
+                stats.missing += 1
+                continue
+            replacements = self._replacements(value)
+            if not replacements:
+                stats.unchanged += 1
+            elif self.dry_run:
+                stats.migrated += 1
+            else:
+                pending.append((session_id, replacements))
+        if not pending:
+            return stats
+
+        if not self._script_loaded:
+            self.redis.script_load(scripts.REPLACE_IF_EQUAL.source)
+            self._script_loaded = True
+        with self.redis.pipeline(transaction=False) as pipe:
+            for session_id, replacements in pending:
+                for field, value, replacement in replacements:
+                    scripts.queue_replace_if_equal(
+                        pipe, session_id, value, replacement, field)
+            results = iter(pipe.execute())
+        for session_id, replacements in pending:
+            outcomes = [int(next(results)) for _ in replacements]
+            if -1 in outcomes:
+                stats.missing += 1
+            elif 0 in outcomes:
+                stats.conflicts += 1
+            else:
+                stats.migrated += 1
+        return stats
+
+
+def _batches(session_ids, size):
+    batch = []
+    for session_id in session_ids:
+        batch.append(session_id)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def _throttled(batches, rate):
+    """Yields ``batches`` no faster than ``rate`` session ids per
+    second."""
+    start = time.time()
+    sent = 0
+    for batch in batches:
+        delay = start + sent / float(rate) - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        sent += len(batch)
+        yield batch
+
+def _bounded(batches, slots):
+    """Yields ``batches`` only while fewer than ``slots`` of them are being
+    converted, so that scanning doesn't run ahead of the workers."""
+    for batch in batches:
+        slots.acquire()
+        yield batch
+
+
+_worker_migrator = None
+
+def _init_worker(client_factory, serialize, deserialize, storage, dry_run):
+    global _worker_migrator
+    _worker_migrator = SessionMigrator(client_factory(), serialize,
+                                       deserialize, storage, dry_run)
+
+def _migrate_in_worker(session_ids):
+    return _worker_migrator.migrate(session_ids)
+
+
+def migrate_sessions(
+    client_factory,
+    serialize,
+    deserialize=None,
+    prefix='',
+    storage='string',
+    batch_size=500,
+    processes=1,
+    rate=None,
+    dry_run=False,
+    progress=None,
+    exclude_prefixes=COMPANION_PREFIXES,
+    ):
+    """
+    Re-encodes every session whose key starts with ``prefix`` with
+    ``serialize``, and returns the ``MigrationStats`` of the whole run.
+
+    ``client_factory`` is called without arguments to create a Redis client,
+    once for scanning and once in each worker process. With ``processes``
+    greater than one, batches are converted by a pool of that many
+    processes, which are forked so that ``serialize`` and ``deserialize``
+    can be any function. ``rate`` limits the number of sessions converted
+    per second, and ``progress`` is called with the running totals after
+    every batch. Keys starting with one of ``exclude_prefixes`` are skipped,
+    as with ``bulk.iter_sessions``. See ``SessionMigrator`` for the other
+    arguments.
+    """
+    scanner = client_factory()
+    session_ids = scan_session_ids(scanner, prefix, count=batch_size,
+                                   exclude_prefixes=exclude_prefixes)
+    batches = _batches(session_ids, batch_size)
+    if rate:
+        batches = _throttled(batches, rate)
+    total = MigrationStats()
+
+    if processes <= 1:
+        migrator = SessionMigrator(scanner, serialize, deserialize, storage,
+                                   dry_run)
+        results = (migrator.migrate(batch) for batch in batches)
+        pool = slots = None
+    else:
+        context = getattr(multiprocessing, 'get_context', None)
+        context = context('fork') if context else multiprocessing
+        pool = context.Pool(
+            processes,
+            initializer=_init_worker,
+            initargs=(client_factory, serialize, deserialize, storage,
+                      dry_run),
+            )
+        slots = threading.BoundedSemaphore(processes * 2)
+        results = pool.imap_unordered(_migrate_in_worker,
+                                      _bounded(batches, slots))
+    try:
+        for stats in results:
+            if slots is not None:
+                slots.release()
+            total.add(stats)
+            if progress is not None:
+                progress(total)
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    return total
+
+
+def main(argv=None):
+    from pyramid.path import DottedNameResolver
+    from redis import StrictRedis
+
+    parser = argparse.ArgumentParser(
+        description='Re-encode the sessions stored in Redis with a new codec.')
+    parser.add_argument('--url', default='redis://localhost:6379/0',
+                        help='the Redis server (default: %(default)s)')
+    parser.add_argument('--prefix', default='',
+                        help='the prefix setting of the session factory')
+    parser.add_argument('--exclude-prefix', action='append',
+                        help='skip keys with this prefix (default: the '
+                             'activity and user index keys)')
+    parser.add_argument('--storage', default='string',
+                        choices=['string', 'hash', 'framed'])
+    parser.add_argument('--codec', help='the new codec')
+    parser.add_argument('--compress-threshold', type=int)
+    parser.add_argument('--compress-level', type=int, default=6)
+    parser.add_argument('--serialize',
+                        help='the dotted name of a serialize function, '
+                             'instead of a codec')
+    parser.add_argument('--deserialize',
+                        help='the dotted name of the deserialize function '
+                             'of the old payloads without a codec header '
+                             '(default: pickle)')
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--processes', type=int, default=1)
+    parser.add_argument('--rate', type=float,
+                        help='the most sessions to convert per second')
+    parser.add_argument('--dry-run', action='store_true')
+    args = parser.parse_args(argv)
+
+    resolve = DottedNameResolver().maybe_resolve
+    if (args.codec is None) == (args.serialize is None):
+        parser.error('give one of --codec and --serialize')
+    if args.codec is not None:
+        try:
+            serialize = codecs.encoder(
+                args.codec,
+                compress_threshold=args.compress_threshold,
+                compress_level=args.compress_level,
+                )
+        except ValueError as e:
+            parser.error(str(e))
+    else:
+        serialize = resolve(args.serialize)
+    deserialize = None
+    if args.deserialize is not None:
+        deserialize = codecs.decoder(legacy=resolve(args.deserialize))
+
+    def report(stats):
+        print('%d sessions: %r' % (stats.total, stats))
+
+    reported = [time.time()]
+
+    def progress(stats):
+        # at most every ten seconds
+        now = time.time()
+        if now - reported[0] >= 10:
+            reported[0] = now
+            report(stats)
+
+    stats = migrate_sessions(
+        partial(StrictRedis.from_url, args.url),
+        serialize,
+        deserialize=deserialize,
+        prefix=args.prefix,
+        storage=args.storage,
+        batch_size=args.batch_size,
+        processes=args.processes,
+        rate=args.rate,
+        dry_run=args.dry_run,
+        progress=progress,
+        exclude_prefixes=args.exclude_prefix or COMPANION_PREFIXES,
+        )
+    report(stats)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+
+"""
+A pytest plugin providing the ``redis_recorder`` fixture and the
+``redis_budget`` marker. Enable it in your ``conftest.py``::
+
+    pytest_plugins = ['pyramid_redis_sessions.pytest_plugin']
+
+See :mod:`pyramid_redis_sessions.testing`.
+"""
+
+import pytest
+
+from .testing import RedisRecorder
+
+
+def pytest_configure(config):
+    config.addinivalue_line(
+        'markers',
+        'redis_budget(round_trips=None, commands=None, bytes=None): fail '
+        'the test if the clients wrapped by redis_recorder exceed the limits',
+        )
+
+
+@pytest.fixture
+def redis_recorder():
+    """
+    A ``RedisRecorder``. With a ``redis_budget`` marker, the calls recorded
+    during the test are checked against its limits once the test passes.
+    """
+    return RedisRecorder()
+
+
+@pytest.hookimpl(trylast=True)
+def pytest_runtest_call(item):
+    # runs after the test, and only if it passed, so that going over the
+    # budget fails the test rather than erroring in its teardown
+    marker = item.get_closest_marker('redis_budget')
+    recorder = getattr(item, 'funcargs', {}).get('redis_recorder')
+    if marker is not None and recorder is not None:
+        recorder.check(recorder.log, **marker.kwargs)
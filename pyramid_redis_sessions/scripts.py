@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+
+"""
+Lua scripts that run compound session operations atomically on the server,
+in a single round trip.
+
+Scripts are invoked with ``EVALSHA``. The first time a server answers
+``NOSCRIPT`` (because it has never seen the script, or was restarted), the
+script is registered with ``SCRIPT LOAD`` and called again.
+
+Enable them with::
+
+    redis.sessions.use_scripts = True
+
+``LOAD_SESSION``
+Loads a session and, in the same step, resets its expire time or fetches
+its remaining time to live, and reads its version. If the caller already
+has the current version cached, the payload is not sent back at all.
+
+``WRITE_IF_VERSION``
+Writes a versioned session only if its version is still the one it was
+loaded at, incrementing the version and resetting both expire times.
+
+``REPLACE_IF_EQUAL``
+Replaces a session's payload (or one field of a hash session) only if it is
+still the value it was read as, keeping its expire time. Used to re-encode
+sessions without overwriting concurrent writes, see
+:mod:`pyramid_redis_sessions.migrate`.
+"""
+
+from hashlib import sha1
+
+from redis.exceptions import NoScriptError
+
+from .util import to_binary
+
+
+class Script(object):
+    def __init__(self, source):
+        self.source = source
+        self.sha = sha1(to_binary(source)).hexdigest()
+
+    def __call__(self, redis, keys=(), args=()):
+        arg = [self.sha, len(keys)] + list(keys) + list(args)
+        try:
+            return redis.evalsha(*arg)
+        except NoScriptError:
+            redis.script_load(self.source)
+            return redis.evalsha(*arg)
+
+
+LOAD_SESSION = Script("""
+-- KEYS[1]: the session, KEYS[2]: its version counter (optional)
+-- ARGV[1]: 'hash' or 'string'
+-- ARGV[2]: timeout to reset the expire time to, or ''
+-- ARGV[3]: '1' to return the remaining time to live
+-- ARGV[4]: the version the caller has cached, or ''
+-- returns {payload, version, ttl, 1 if the cached version is current}
+local version = false
+if KEYS[2] then
+    version = redis.call('GET', KEYS[2])
+end
+local data = false
+local current = 0
+if version and version == ARGV[4] then
+    current = 1
+elseif ARGV[1] == 'hash' then
+    data = redis.call('HGETALL', KEYS[1])
+else
+    data = redis.call('GET', KEYS[1])
+end
+local ttl = false
+if ARGV[2] ~= '' then
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+    if KEYS[2] then
+        redis.call('EXPIRE', KEYS[2], ARGV[2])
+    end
+elseif ARGV[3] == '1' then
+    ttl = redis.call('TTL', KEYS[1])
+end
+return {data, version, ttl, current}
+""")
+
+WRITE_IF_VERSION = Script("""
+-- KEYS[1]: the session, KEYS[2]: its version counter
+-- ARGV[1]: the expected version ('' if there is none yet, '*' for any)
+-- ARGV[2]: the serialized session, ARGV[3]: its timeout
+-- returns the new version, or nil if the version has changed
+if ARGV[1] ~= '*' and (redis.call('GET', KEYS[2]) or '') ~= ARGV[1] then
+    return false
+end
+redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+local version = redis.call('INCR', KEYS[2])
+redis.call('EXPIRE', KEYS[2], ARGV[3])
+return version
+""")
+
+REPLACE_IF_EQUAL = Script("""
+-- KEYS[1]: the session
+-- ARGV[1]: the hash field to replace, or '' for a string session
+-- ARGV[2]: the value it must still have, ARGV[3]: its replacement
+-- returns 1 if replaced, 0 if the value has changed, -1 if it is gone
+local current
+if ARGV[1] == '' then
+    current = redis.call('GET', KEYS[1])
+else
+    current = redis.call('HGET', KEYS[1], ARGV[1])
+end
+if not current then
+    return -1
+end
+if current ~= ARGV[2] then
+    return 0
+end
+if ARGV[1] ~= '' then
+    redis.call('HSET', KEYS[1], ARGV[1], ARGV[3])
+    return 1
+end
+local ttl = redis.call('PTTL', KEYS[1])
+if ttl > 0 then
+    redis.call('SET', KEYS[1], ARGV[3], 'PX', ttl)
+else
+    redis.call('SET', KEYS[1], ARGV[3])
+end
+return 1
+""")
+
+
+def _text(value):
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    return value
+
+def load_session(
+    redis,
+    session_id,
+    storage='string',
+    version_key=None,
+    touch_timeout=None,
+    with_ttl=False,
+    cached_version=None,
+    ):
+    """
+    Runs ``LOAD_SESSION`` and returns a ``(data, version, ttl, current)``
+    tuple. ``data`` is the payload (a dict of fields for hash sessions), or
+    ``None`` if the session does not exist or ``current`` is ``True``.
+    ``current`` tells whether ``cached_version`` is the session's version.
+    """
+    keys = [session_id]
+    if version_key is not None:
+        keys.append(version_key)
+    data, version, ttl, current = LOAD_SESSION(redis, keys, [
+        storage,
+        '' if touch_timeout is None else touch_timeout,
+        '1' if with_ttl else '',
+        '' if cached_version is None else cached_version,
+        ])
+    if storage == 'hash' and data is not None:
+        # HGETALL returns a flat list of fields and values to Lua
+        data = dict(zip([_text(f) for f in data[::2]], data[1::2])) or None
+    if version is not None:
+        version = int(version)
+    return data, version, ttl, bool(current)
+
+def write_if_version(redis, session_id, version_key, value, timeout,
+                     expected=None, force=False):
+    """
+    Runs ``WRITE_IF_VERSION`` and returns the new version, or ``None`` if
+    the session's version is no longer ``expected``. With ``force``, the
+    session is written whatever its version.
+    """
+    if force:
+        expected = '*'
+    elif expected is None:
+        expected = ''
+    version = WRITE_IF_VERSION(redis, [session_id, version_key],
+                               [expected, value, timeout])
+    return None if version is None else int(version)
+
+def queue_replace_if_equal(pipe, session_id, value, replacement, field=''):
+    """
+    Queues ``REPLACE_IF_EQUAL`` on a pipeline. The script must already be
+    loaded on the server, as pipelines can't recover from ``NOSCRIPT``.
+    """
+    pipe.evalsha(REPLACE_IF_EQUAL.sha, 1, session_id, field, value,
+                 replacement)
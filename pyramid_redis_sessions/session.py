@@ -2,14 +2,26 @@
 
 import binascii
 import os
+import time
 
 from pyramid.compat import text_
 from pyramid.decorator import reify
 from pyramid.interfaces import ISession
 from zope.interface import implementer
 
+from .backend import RedisBackend
 from .compat import cPickle
+from .cache import version_key
+from .framing import (
+    decode_framed,
+    encode_framed,
+    is_framed,
+    )
+from . import scripts
+from .metrics import timed
 from .util import (
+    PY3,
+    _on_one_node,
     persist,
     refresh,
     to_unicode,
@@ -17,93 +29,50 @@ from .util import (
 
 
 class _SessionState(object):
-    def __init__(self, session_id, managed_dict, created, timeout, new):
+    def __init__(self, session_id, managed_dict, created, timeout, new,
+                 persisted=None):
         self.session_id = session_id
         self.managed_dict = managed_dict
         self.created = created
         self.timeout = timeout
         self.new = new
+        # the serialized data as last read from or written to Redis
+        self.persisted = persisted
+        # the version of the session in Redis, for versioned sessions
+        self.version = None
+        # the user the session is indexed under, see index.UserIndex
+        self.owner = None
 
 
-@implementer(ISession)
-class RedisSession(object):
+class _SessionDict(object):
     """
-    Implements the Pyramid ISession and IDict interfaces and is returned by
-    the ``RedisSessionFactory``.
-
-    Methods that modify the ``dict`` (get, set, update, etc.) are decorated
-    with ``@persist`` to update the persisted copy in Redis and reset the
-    timeout.
-
-    Methods that are read-only (items, keys, values, etc.) are decorated
-    with ``@refresh`` to reset the session's expire time in Redis.
-
-    Session methods make use of the dict methods that already communicate with
-    Redis, so they are not decorated.
-
-    Parameters:
-
-    ``redis``
-    A Redis connection object.
-
-    ``session_id``
-    A unique string associated with the session. Used as a prefix for keys
-    and hashes associated with the session.
-
-    ``new``
-    Boolean. Whether this session is new (whether it was created in this
-    request).
-
-    ``new_session``
-    A function that takes no arguments. It should insert a new session into
-    Redis under a new session_id, and return that session_id.
-
-    ``serialize``
-    A function to serialize pickleable Python objects. Default:
-    ``cPickle.dumps``.
-
-    ``deserialize``
-    The dual of ``serialize``, to convert serialized strings back to Python
-    objects. Default: ``cPickle.loads``.
+    The dict methods, change tracking and payload format shared by
+    ``RedisSession`` and ``aio.AsyncRedisSession``, which add the methods
+    that talk to Redis. Sessions that aren't in write-back mode or don't
+    defer refreshes must provide ``do_persist`` and ``do_refresh``.
     """
 
-    def __init__(
-        self,
-        redis,
-        session_id,
-        new,
-        new_session,
-        serialize=cPickle.dumps,
-        deserialize=cPickle.loads
-        ):
-
-        self.redis = redis
-        self.serialize = serialize
-        self.deserialize = deserialize
-        self._new_session = new_session
-        self._session_state = self._make_session_state(
-            session_id=session_id,
-            new=new,
-            )
-
-    @reify
-    def _session_state(self):
-        return self._make_session_state(
-            session_id=self._new_session(),
-            new=True,
-            )
-
-    def _make_session_state(self, session_id, new):
-        persisted = self.from_redis(session_id=session_id)
-        # self.from_redis needs to take a session_id here, because otherwise it
-        # would look up self.session_id, which is not ready yet as
-        # session_state has not been created yet.
+    # the storage layout, as named by the ``storage`` setting
+    storage = 'string'
+
+    def _make_session_state(self, session_id, new, serialized=None):
+        if session_id is None:
+            # not stored yet, see do_persist
+            return _SessionState(
+                session_id=None,
+                managed_dict={},
+                created=time.time(),
+                timeout=self.default_timeout,
+                new=new,
+                )
+        persisted = self._decode(serialized)
         return _SessionState(
             session_id=session_id,
             managed_dict=persisted['managed_dict'],
             created=persisted['created'],
             timeout=persisted['timeout'],
             new=new,
+            persisted=serialized,
             )
 
     @property
@@ -139,51 +108,70 @@ class RedisSession(object):
             'timeout': self.timeout,
             })
 
-    def from_redis(self, session_id=None):
-        """Get and deserialize the persisted data for this session from Redis.
-        """
-        persisted = self.redis.get(session_id or self.session_id)
-        deserialized = self.deserialize(persisted)
-        return deserialized
+    def _decode(self, serialized):
+        return self.deserialize(serialized)
 
-    def invalidate(self):
-        """Invalidate the session."""
-        self.redis.delete(self.session_id)
-        del self._session_state
-        # Delete the self._session_state attribute so that direct access to or
-        # indirect access via other methods and properties to .session_id,
-        # .managed_dict, .created, .timeout and .new (i.e. anything stored in
-        # self._session_state) after this will trigger the creation of a new
-        # session with a new session_id.
+    @classmethod
+    def queue_read(cls, pipe, session_id):
+        """Queue the command that reads ``session_id`` on a pipeline."""
+        pipe.get(session_id)
+
+    @classmethod
+    def read_result(cls, result):
+        """Convert the result of the command queued by ``queue_read`` to the
+        ``serialized`` constructor argument, or ``None`` if the session does
+        not exist."""
+        return result
+
+    def _mark_changed(self, *keys):
+        """Record which top-level keys a mutation changed, for storage
+        layouts that can write them individually."""
+        self._changed_keys.update(keys)
+
+    def _reset_changes(self):
+        self._dirty = False
+        self._touched = False
+        self._changed_keys = set()
+        self._rewrite = False
 
     # dict modifying methods decorated with @persist
     @persist
     def __delitem__(self, key):
         del self.managed_dict[key]
+        self._mark_changed(key)
 
     @persist
     def __setitem__(self, key, value):
         self.managed_dict[key] = value
+        self._mark_changed(key)
 
     @persist
     def setdefault(self, key, default=None):
+        if key not in self.managed_dict:
+            self._mark_changed(key)
         return self.managed_dict.setdefault(key, default)
 
     @persist
     def clear(self):
+        self._rewrite = True
         return self.managed_dict.clear()
 
     @persist
     def pop(self, key, default=None):
+        self._mark_changed(key)
         return self.managed_dict.pop(key, default)
 
     @persist
     def update(self, other):
+        other = dict(other)
+        self._mark_changed(*other)
         return self.managed_dict.update(other)
 
     @persist
     def popitem(self):
-        return self.managed_dict.popitem()
+        item = self.managed_dict.popitem()
+        self._mark_changed(item[0])
+        return item
 
     # dict read-only methods decorated with @refresh
     @refresh
@@ -245,9 +233,11 @@ class RedisSession(object):
     @persist
     def changed(self):
         """ Persist all the data that needs to be persisted for this session
-        immediately with ``@persist``.
+        with ``@persist`` (immediately, or at the end of the request in
+        write-back mode).
         """
-        pass
+        # we can't tell which mutable value changed
+        self._rewrite = True
 
     # session methods persist or refresh using above dict methods
     def new_csrf_token(self):
@@ -267,7 +257,8 @@ class RedisSession(object):
         storage = self.setdefault('_f_' + queue, [])
         if allow_duplicate or (msg not in storage):
             storage.append(msg)
-            self.changed()  # notify redis of change to ``storage`` mutable
+            # notify redis of change to ``storage`` mutable
+            self['_f_' + queue] = storage
 
     def peek_flash(self, queue=''):
         storage = self.get('_f_' + queue, [])
@@ -295,3 +286,668 @@ class RedisSession(object):
         place.
         """
         return '_session_state' not in self.__dict__
+
+
+@implementer(ISession)
+class RedisSession(_SessionDict):
+    """
+    Implements the Pyramid ISession and IDict interfaces and is returned by
+    the ``RedisSessionFactory``.
+
+    Methods that modify the ``dict`` (get, set, update, etc.) are decorated
+    with ``@persist`` to update the persisted copy in Redis and reset the
+    timeout. In write-back mode they only mark the session as dirty, and the
+    factory writes it once with ``do_persist`` at the end of the request.
+
+    Methods that are read-only (items, keys, values, etc.) are decorated
+    with ``@refresh`` to reset the session's expire time in Redis. If
+    refreshes are deferred they only mark the session as touched, and the
+    factory resets the expire time with ``do_refresh`` at the end of the
+    request.
+
+    Session methods make use of the dict methods that already communicate with
+    Redis, so they are not decorated.
+
+    Parameters:
+
+    ``redis``
+    A Redis connection object.
+
+    ``session_id``
+    A unique string associated with the session. Used as a prefix for keys
+    and hashes associated with the session. ``None`` for a new session that
+    should only be created in Redis once something is stored in it.
+
+    ``new``
+    Boolean. Whether this session is new (whether it was created in this
+    request).
+
+    ``new_session``
+    A function that takes no arguments. It should insert a new session into
+    Redis under a new session_id, and return that session_id. For lazily
+    created sessions it is called with ``timeout`` and ``value`` (the
+    serialized session) keyword arguments instead.
+
+    ``serialize``
+    A function to serialize pickleable Python objects. Default:
+    ``cPickle.dumps``.
+
+    ``deserialize``
+    The dual of ``serialize``, to convert serialized strings back to Python
+    objects. Default: ``cPickle.loads``.
+
+    ``write_back``
+    Boolean. If ``True``, mutations only mark the session as dirty instead of
+    writing to Redis immediately. Default: ``False``.
+
+    ``defer_refresh``
+    Boolean. If ``True``, read-only methods only mark the session as touched
+    instead of resetting its expire time immediately. Default: ``False``.
+
+    ``lazy_create``
+    Boolean. If ``True``, a new session created after ``invalidate`` is kept
+    in memory until something is stored in it. Default: ``False``.
+
+    ``timeout``
+    The timeout for sessions that have not been created in Redis yet.
+    Default: ``1200``.
+
+    ``serialized``
+    The serialized session data, if the caller already fetched it from Redis
+    while checking that ``session_id`` exists. Saves looking it up again.
+    Default: ``None``.
+
+    ``versioned``
+    Boolean. If ``True``, every write also increments a version counter kept
+    in Redis next to the session, which lets a process-local cache tell
+    whether its copy is current. Default: ``False``.
+
+    ``version``
+    The version of ``serialized``, for versioned sessions. Default: ``None``.
+
+    ``state``
+    A session state taken from a process-local cache, used instead of
+    ``serialized``. Default: ``None``.
+
+    ``scripted``
+    Boolean. If ``True``, versioned sessions are written with a server-side
+    script that only writes if the session is still at the version it was
+    loaded at. If another request wrote it in the meantime, the keys changed
+    in this request are applied on top of that write instead of overwriting
+    it. Default: ``False``.
+
+    ``metrics``
+    A ``metrics.SessionMetrics`` listener that is told how long loading,
+    persisting, refreshing and invalidating this session take.
+    Default: ``None``.
+
+    ``backend``
+    A ``backend.SessionBackend`` that stores the session instead of
+    ``redis``, which is then unused. Versioned sessions always use
+    ``redis``. Default: a ``backend.RedisBackend`` for ``redis``.
+
+    ``user_index``
+    An ``index.UserIndex`` that this session is added to when it is
+    persisted with a different user id than it was loaded with, and
+    removed from when it is invalidated. Default: ``None``.
+    """
+
+    def __init__(
+        self,
+        redis,
+        session_id,
+        new,
+        new_session,
+        serialize=cPickle.dumps,
+        deserialize=cPickle.loads,
+        write_back=False,
+        defer_refresh=False,
+        lazy_create=False,
+        timeout=1200,
+        serialized=None,
+        versioned=False,
+        version=None,
+        state=None,
+        scripted=False,
+        metrics=None,
+        backend=None,
+        user_index=None,
+        ):
+
+        self.redis = redis
+        self.user_index = user_index
+        if backend is not None:
+            self.backend = backend
+        self.metrics = metrics
+        self.serialize = serialize
+        self.deserialize = deserialize
+        self.write_back = write_back
+        self.defer_refresh = defer_refresh
+        self.lazy_create = lazy_create
+        self.default_timeout = timeout
+        self.versioned = versioned
+        self.scripted = scripted
+        self._dirty = False
+        self._touched = False
+        self._changed_keys = set()
+        self._rewrite = False
+        # whether this session was written to Redis since it was loaded
+        self.written = False
+        self._new_session = new_session
+        if state is None:
+            state = self._make_session_state(
+                session_id=session_id,
+                new=new,
+                serialized=serialized,
+                )
+            state.version = version
+        self._session_state = state
+
+    @reify
+    def backend(self):
+        return RedisBackend(self.redis)
+
+    @reify
+    def _session_state(self):
+        if self.lazy_create:
+            return self._make_session_state(session_id=None, new=True)
+        return self._make_session_state(
+            session_id=self._new_session(),
+            new=True,
+            )
+
+    def _make_session_state(self, session_id, new, serialized=None):
+        if session_id is not None and serialized is None:
+            serialized = self._fetch(session_id)
+        # self._fetch needs to take a session_id here, because otherwise it
+        # would look up self.session_id, which is not ready yet as
+        # session_state has not been created yet.
+        state = _SessionDict._make_session_state(
+            self, session_id, new, serialized)
+        if self.user_index is not None:
+            state.owner = state.managed_dict.get(self.user_index.user_key)
+        return state
+
+    @timed('loaded')
+    def from_redis(self, session_id=None):
+        """Get and deserialize the persisted data for this session from Redis.
+        """
+        return self._decode(self._fetch(session_id or self.session_id))
+
+    def _fetch(self, session_id):
+        return self.backend.load(session_id)
+
+    @classmethod
+    def load(cls, redis, session_id, touch_timeout=None, with_ttl=False):
+        """Fetch the serialized data for ``session_id`` from Redis in a single
+        round trip, for passing to the constructor as ``serialized``.
+
+        Returns a ``(serialized, ttl)`` tuple. ``serialized`` is ``None`` if
+        the session does not exist. The expire time is reset to
+        ``touch_timeout`` if it is given, and ``ttl`` is the remaining time
+        to live if ``with_ttl`` is ``True`` (otherwise ``None``).
+        """
+        if touch_timeout is not None:
+            return redis.getex(session_id, ex=touch_timeout), None
+        if with_ttl:
+            with redis.pipeline(transaction=False) as pipe:
+                pipe.get(session_id)
+                pipe.ttl(session_id)
+                serialized, ttl = pipe.execute()
+            return serialized, ttl
+        return redis.get(session_id), None
+
+    @classmethod
+    def queue_load(cls, pipe, session_id, touch_timeout=None,
+                   with_ttl=False):
+        """Queue the commands of ``load`` on a pipeline, to run them in the
+        same round trip as other commands. Pass the first results to
+        ``load_result``."""
+        if touch_timeout is not None:
+            pipe.getex(session_id, ex=touch_timeout)
+        else:
+            cls.queue_read(pipe, session_id)
+            if with_ttl:
+                pipe.ttl(session_id)
+
+    @classmethod
+    def load_result(cls, results, touch_timeout=None, with_ttl=False):
+        """Convert the results of the commands queued by ``queue_load`` to
+        the ``(serialized, ttl)`` tuple returned by ``load``."""
+        ttl = results[1] if with_ttl and touch_timeout is None else None
+        return cls.read_result(results[0]), ttl
+
+    @timed('persisted')
+    def do_persist(self):
+        """Write the data that needs to be persisted for this session to Redis
+        and reset its expire time, in a single ``SET`` command.
+
+        If the serialized session is identical to what was last read from or
+        written to Redis, the write is skipped and only the expire time is
+        reset (immediately, or at the end of the request if refreshes are
+        deferred).
+        """
+        if self.session_id is None:
+            # first write to a lazily created session
+            value = self.to_redis()
+            self._session_state.session_id = self._new_session(
+                timeout=self.timeout,
+                value=value,
+                )
+            self._session_state.persisted = value
+        elif not self._write_changes():
+            self._dirty = False
+            self._changed_keys = set()
+            self._rewrite = False
+            # nothing changed, so the write only needs to reset the expire
+            # time like a read would
+            if self.defer_refresh:
+                self._touched = True
+            else:
+                self.do_refresh()
+            return
+        self._reset_changes()
+        self.written = True
+        self._update_index()
+
+    def persist_if_changed(self):
+        """Write this session to Redis if its serialized data differs from
+        what was last read from or written to Redis. This catches changes to
+        mutable values that were made in place without calling ``changed``.
+        Returns ``True`` if anything was written.
+        """
+        if self.session_id is None:
+            # lazily created sessions have nothing in Redis to compare with
+            return False
+        self._rewrite = True
+        if self._write_changes():
+            self._reset_changes()
+            self.written = True
+            self._update_index()
+            return True
+        self._rewrite = False
+        return False
+
+    def _write_changes(self):
+        """Write the session if it changed, and return whether it did."""
+        value = self.to_redis()
+        if value == self._session_state.persisted:
+            return False
+        if self.versioned and self.scripted:
+            self._write_if_version(value)
+            return True
+        if self.versioned:
+            with self.redis.pipeline() as pipe:
+                pipe.set(self.session_id, value, ex=self.timeout)
+                self._execute_write(pipe)
+        else:
+            self.backend.save(self.session_id, value, self.timeout)
+        self._session_state.persisted = value
+        return True
+
+    def _write_if_version(self, value, attempts=3):
+        """Write ``value`` if the session is still at the version it was
+        loaded at. Otherwise merge the keys changed in this request into
+        the current session and try again, and finally write regardless."""
+        state = self._session_state
+        key = version_key(self.session_id)
+        for attempt in range(attempts):
+            version = scripts.write_if_version(
+                self.redis,
+                self.session_id,
+                key,
+                value,
+                self.timeout,
+                expected=state.version,
+                force=attempt == attempts - 1,
+                )
+            if version is not None:
+                break
+            self._merge_current(key)
+            value = self.to_redis()
+        state.version = version
+        state.persisted = value
+
+    def _merge_current(self, key):
+        """Apply the keys changed in this request to the session as it is
+        currently stored in Redis."""
+        state = self._session_state
+        changed_keys = self._merge_keys()
+        serialized, version, _, _ = scripts.load_session(
+            self.redis,
+            self.session_id,
+            version_key=key,
+            )
+        state.version = version
+        if serialized is None:
+            # expired since it was loaded, so there is nothing to merge
+            return
+        current = self._decode(serialized)['managed_dict']
+        for changed in changed_keys:
+            if changed in state.managed_dict:
+                current[changed] = state.managed_dict[changed]
+            else:
+                current.pop(changed, None)
+        state.managed_dict = current
+        state.persisted = serialized
+
+    def _merge_keys(self):
+        """Returns the keys this request changed. After ``clear``,
+        ``changed`` or ``persist_if_changed`` the changes can't be tracked
+        per key, so they are all the keys that differ from the session as it
+        was loaded."""
+        if not self._rewrite:
+            return self._changed_keys
+        ours = self.managed_dict
+        if self._session_state.persisted is None:
+            return set(ours)
+        loaded = self._decode(self._session_state.persisted)['managed_dict']
+        return set(
+            key for key in set(loaded) | set(ours)
+            if key not in loaded or key not in ours or loaded[key] != ours[key]
+            )
+
+    def _execute_write(self, pipe):
+        """Execute a pipeline of writes to this session, incrementing its
+        version in the same transaction if it is versioned."""
+        if not self.versioned:
+            return pipe.execute()
+        key = version_key(self.session_id)
+        pipe.incr(key)
+        pipe.expire(key, self.timeout)
+        results = pipe.execute()
+        self._session_state.version = int(results[-2])
+        return results
+
+    def _update_index(self):
+        """Move this session to the index of the user it now belongs to,
+        if that changed since it was loaded or last persisted."""
+        index = self.user_index
+        if index is None:
+            return
+        state = self._session_state
+        owner = self.managed_dict.get(index.user_key)
+        if owner == state.owner:
+            return
+        if owner is None:
+            index.unbind(self.session_id, state.owner)
+        else:
+            index.bind(self.session_id, owner, previous=state.owner,
+                       timeout=self.timeout)
+        state.owner = owner
+
+    @timed('refreshed')
+    def do_refresh(self):
+        """Reset the expire time for this session's key in Redis."""
+        owner = None
+        if self.user_index is not None and self.session_id is not None:
+            owner = self._session_state.owner
+        if self.session_id is None:
+            pass
+        elif self.versioned or owner is not None:
+            # the index lives as long as the sessions of its user
+            index_key = None if owner is None else self.user_index.key(owner)
+            queue_index = index_key is not None and _on_one_node(
+                self.redis, [self.session_id, index_key])
+            with self.redis.pipeline(transaction=False) as pipe:
+                pipe.expire(self.session_id, self.timeout)
+                if self.versioned:
+                    pipe.expire(version_key(self.session_id), self.timeout)
+                if queue_index:
+                    self.user_index.queue_touch(pipe, owner, self.timeout)
+                pipe.execute()
+            if index_key is not None and not queue_index:
+                self.user_index.touch(owner, self.timeout)
+        else:
+            self.backend.touch(self.session_id, self.timeout)
+        self._touched = False
+
+    @timed('invalidated')
+    def invalidate(self):
+        """Invalidate the session."""
+        if self.session_id is None:
+            pass
+        elif self.versioned:
+            self.redis.delete(self.session_id, version_key(self.session_id))
+        else:
+            self.backend.delete(self.session_id)
+        owner = self._session_state.owner
+        if owner is not None:
+            self.user_index.unbind(self.session_id, owner)
+        del self._session_state
+        # any pending writes belonged to the session we just deleted
+        self._reset_changes()
+        # Delete the self._session_state attribute so that direct access to or
+        # indirect access via other methods and properties to .session_id,
+        # .managed_dict, .created, .timeout and .new (i.e. anything stored in
+        # self._session_state) after this will trigger the creation of a new
+        # session with a new session_id.
+
+    def rotate(self):
+        """Move this session's data to a new session id and delete the old
+        one, in a single transaction. Call it when a user logs in, so that a
+        session id obtained before then is useless. Returns the new id."""
+        old_id = self.session_id
+        if old_id is None:
+            # nothing stored yet, so nothing to move
+            return None
+        replace = [old_id]
+        if self.versioned:
+            replace.append(version_key(old_id))
+        value = self.to_redis()
+        state = self._session_state
+        state.session_id = self._new_session(
+            timeout=self.timeout,
+            value=value,
+            replace=replace,
+            )
+        state.persisted = value
+        state.version = None
+        state.new = True
+        self._reset_changes()
+        self.written = True
+        if state.owner is not None:
+            # the old id is gone, and the new one is indexed below
+            self.user_index.unbind(old_id, state.owner)
+            state.owner = None
+        self._update_index()
+        return state.session_id
+
+
+
+def _hash_field(key):
+    return 'k:' + key
+
+def encode_hash_fields(persisted, serialize):
+    """
+    Converts the ``persisted`` dict (``managed_dict``, ``created`` and
+    ``timeout``) to a mapping of Redis hash fields, with each top-level
+    session key and each of ``created`` and ``timeout`` serialized as its own
+    field.
+    """
+    fields = dict(
+        (_hash_field(key), serialize(value))
+        for key, value in persisted['managed_dict'].items()
+        )
+    fields['created'] = serialize(persisted['created'])
+    fields['timeout'] = serialize(persisted['timeout'])
+    return fields
+
+def _text_fields(fields):
+    if not PY3:
+        return fields
+    return dict(
+        (field.decode('utf-8') if isinstance(field, bytes) else field, value)
+        for field, value in fields.items()
+        )
+
+def decode_hash_fields(fields, deserialize):
+    """
+    The dual of ``encode_hash_fields``.
+    """
+    persisted = {'managed_dict': {}}
+    for field, value in fields.items():
+        if PY3 and isinstance(field, bytes):
+            field = field.decode('utf-8')
+        if field.startswith('k:'):
+            persisted['managed_dict'][field[2:]] = deserialize(value)
+        else:
+            persisted[field] = deserialize(value)
+    return persisted
+
+
+class _HashSessionDict(_SessionDict):
+    """
+    The hash storage layout of ``RedisHashSession``, shared with
+    ``aio.AsyncRedisHashSession``.
+    """
+
+    storage = 'hash'
+
+    def to_redis(self):
+        """Return a mapping of all the hash fields that need to be persisted
+        for this session."""
+        return encode_hash_fields({
+            'managed_dict': self.managed_dict,
+            'created': self.created,
+            'timeout': self.timeout,
+            }, self.serialize)
+
+    def _decode(self, fields):
+        return decode_hash_fields(fields, self.deserialize)
+
+    @classmethod
+    def queue_read(cls, pipe, session_id):
+        pipe.hgetall(session_id)
+
+    @classmethod
+    def read_result(cls, result):
+        # HGETALL returns an empty mapping for keys that don't exist
+        return _text_fields(result) or None
+
+    def _diff_fields(self):
+        """Return the ``(fields, deleted)`` hash fields to set and delete to
+        bring Redis up to date, or ``None`` if nothing changed."""
+        persisted = self._session_state.persisted or {}
+        if self._rewrite:
+            keys = set(self.managed_dict)
+            keys.update(field[2:] for field in persisted
+                        if field.startswith('k:'))
+        else:
+            keys = self._changed_keys
+        fields = {}
+        deleted = []
+        for key in keys:
+            field = _hash_field(key)
+            if key in self.managed_dict:
+                value = self.serialize(self.managed_dict[key])
+                if value != persisted.get(field):
+                    fields[field] = value
+            elif field in persisted:
+                deleted.append(field)
+        timeout = self.serialize(self.timeout)
+        if not fields and not deleted and timeout == persisted.get('timeout'):
+            return None
+        # always write the metadata, in case the key expired since it was read
+        fields['created'] = self.serialize(self.created)
+        fields['timeout'] = timeout
+        return fields, deleted
+
+    def _queue_field_writes(self, pipe, fields, deleted):
+        if deleted:
+            pipe.hdel(self.session_id, *deleted)
+        pipe.hset(self.session_id, mapping=fields)
+        pipe.expire(self.session_id, self.timeout)
+
+    def _update_persisted(self, fields, deleted):
+        persisted = dict(self._session_state.persisted or {})
+        persisted.update(fields)
+        for field in deleted:
+            del persisted[field]
+        self._session_state.persisted = persisted
+
+
+class RedisHashSession(_HashSessionDict, RedisSession):
+    """
+    A ``RedisSession`` that stores each top-level session key as its own field
+    in a Redis hash, alongside ``created`` and ``timeout`` fields. Changing
+    one key only rewrites that field instead of the whole session, and fields
+    that serialize to the same value as in Redis are not written at all.
+
+    Session keys must be strings. Values are serialized individually with
+    ``serialize``.
+    """
+
+    def _fetch(self, session_id):
+        return _text_fields(self.redis.hgetall(session_id))
+
+    @classmethod
+    def load(cls, redis, session_id, touch_timeout=None, with_ttl=False):
+        """Fetch all hash fields for ``session_id`` from Redis in a single
+        round trip. See ``RedisSession.load``."""
+        with redis.pipeline(transaction=False) as pipe:
+            cls.queue_load(pipe, session_id, touch_timeout, with_ttl)
+            results = pipe.execute()
+        return cls.load_result(results, touch_timeout, with_ttl)
+
+    @classmethod
+    def queue_load(cls, pipe, session_id, touch_timeout=None,
+                   with_ttl=False):
+        cls.queue_read(pipe, session_id)
+        if touch_timeout is not None:
+            pipe.expire(session_id, touch_timeout)
+        elif with_ttl:
+            pipe.ttl(session_id)
+
+    def _write_changes(self):
+        """Write the fields of this session that changed with ``HSET`` and
+        ``HDEL``, and reset its expire time, in a single transaction. Fields
+        whose serialized value is unchanged are skipped. After ``clear`` or
+        ``changed`` every field is compared, otherwise only the keys changed
+        through the session's methods.
+        """
+        diff = self._diff_fields()
+        if diff is None:
+            return False
+        fields, deleted = diff
+        with self.redis.pipeline() as pipe:
+            self._queue_field_writes(pipe, fields, deleted)
+            self._execute_write(pipe)
+        self._update_persisted(fields, deleted)
+        return True
+
+
+class _FramedSessionDict(_SessionDict):
+    """
+    The framed storage layout of ``RedisFramedSession``, shared with
+    ``aio.AsyncRedisFramedSession``.
+    """
+
+    storage = 'framed'
+
+    def to_redis(self):
+        """Serialize the data that needs to be persisted for this session
+        in the framed format."""
+        return encode_framed({
+            'managed_dict': self.managed_dict,
+            'created': self.created,
+            'timeout': self.timeout,
+            }, self.serialize)
+
+    def _decode(self, serialized):
+        if not is_framed(serialized):
+            return self.deserialize(serialized)
+        return decode_framed(serialized, self.deserialize)
+
+
+class RedisFramedSession(_FramedSessionDict, RedisSession):
+    """
+    A ``RedisSession`` stored as a single string in the framed format, with
+    each top-level session value serialized on its own. Values are only
+    deserialized when they are read, and values that weren't read are
+    written back without serializing them again. See
+    :mod:`pyramid_redis_sessions.framing`.
+
+    Session keys must be strings. Sessions stored as plain strings by
+    ``RedisSession`` are read too, and written back framed.
+    """
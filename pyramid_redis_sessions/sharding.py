@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+
+"""
+Client-side sharding of sessions across independent Redis servers.
+
+Each session key is routed to one node by consistent hashing, so adding or
+removing a node only moves the sessions that hash to it (about ``1/n`` of
+them) instead of reshuffling all of them. Every key belonging to a session
+(such as its version counter) is routed with the session, so creating,
+loading, persisting and invalidating a session each talk to a single node.
+Rotating a session to an id on another node creates the new session first
+and then deletes the old one from its node.
+
+Configure the nodes with the ``shards`` setting, one ``name=url`` pair per
+line (or separated by spaces). Names are what gets hashed, so keep a node's
+name when moving it to a new host::
+
+    redis.sessions.shards =
+        a=redis://redis-a:6379/0
+        b=redis://redis-b:6379/0
+        c=redis://redis-c:6379/0
+
+A key can also name its node explicitly with a ``{name}`` tag, which takes
+priority over the hash. ``tagged_id_generator`` produces session ids with a
+tag, so that sessions stay on the node they were created on even when nodes
+are added later.
+"""
+
+from bisect import bisect
+from hashlib import md5
+import random
+
+from pyramid.compat import string_types
+
+from .util import _generate_session_id
+
+# suffixes of keys that are stored alongside a session, and must be routed to
+# the same node as the session
+SESSION_KEY_SUFFIXES = (
+    ':version',
+    )
+
+# points on the hash ring for each node
+REPLICAS = 160
+
+# commands whose first argument is the only key they use
+KEY_COMMANDS = (
+    'expire',
+    'get',
+    'getex',
+    'hdel',
+    'hget',
+    'hgetall',
+    'hmget',
+    'hset',
+    'incr',
+    'persist',
+    'pexpire',
+    'pttl',
+    'set',
+    'ttl',
+    'type',
+    'zadd',
+    'zrange',
+    'zrem',
+    )
+
+
+def parse_shards(shards):
+    """
+    Converts the ``shards`` setting (a string, or a list of strings, of
+    ``name=url`` or bare ``url`` entries) to a list of ``(name, url)`` pairs.
+    A bare url is its own name.
+    """
+    if isinstance(shards, string_types):
+        shards = shards.split()
+    nodes = []
+    for entry in shards:
+        name, sep, url = entry.partition('=')
+        if not sep or '://' in name:
+            name, url = entry, entry
+        nodes.append((name, url))
+    return nodes
+
+def _hash(value):
+    return int(md5(value.encode('utf-8')).hexdigest()[:8], 16)
+
+def routing_key(key):
+    """
+    Returns the part of ``key`` that is hashed to choose its node: the
+    contents of a ``{tag}`` if it has one, otherwise the session id it
+    belongs to.
+    """
+    if isinstance(key, bytes):
+        key = key.decode('utf-8')
+    tag = _tag(key)
+    if tag is not None:
+        return tag
+    for suffix in SESSION_KEY_SUFFIXES:
+        if key.endswith(suffix):
+            return key[:-len(suffix)]
+    return key
+
+def _tag(key):
+    start = key.find('{')
+    if start != -1:
+        end = key.find('}', start + 1)
+        if end > start + 1:
+            return key[start + 1:end]
+    return None
+
+def _key_command(name):
+    def command(self, key, *arg, **kw):
+        return getattr(self._client_for([key]), name)(key, *arg, **kw)
+    command.__name__ = name
+    return command
+
+def _add_key_commands(cls):
+    for name in KEY_COMMANDS:
+        setattr(cls, name, _key_command(name))
+    return cls
+
+
+def tagged_id_generator(names, generator=_generate_session_id):
+    """
+    Returns an ``id_generator`` that prefixes the ids made by ``generator``
+    with a ``{name}`` tag for a randomly chosen node in ``names``.
+    """
+    names = list(names)
+
+    def generate():
+        return '{%s}%s' % (random.choice(names), generator())
+    return generate
+
+
+@_add_key_commands
+class ShardedRedis(object):
+    """
+    Routes each command to one of several Redis clients by the key it is
+    called with, and otherwise behaves like a single ``StrictRedis`` for the
+    commands sessions use.
+
+    Parameters:
+
+    ``nodes``
+    A list of ``(name, client)`` pairs.
+    """
+
+    def __init__(self, nodes):
+        if not nodes:
+            raise ValueError('at least one shard is required')
+        self.nodes = dict(nodes)
+        ring = []
+        for name in self.nodes:
+            for i in range(REPLICAS):
+                ring.append((_hash('%s-%d' % (name, i)), name))
+        ring.sort()
+        self._ring_hashes = [h for h, _ in ring]
+        self._ring_names = [name for _, name in ring]
+
+    def node_name(self, key):
+        """Returns the name of the node ``key`` is stored on."""
+        if isinstance(key, bytes):
+            key = key.decode('utf-8')
+        tag = _tag(key)
+        if tag in self.nodes:
+            return tag
+        index = bisect(self._ring_hashes, _hash(routing_key(key)))
+        return self._ring_names[index % len(self._ring_names)]
+
+    def node_for(self, key):
+        """Returns the client of the node ``key`` is stored on."""
+        return self.nodes[self.node_name(key)]
+
+    def _client_for(self, keys):
+        return self.node_for(keys[0])
+
+    def delete(self, *keys):
+        deleted = 0
+        for node, node_keys in self._group(keys):
+            deleted += node.delete(*node_keys) or 0
+        return deleted
+
+    def exists(self, *keys):
+        found = 0
+        for node, node_keys in self._group(keys):
+            found += int(node.exists(*node_keys) or 0)
+        return found
+
+    def _group(self, keys):
+        groups = {}
+        for key in keys:
+            groups.setdefault(self.node_name(key), []).append(key)
+        return [(self.nodes[name], node_keys)
+                for name, node_keys in groups.items()]
+
+    def evalsha(self, sha, numkeys, *arg):
+        keys = arg[:numkeys]
+        if len(set(self.node_name(key) for key in keys)) > 1:
+            raise ValueError('keys %r are on different shards' % (keys,))
+        return self.node_for(keys[0]).evalsha(sha, numkeys, *arg)
+
+    def script_load(self, source):
+        for node in self.nodes.values():
+            sha = node.script_load(source)
+        return sha
+
+    def pipeline(self, transaction=True):
+        return ShardedPipeline(self, transaction)
+
+
+@_add_key_commands
+class ShardedPipeline(object):
+    """
+    A pipeline that is bound to the node of the first key it is used with.
+    Every key used with it must live on that node, which is always the case
+    for the keys of a single session.
+    """
+
+    def __init__(self, sharded, transaction=True):
+        self.sharded = sharded
+        self.transaction = transaction
+        self.node_name = None
+        self.pipe = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *arg):
+        if self.pipe is not None:
+            self.pipe.__exit__(*arg)
+
+    def _bind(self, keys):
+        for key in keys:
+            name = self.sharded.node_name(key)
+            if self.node_name is None:
+                self.node_name = name
+                self.pipe = self.sharded.nodes[name].pipeline(
+                    transaction=self.transaction)
+            elif name != self.node_name:
+                raise ValueError(
+                    'keys %r are on different shards' % (list(keys),))
+        return self.pipe
+
+    def _client_for(self, keys):
+        return self._bind(keys)
+
+    def watch(self, *keys):
+        return self._bind(keys).watch(*keys)
+
+    def delete(self, *keys):
+        return self._bind(keys).delete(*keys)
+
+    def exists(self, *keys):
+        return self._bind(keys).exists(*keys)
+
+    def multi(self):
+        self.pipe.multi()
+
+    def execute(self):
+        if self.pipe is None:
+            return []
+        return self.pipe.execute()
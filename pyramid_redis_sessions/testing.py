@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+
+"""
+Helpers for asserting how many round trips, commands and bytes sessions cost
+in your tests, so that a change can't quietly add a Redis call to every
+request.
+
+Wrap the Redis client the session factory uses with a ``RedisRecorder``,
+and check a request against a budget::
+
+    from pyramid_redis_sessions.testing import RedisRecorder
+
+    recorder = RedisRecorder()
+    request.registry._redis_sessions = recorder.wrap(redis)
+    with recorder.budget(round_trips=1):
+        session = factory(request)
+        session['user']
+        finish_request(request)
+
+With pytest, enable the plugin in your ``conftest.py``::
+
+    pytest_plugins = ['pyramid_redis_sessions.pytest_plugin']
+
+and use the ``redis_recorder`` fixture, optionally with a budget for the
+whole test::
+
+    @pytest.mark.redis_budget(round_trips=1)
+    def test_read_only_request(redis_recorder):
+        request.registry._redis_sessions = redis_recorder.wrap(redis)
+        ...
+"""
+
+from contextlib import contextmanager
+
+from .metrics import (
+    InstrumentedRedis,
+    SessionMetrics,
+    )
+
+
+class RecordedCall(object):
+    """A round trip: one command, or a pipeline of several."""
+
+    def __init__(self, commands, sent, received):
+        self.commands = commands
+        self.sent = sent
+        self.received = received
+
+    def __repr__(self):
+        return '<%s (%d bytes sent, %d received)>' % (
+            ' '.join(name.upper() for name in self.commands),
+            self.sent,
+            self.received,
+            )
+
+
+class CommandLog(object):
+    """A list of ``RecordedCall``, with totals."""
+
+    def __init__(self, calls):
+        self.calls = calls
+
+    @property
+    def round_trips(self):
+        return len(self.calls)
+
+    @property
+    def commands(self):
+        return sum(len(call.commands) for call in self.calls)
+
+    @property
+    def bytes(self):
+        return sum(call.sent + call.received for call in self.calls)
+
+    def __str__(self):
+        return '\n'.join('  %r' % call for call in self.calls) or '  (none)'
+
+
+class RedisRecorder(SessionMetrics):
+    """
+    Records every call made through the clients returned by ``wrap``.
+    """
+
+    def __init__(self):
+        self.calls = []
+
+    def wrap(self, redis):
+        """Return a client that records its calls here, and otherwise
+        behaves like ``redis``."""
+        return InstrumentedRedis(redis, self)
+
+    def redis_call(self, commands, seconds, sent, received):
+        self.calls.append(RecordedCall(list(commands), sent, received))
+
+    @property
+    def log(self):
+        """A ``CommandLog`` of every call recorded so far."""
+        return CommandLog(list(self.calls))
+
+    def reset(self):
+        self.calls = []
+
+    def check(self, log, round_trips=None, commands=None, bytes=None):
+        """
+        Raise ``AssertionError`` if ``log`` exceeds any of the limits that
+        are given, listing its calls.
+        """
+        limits = (
+            ('round trips', round_trips, log.round_trips),
+            ('commands', commands, log.commands),
+            ('bytes', bytes, log.bytes),
+            )
+        for name, limit, actual in limits:
+            if limit is not None and actual > limit:
+                raise AssertionError('%d %s, expected at most %d:\n%s' % (
+                    actual, name, limit, log))
+
+    @contextmanager
+    def budget(self, round_trips=None, commands=None, bytes=None):
+        """
+        A context manager that checks the calls made within it against the
+        limits that are given. Yields the ``CommandLog`` of those calls,
+        which is filled in when the block exits.
+        """
+        start = len(self.calls)
+        log = CommandLog([])
+        yield log
+        log.calls = self.calls[start:]
+        self.check(log, round_trips, commands, bytes)
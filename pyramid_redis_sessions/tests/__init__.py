@@ -12,6 +12,10 @@ class DummySession(object):
         self.serialize = serialize
         self.managed_dict = {}
         self.created = float()
+        self.write_back = False
+        self.defer_refresh = False
+        self._dirty = False
+        self._touched = False
 
     def to_redis(self):
         return self.serialize({
@@ -20,13 +24,23 @@ class DummySession(object):
             'timeout': self.timeout,
             })
 
+    def do_persist(self):
+        self.redis.set(self.session_id, self.to_redis(), ex=self.timeout)
+        self._dirty = False
+
+    def do_refresh(self):
+        self.redis.expire(self.session_id, self.timeout)
+        self._touched = False
+
 
 class DummyRedis(object):
     def __init__(self, raise_watcherror=False, **kw):
         self.url = None
         self.timeouts = {}
         self.store = {}
-        self.pipeline = lambda : DummyPipeline(self.store, raise_watcherror)
+        self.loaded_scripts = set()
+        self.pipeline = lambda transaction=True: DummyPipeline(
+            self, raise_watcherror, transaction)
         self.__dict__.update(kw)
 
     @classmethod
@@ -39,12 +53,91 @@ class DummyRedis(object):
     def get(self, key):
         return self.store.get(key)
 
-    def set(self, key, value):
+    def getex(self, key, ex=None):
+        if ex is not None and key in self.store:
+            self.timeouts[key] = ex
+        return self.store.get(key)
+
+    def set(self, key, value, ex=None, nx=False):
+        if nx and key in self.store:
+            return None
         self.store[key] = value
+        if ex is not None:
+            self.timeouts[key] = ex
+        return True
+
+    def mget(self, keys):
+        return [self.store.get(key) for key in keys]
+
+    def scan(self, cursor=0, match=None, count=None):
+        # the cursor is an offset into the sorted keys
+        import fnmatch
+        keys = sorted(self.store)
+        end = cursor + (count or 10)
+        found = [key for key in keys[cursor:end]
+                 if match is None or fnmatch.fnmatchcase(key, match)]
+        return (end if end < len(keys) else 0), found
+
+    def hset(self, key, field=None, value=None, mapping=None):
+        fields = self.store.setdefault(key, {})
+        if field is not None:
+            fields[field] = value
+        fields.update(mapping or {})
+
+    def hdel(self, key, *fields):
+        for field in fields:
+            self.store.get(key, {}).pop(field, None)
+
+    def hgetall(self, key):
+        return dict(self.store.get(key, {}))
 
     def delete(self, *keys):
         for key in keys:
-            del self.store[key]
+            self.store.pop(key, None)
+
+    def zadd(self, key, mapping):
+        self.store.setdefault(key, {}).update(mapping)
+
+    def zrange(self, key, start, end):
+        members = sorted(self.store.get(key, {}).items(),
+                         key=lambda item: (item[1], item[0]))
+        end = len(members) if end == -1 else end + 1
+        return [member for member, _ in members[start:end]]
+
+    def zscore(self, key, member):
+        return self.store.get(key, {}).get(member)
+
+    def zcount(self, key, low, high):
+        low, high = float(low), float(high)
+        return sum(1 for score in self.store.get(key, {}).values()
+                   if low <= score <= high)
+
+    def zremrangebyscore(self, key, low, high):
+        low, high = float(low), float(high)
+        scores = self.store.get(key, {})
+        for member, score in list(scores.items()):
+            if low <= score <= high:
+                del scores[member]
+
+    def pfadd(self, key, *values):
+        # an exact set stands in for the HyperLogLog
+        self.store.setdefault(key, set()).update(values)
+
+    def pfcount(self, *keys):
+        return len(set().union(*[self.store.get(key, set())
+                                 for key in keys]))
+
+    def zrem(self, key, *members):
+        scores = self.store.get(key, {})
+        for member in members:
+            scores.pop(member, None)
+        if not scores:
+            # like Redis, empty sorted sets are deleted
+            self.store.pop(key, None)
+
+    def incr(self, key):
+        self.store[key] = int(self.store.get(key, 0)) + 1
+        return self.store[key]
 
     def exists(self, key):
         return key in self.store
@@ -55,11 +148,87 @@ class DummyRedis(object):
     def ttl(self, key):
         return self.timeouts.get(key)
 
+    def script_load(self, source):
+        from ..scripts import Script
+        sha = Script(source).sha
+        self.loaded_scripts.add(sha)
+        return sha
+
+    def evalsha(self, sha, numkeys, *arg):
+        from redis.exceptions import NoScriptError
+        if sha not in self.loaded_scripts:
+            raise NoScriptError('NOSCRIPT')
+        return _script_emulations()[sha](self, arg[:numkeys], arg[numkeys:])
+
+
+def _load_session(redis, keys, argv):
+    storage, touch_timeout, with_ttl, cached_version = argv
+    version = None
+    if len(keys) > 1:
+        version = redis.get(keys[1])
+    data = None
+    current = 0
+    if version is not None and str(version) == str(cached_version):
+        current = 1
+    elif storage == 'hash':
+        data = []
+        for field, value in redis.hgetall(keys[0]).items():
+            data.extend([field, value])
+    else:
+        data = redis.get(keys[0])
+    ttl = None
+    if touch_timeout != '':
+        for key in keys:
+            redis.expire(key, touch_timeout)
+    elif with_ttl == '1':
+        ttl = redis.ttl(keys[0])
+    return [data, version, ttl, current]
+
+def _write_if_version(redis, keys, argv):
+    expected, value, timeout = argv
+    current = redis.get(keys[1])
+    if expected != '*' and str(current or '') != str(expected):
+        return None
+    redis.set(keys[0], value, ex=timeout)
+    version = redis.incr(keys[1])
+    redis.expire(keys[1], timeout)
+    return version
+
+def _replace_if_equal(redis, keys, argv):
+    field, value, replacement = argv
+    if field == '':
+        current = redis.get(keys[0])
+    else:
+        current = redis.hgetall(keys[0]).get(field)
+    if current is None:
+        return -1
+    if current != value:
+        return 0
+    if field == '':
+        redis.set(keys[0], replacement, ex=redis.ttl(keys[0]))
+    else:
+        redis.hset(keys[0], field, replacement)
+    return 1
+
+def _script_emulations():
+    """Python versions of the Lua scripts, for ``DummyRedis.evalsha``."""
+    from .. import scripts
+    return {
+        scripts.LOAD_SESSION.sha: _load_session,
+        scripts.WRITE_IF_VERSION.sha: _write_if_version,
+        scripts.REPLACE_IF_EQUAL.sha: _replace_if_equal,
+        }
+
 
 class DummyPipeline(object):
-    def __init__(self, store, raise_watcherror=False):
-        self.store = store
+    """
+    Runs each command against the parent ``DummyRedis`` straight away, and
+    returns the collected results from ``execute`` like a real pipeline.
+    """
+    def __init__(self, redis, raise_watcherror=False, transaction=True):
+        self.redis = redis
         self.raise_watcherror = raise_watcherror
+        self.results = []
 
     def __enter__(self):
         return self
@@ -67,17 +236,16 @@ class DummyPipeline(object):
     def __exit__(self, *arg, **kwarg):
         pass
 
-    def multi(self):
-        pass
+    def __getattr__(self, name):
+        command = getattr(self.redis, name)
+        def queued(*arg, **kw):
+            result = command(*arg, **kw)
+            self.results.append(result)
+            return result
+        return queued
 
-    def set(self, key, value):
-        self.store[key] = value
-
-    def get(self, key):
-        return self.store.get(key)
-
-    def expire(self, key, timeout):
-        pass
+    def multi(self):
+        self.results = []
 
     def watch(self, key):
         if self.raise_watcherror:
@@ -85,4 +253,5 @@ class DummyPipeline(object):
             raise WatchError
 
     def execute(self):
-        pass
+        results, self.results = self.results, []
+        return results
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+
+"""
+Dummies for the asyncio API. Kept out of ``tests/__init__.py`` because they
+need Python 3.5 syntax.
+"""
+
+from . import DummyRedis
+
+
+class DummyAsyncRedis(object):
+    """
+    Wraps a ``DummyRedis`` with the coroutine interface of
+    ``redis.asyncio.Redis``.
+    """
+    def __init__(self, redis=None, raise_watcherror=False):
+        self.sync = redis if redis is not None else DummyRedis()
+        self.raise_watcherror = raise_watcherror
+        self.calls = []
+
+    def __getattr__(self, name):
+        command = getattr(self.sync, name)
+        async def call(*arg, **kw):
+            self.calls.append(name)
+            return command(*arg, **kw)
+        return call
+
+    def pipeline(self, transaction=True):
+        return DummyAsyncPipeline(self, transaction)
+
+
+class DummyAsyncPipeline(object):
+    """
+    Buffers commands like a ``redis.asyncio`` pipeline: commands are queued
+    synchronously, except while watching keys, when they run immediately and
+    must be awaited.
+    """
+    def __init__(self, redis, transaction=True):
+        self.redis = redis
+        self.transaction = transaction
+        self.watching = False
+        self.queued = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *arg):
+        pass
+
+    def __getattr__(self, name):
+        command = getattr(self.redis.sync, name)
+        if self.watching:
+            async def immediate(*arg, **kw):
+                return command(*arg, **kw)
+            return immediate
+        def queue(*arg, **kw):
+            self.queued.append((name, command, arg, kw))
+            return self
+        return queue
+
+    async def watch(self, *keys):
+        self.watching = True
+        if self.redis.raise_watcherror:
+            from redis.exceptions import WatchError
+            self.redis.raise_watcherror = False
+            raise WatchError
+
+    def multi(self):
+        self.watching = False
+
+    async def execute(self):
+        queued, self.queued = self.queued, []
+        self.redis.calls.append('pipeline')
+        return [command(*arg, **kw) for name, command, arg, kw in queued]
+
+
+async def gather(*coroutines):
+    import asyncio
+    return await asyncio.gather(*coroutines)
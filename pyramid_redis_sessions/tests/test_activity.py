@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from pyramid import testing
+
+from ..compat import cPickle
+
+
+class DummyClock(object):
+    def __init__(self):
+        self.now = 6000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestActivityTracker(unittest.TestCase):
+    def _makeOne(self, **kw):
+        from . import DummyRedis
+        from ..activity import ActivityTracker
+        self.clock = DummyClock()
+        self.redis = DummyRedis()
+        return ActivityTracker(clock=self.clock, **kw)
+
+    def test_bucket_key(self):
+        inst = self._makeOne(prefix='act:', bucket_seconds=60)
+        self.assertEqual(inst.bucket_key(6059.5), 'act:hll:6000')
+        self.assertEqual(inst.bucket_key(6060), 'act:hll:6060')
+
+    def test_record(self):
+        inst = self._makeOne(retention=600)
+        inst.record(self.redis, 'a')
+        key = inst.bucket_key(self.clock.now)
+        self.assertEqual(self.redis.store[key], set(['a']))
+        self.assertEqual(self.redis.ttl(key), 660)
+        self.assertNotIn(inst.last_seen_key, self.redis.store)
+
+    def test_active_count(self):
+        inst = self._makeOne()
+        for session_id in ('a', 'b', 'c'):
+            inst.record(self.redis, session_id)
+        self.clock.now += 240
+        inst.record(self.redis, 'a')
+        inst.record(self.redis, 'd')
+        self.assertEqual(inst.active_count(self.redis, 60), 2)
+        self.assertEqual(inst.active_count(self.redis, 300), 4)
+        self.clock.now += 600
+        self.assertEqual(inst.active_count(self.redis, 300), 0)
+
+    def test_active_count_limited_to_retention(self):
+        inst = self._makeOne(retention=120)
+        inst.record(self.redis, 'a')
+        self.clock.now += 300
+        self.assertEqual(inst.active_count(self.redis, 3600), 0)
+
+    def test_last_seen(self):
+        inst = self._makeOne(last_seen=True, retention=600)
+        inst.record(self.redis, 'a')
+        self.clock.now += 100
+        inst.record(self.redis, 'b')
+        self.assertEqual(inst.seen_at(self.redis, 'a'), 6000.0)
+        self.assertEqual(inst.active_exact(self.redis, 60), 1)
+        self.assertEqual(inst.active_exact(self.redis, 300), 2)
+        # old entries are dropped as new ones come in
+        self.clock.now += 550
+        inst.record(self.redis, 'c')
+        self.assertIsNone(inst.seen_at(self.redis, 'a'))
+        self.assertEqual(self.redis.ttl(inst.last_seen_key), 600)
+
+
+class TestFactoryWithActivity(unittest.TestCase):
+    def setUp(self):
+        from . import DummyRedis
+        testing.setUp()
+        self.redis = DummyRedis()
+        self.redis.set('id', cPickle.dumps({
+            'managed_dict': {},
+            'created': 1.0,
+            'timeout': 1200,
+            }), ex=1200)
+
+    def tearDown(self):
+        testing.tearDown()
+
+    def _request(self, cookie=True, **kw):
+        from pyramid.session import signed_serialize
+        from .. import RedisSessionFactory
+        request = testing.DummyRequest()
+        request.exception = None
+        if cookie:
+            request.cookies['session'] = signed_serialize('id', 'secret')
+        factory = RedisSessionFactory(
+            'secret',
+            client_callable=lambda request, **options: self.redis,
+            track_activity=True,
+            **kw
+            )
+        return factory(request)
+
+    def _active(self, **kw):
+        from ..activity import ActivityTracker
+        return ActivityTracker(**kw).active_count(self.redis, 60)
+
+    def test_loaded(self):
+        session = self._request()
+        self.assertIs(session.new, False)
+        self.assertEqual(self._active(), 1)
+
+    def test_loaded_hash(self):
+        from ..session import encode_hash_fields
+        self.redis.delete('id')
+        self.redis.hset('id', mapping=encode_hash_fields({
+            'managed_dict': {'a': 1},
+            'created': 1.0,
+            'timeout': 1200,
+            }, cPickle.dumps))
+        session = self._request(storage='hash', refresh_policy='threshold')
+        self.assertEqual(session['a'], 1)
+        self.assertEqual(self._active(), 1)
+
+    def test_new(self):
+        session = self._request(cookie=False)
+        self.assertIs(session.new, True)
+        self.assertEqual(self._active(), 1)
+
+    def test_lazy_new_not_recorded(self):
+        self._request(cookie=False, lazy_create=True)
+        self.assertEqual(self._active(), 0)
+
+    def test_local_cache(self):
+        self._request(local_cache=True)
+        self.assertEqual(self._active(), 1)
+
+    def test_settings(self):
+        self._request(activity_prefix='act:', activity_last_seen=True)
+        self.assertEqual(self._active(prefix='act:'), 1)
+        self.assertIn('act:last_seen', self.redis.store)
+
+    def test_invalid_combinations(self):
+        from pyramid.exceptions import ConfigurationError
+        from .. import RedisSessionFactory
+        self.assertRaises(ConfigurationError, RedisSessionFactory, 'secret',
+                          track_activity=True, backend='memory')
+        self.assertRaises(ConfigurationError, RedisSessionFactory, 'secret',
+                          track_activity=True, shards='redis://a')
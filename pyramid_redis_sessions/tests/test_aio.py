@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+
+import sys
+import unittest
+
+from ..compat import cPickle
+
+
+@unittest.skipIf(sys.version_info < (3, 5), 'requires Python 3.5')
+class Test_aio(unittest.TestCase):
+    def _run(self, coroutine):
+        import asyncio
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(coroutine)
+        finally:
+            loop.close()
+
+    def _makeRedis(self, session_dict=None, **kw):
+        from .aio_dummies import DummyAsyncRedis
+        redis = DummyAsyncRedis(**kw)
+        if session_dict is not None:
+            redis.sync.set('id', cPickle.dumps({
+                'managed_dict': session_dict,
+                'created': 1.0,
+                'timeout': 300,
+                }), ex=300)
+        return redis
+
+    def _stored(self, redis, session_id):
+        return cPickle.loads(redis.sync.get(session_id))['managed_dict']
+
+    def _load(self, redis, session_id='id', **kw):
+        from ..aio import load_session
+        return self._run(load_session(redis, session_id, **kw))
+
+    def test_requires_redis_asyncio(self):
+        saved = dict(sys.modules)
+        sys.modules.pop('pyramid_redis_sessions.aio', None)
+        sys.modules['redis.asyncio'] = None
+        try:
+            try:
+                import pyramid_redis_sessions.aio
+            except ImportError as exc:
+                self.assertIn('redis-py 4.2', str(exc))
+            else: # pragma: no cover
+                self.fail('aio imported without redis.asyncio')
+        finally:
+            sys.modules.clear()
+            sys.modules.update(saved)
+
+    def test_load_session(self):
+        redis = self._makeRedis({'a': 1})
+        session = self._load(redis)
+        self.assertEqual(dict(session), {'a': 1})
+        self.assertEqual(session.timeout, 300)
+        self.assertIs(session.new, False)
+        self.assertEqual(redis.calls, ['pipeline'])
+
+    def test_load_missing_session(self):
+        redis = self._makeRedis()
+        self.assertIsNone(self._load(redis))
+        self.assertIsNone(self._load(redis, session_id=None))
+
+    def test_load_session_touch_keeps_adjusted_timeout(self):
+        redis = self._makeRedis({'a': 1})
+        self._load(redis, touch=True, timeout=60)
+        self.assertEqual(redis.sync.ttl('id'), 300)
+
+    def test_save_writes_changes_once(self):
+        redis = self._makeRedis({'a': 1})
+        session = self._load(redis)
+        session['a'] = 2
+        session['b'] = 3
+        self.assertEqual(redis.calls, ['pipeline'])
+        self._run(session.save())
+        self.assertEqual(redis.calls, ['pipeline', 'set'])
+        self.assertEqual(self._stored(redis, session.session_id),
+                         {'a': 2, 'b': 3})
+
+    def test_save_read_only_session_refreshes(self):
+        redis = self._makeRedis({'a': 1})
+        session = self._load(redis)
+        redis.sync.timeouts['id'] = 10
+        session.get('a')
+        self._run(session.save())
+        self.assertEqual(redis.calls, ['pipeline', 'expire'])
+        self.assertEqual(redis.sync.ttl('id'), 300)
+
+    def test_save_untouched_session_does_nothing(self):
+        redis = self._makeRedis({'a': 1})
+        session = self._load(redis)
+        self._run(session.save())
+        self.assertEqual(redis.calls, ['pipeline'])
+
+    def test_invalidate_deleted_on_save(self):
+        redis = self._makeRedis({'a': 1})
+        session = self._load(redis)
+        session.invalidate()
+        self.assertIn('id', redis.sync.store)
+        self.assertIsNone(session.session_id)
+        self._run(session.save())
+        self.assertNotIn('id', redis.sync.store)
+        self.assertIsNone(session.session_id)
+
+    def test_invalidate_then_write_creates_new_session(self):
+        redis = self._makeRedis({'a': 1})
+        session = self._load(redis)
+        session.invalidate()
+        session['b'] = 2
+        self._run(session.save())
+        self.assertNotIn('id', redis.sync.store)
+        self.assertEqual(self._stored(redis, session.session_id), {'b': 2})
+
+    def test_create_session(self):
+        from ..aio import create_session
+        redis = self._makeRedis()
+        redis.sync.set('x', 'taken')
+        session = self._run(create_session(redis, timeout=60,
+                                           id_generator=iter('xy').__next__))
+        self.assertEqual(session.session_id, 'y')
+        self.assertIs(session.new, True)
+        self.assertEqual(self._stored(redis, session.session_id), {})
+        self.assertEqual(redis.sync.ttl('y'), 60)
+
+    def test_create_session_lazy(self):
+        from ..aio import create_session
+        redis = self._makeRedis()
+        session = self._run(create_session(redis, lazy=True))
+        self.assertIsNone(session.session_id)
+        self._run(session.save())
+        self.assertEqual(redis.sync.store, {})
+        session['a'] = 1
+        self._run(session.save())
+        self.assertEqual(self._stored(redis, session.session_id), {'a': 1})
+
+    def test_no_sync_persistence(self):
+        from ..aio import _session_classes
+        for session_class in _session_classes.values():
+            for name in ('do_persist', 'persist_if_changed', 'do_refresh',
+                         'rotate', 'from_redis', 'load', 'queue_load'):
+                self.assertFalse(hasattr(session_class, name), name)
+
+    def test_provides_isession(self):
+        from pyramid.interfaces import ISession
+        from zope.interface.verify import verifyObject
+        redis = self._makeRedis({'a': 1})
+        self.assertTrue(verifyObject(ISession, self._load(redis)))
+
+    def test_hash_storage(self):
+        from ..aio import create_session
+        redis = self._makeRedis()
+        session = self._run(create_session(redis, storage='hash'))
+        session['a'] = 1
+        self._run(session.save())
+        loaded = self._load(redis, session_id=session.session_id,
+                            storage='hash')
+        self.assertEqual(dict(loaded), {'a': 1})
+        self.assertEqual(
+            cPickle.loads(redis.sync.store[session.session_id]['k:a']), 1)
+
+    def test_framed_storage(self):
+        from ..aio import create_session
+        from ..framing import is_framed
+        redis = self._makeRedis()
+        session = self._run(create_session(redis, storage='framed'))
+        session['a'] = 1
+        self._run(session.save())
+        self.assertTrue(is_framed(redis.sync.store[session.session_id]))
+        loaded = self._load(redis, session_id=session.session_id,
+                            storage='framed')
+        self.assertEqual(dict(loaded), {'a': 1})
+
+    def test_invalid_storage(self):
+        from ..aio import create_session
+        self.assertRaises(ValueError, self._run,
+                          create_session(self._makeRedis(), storage='list'))
+
+    def test_concurrent_loads(self):
+        from ..aio import load_session
+        from .aio_dummies import gather
+        redis = self._makeRedis({'a': 1})
+        redis.sync.set('other', redis.sync.get('id'))
+        sessions = self._run(gather(
+            load_session(redis, 'id'),
+            load_session(redis, 'other'),
+            ))
+        self.assertEqual([s.session_id for s in sessions], ['id', 'other'])
+
+    def test_cookie_value_roundtrip(self):
+        from ..aio import cookie_value, session_id_from_cookie
+        redis = self._makeRedis({'a': 1})
+        session = self._load(redis)
+        cookieval = cookie_value(session, 'secret')
+        self.assertEqual(session_id_from_cookie(cookieval, 'secret'), 'id')
+        self.assertIsNone(session_id_from_cookie(cookieval, 'wrong'))
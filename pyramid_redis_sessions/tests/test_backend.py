@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from pyramid import testing
+
+
+class DummyClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestMemoryBackend(unittest.TestCase):
+    def _makeOne(self):
+        from ..backend import MemoryBackend
+        clock = DummyClock()
+        return MemoryBackend(clock=clock), clock
+
+    def test_create(self):
+        inst, _ = self._makeOne()
+        self.assertIs(inst.create('id', b'value', 10), True)
+        self.assertIs(inst.create('id', b'other', 10), False)
+        self.assertEqual(inst.load('id'), b'value')
+
+    def test_create_replaces(self):
+        inst, _ = self._makeOne()
+        inst.create('old', b'value', 10)
+        self.assertIs(inst.create('new', b'value', 10, replace=['old']), True)
+        self.assertNotIn('old', inst)
+        self.assertIn('new', inst)
+
+    def test_load_missing(self):
+        inst, _ = self._makeOne()
+        self.assertIsNone(inst.load('id'))
+
+    def test_expiry(self):
+        inst, clock = self._makeOne()
+        inst.save('a', b'a', 10)
+        inst.save('b', b'b', 20)
+        clock.now += 10
+        self.assertIsNone(inst.load('a'))
+        self.assertEqual(inst.load('b'), b'b')
+        self.assertEqual(len(inst), 1)
+        self.assertIs(inst.create('a', b'new', 10), True)
+
+    def test_save_resets_expiry(self):
+        inst, clock = self._makeOne()
+        inst.save('id', b'old', 10)
+        clock.now += 5
+        inst.save('id', b'new', 10)
+        clock.now += 6
+        self.assertEqual(inst.load('id'), b'new')
+
+    def test_touch(self):
+        inst, clock = self._makeOne()
+        inst.save('id', b'value', 10)
+        clock.now += 5
+        inst.touch('id', 10)
+        clock.now += 6
+        self.assertIn('id', inst)
+        inst.touch('missing', 10)
+        self.assertNotIn('missing', inst)
+
+    def test_load_with_touch(self):
+        inst, clock = self._makeOne()
+        inst.save('id', b'value', 10)
+        clock.now += 5
+        self.assertEqual(inst.load('id', touch_timeout=10), b'value')
+        clock.now += 6
+        self.assertEqual(inst.load('id'), b'value')
+
+    def test_delete(self):
+        inst, _ = self._makeOne()
+        inst.save('a', b'a', 10)
+        inst.save('b', b'b', 10)
+        inst.delete('a', 'b', 'missing')
+        self.assertEqual(len(inst), 0)
+
+    def test_stale_expiry_entries_are_dropped(self):
+        inst, _ = self._makeOne()
+        inst.save('id', b'value', 10)
+        for _ in range(1000):
+            inst.touch('id', 10)
+        self.assertTrue(len(inst._expiry) < 100)
+        self.assertIn('id', inst)
+
+
+class TestRedisBackend(unittest.TestCase):
+    def _makeOne(self):
+        from . import DummyRedis
+        from ..backend import RedisBackend
+        redis = DummyRedis()
+        return RedisBackend(redis), redis
+
+    def test_it(self):
+        inst, redis = self._makeOne()
+        self.assertIs(inst.create('id', b'value', 10), True)
+        self.assertIs(inst.create('id', b'other', 10), False)
+        self.assertEqual(inst.load('id'), b'value')
+        inst.save('id', b'new', 20)
+        self.assertEqual(redis.get('id'), b'new')
+        self.assertEqual(redis.ttl('id'), 20)
+        inst.touch('id', 30)
+        self.assertEqual(redis.ttl('id'), 30)
+        self.assertEqual(inst.load('id', touch_timeout=40), b'new')
+        self.assertEqual(redis.ttl('id'), 40)
+        inst.delete('id')
+        self.assertIsNone(inst.load('id'))
+
+    def test_create_replaces(self):
+        inst, redis = self._makeOne()
+        inst.create('old', b'value', 10)
+        self.assertIs(inst.create('new', b'value', 10, replace=['old']), True)
+        self.assertIsNone(redis.get('old'))
+        self.assertEqual(redis.get('new'), b'value')
+
+
+class StubBackend(object):
+    """Stores sessions in a dict and records the methods called."""
+
+    def __init__(self):
+        self.sessions = {}
+        self.calls = []
+
+    def load(self, session_id, touch_timeout=None):
+        self.calls.append('load')
+        return self.sessions.get(session_id)
+
+    def create(self, session_id, value, timeout, replace=None):
+        self.calls.append('create')
+        for replaced in replace or ():
+            self.sessions.pop(replaced, None)
+        return self.sessions.setdefault(session_id, value) is value
+
+    def save(self, session_id, value, timeout):
+        self.calls.append('save')
+        self.sessions[session_id] = value
+
+    def touch(self, session_id, timeout):
+        self.calls.append('touch')
+
+    def delete(self, *session_ids):
+        self.calls.append('delete')
+        for session_id in session_ids:
+            self.sessions.pop(session_id, None)
+
+
+class Test_get_unique_session_id(unittest.TestCase):
+    def test_it(self):
+        from ..backend import MemoryBackend, get_unique_session_id
+        backend = MemoryBackend()
+        backend.save('taken', b'value', 10)
+        backend.save('old', b'value', 10)
+        ids = iter(['taken', 'new'])
+        session_id = get_unique_session_id(backend, 10, repr,
+                                           generator=lambda: next(ids),
+                                           replace=['old'])
+        self.assertEqual(session_id, 'new')
+        self.assertNotIn('old', backend)
+        self.assertIn('managed_dict', backend.load('new'))
+
+
+class TestFactoryWithBackend(unittest.TestCase):
+    def setUp(self):
+        testing.setUp()
+
+    def tearDown(self):
+        testing.tearDown()
+
+    def _request(self, factory, cookie=None):
+        import webob
+        request = testing.DummyRequest()
+        request.exception = None
+        if cookie is not None:
+            request.cookies['session'] = cookie
+        session = factory(request)
+
+        def finish():
+            response = webob.Response()
+            for callback in request.response_callbacks:
+                callback(request, response)
+            return response
+        return session, finish
+
+    def test_memory_backend(self):
+        from pyramid.session import signed_serialize
+        from .. import RedisSessionFactory
+        factory = RedisSessionFactory('secret', backend='memory')
+        session, finish = self._request(factory)
+        self.assertIsNone(session.redis)
+        session['key'] = 'value'
+        finish()
+        cookie = signed_serialize(session.session_id, 'secret')
+        session, finish = self._request(factory, cookie)
+        self.assertIs(session.new, False)
+        self.assertEqual(session['key'], 'value')
+        session.invalidate()
+        session, finish = self._request(factory, cookie)
+        self.assertIs(session.new, True)
+
+    def test_backend_instance(self):
+        from ..backend import MemoryBackend
+        from .. import RedisSessionFactory
+        backend = MemoryBackend()
+        factory = RedisSessionFactory('secret', backend=backend,
+                                      lazy_create=True, write_back=True)
+        session, finish = self._request(factory)
+        session['key'] = 'value'
+        finish()
+        self.assertEqual(len(backend), 1)
+
+    def test_stub_backend(self):
+        from pyramid.session import signed_serialize
+        from .. import RedisSessionFactory
+        backend = StubBackend()
+        factory = RedisSessionFactory('secret', backend=backend)
+        session, finish = self._request(factory)
+        session['key'] = 'value'
+        finish()
+        self.assertEqual(backend.calls, ['create', 'save'])
+        backend.calls = []
+        cookie = signed_serialize(session.session_id, 'secret')
+        session, finish = self._request(factory, cookie)
+        self.assertEqual(session['key'], 'value')
+        old_id = session.session_id
+        session.rotate()
+        session.invalidate()
+        finish()
+        self.assertEqual(backend.calls, ['load', 'touch', 'create', 'delete'])
+        self.assertEqual(backend.sessions, {})
+        self.assertNotEqual(session.session_id, old_id)
+
+    def _recording_redis_backend(self):
+        from .. import backend
+        calls = []
+
+        class RecordingBackend(backend.RedisBackend):
+            def load(self, *arg, **kw):
+                calls.append('load')
+                return backend.RedisBackend.load(self, *arg, **kw)
+
+            def create(self, *arg, **kw):
+                calls.append('create')
+                return backend.RedisBackend.create(self, *arg, **kw)
+        return RecordingBackend, calls
+
+    def test_redis_sessions_use_redis_backend(self):
+        import pyramid_redis_sessions
+        from pyramid.session import signed_serialize
+        from . import DummyRedis
+        RecordingBackend, calls = self._recording_redis_backend()
+        redis = DummyRedis()
+        original = pyramid_redis_sessions.RedisBackend
+        pyramid_redis_sessions.RedisBackend = RecordingBackend
+        try:
+            for storage, used in (('string', True), ('framed', True),
+                                  ('hash', False)):
+                factory = pyramid_redis_sessions.RedisSessionFactory(
+                    'secret',
+                    storage=storage,
+                    client_callable=lambda request, **kw: redis,
+                    )
+                session, finish = self._request(factory)
+                cookie = signed_serialize(session.session_id, 'secret')
+                self._request(factory, cookie)
+                self.assertEqual(calls, ['create', 'load'] if used else [])
+                del calls[:]
+        finally:
+            pyramid_redis_sessions.RedisBackend = original
+
+    def test_invalid_combinations(self):
+        from pyramid.exceptions import ConfigurationError
+        from .. import RedisSessionFactory
+        self.assertRaises(ConfigurationError, RedisSessionFactory, 'secret',
+                          backend='mongodb')
+        for option in (dict(storage='hash'), dict(local_cache=True),
+                       dict(use_scripts=True), dict(shards='redis://a'),
+                       dict(replica_urls='redis://replica')):
+            self.assertRaises(ConfigurationError, RedisSessionFactory,
+                              'secret', backend='memory', **option)
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+
+"""
+The Redis round trips each kind of request costs. A change that adds one
+has to update these tests.
+"""
+
+import unittest
+
+from pyramid import testing
+
+from ..compat import cPickle
+
+
+class TestRequestBudgets(unittest.TestCase):
+    def setUp(self):
+        from . import DummyRedis
+        from ..testing import RedisRecorder
+        self.config = testing.setUp()
+        self.redis = DummyRedis()
+        self.redis.set('id', cPickle.dumps({
+            'managed_dict': {'user': 'alice'},
+            'created': 1.0,
+            'timeout': 1200,
+            }), ex=1200)
+        self.recorder = RedisRecorder()
+
+    def tearDown(self):
+        testing.tearDown()
+
+    def _request(self, view, cookie=True, **kw):
+        import webob
+        from pyramid.session import signed_serialize
+        from .. import RedisSessionFactory
+        request = testing.DummyRequest()
+        request.exception = None
+        request.registry._redis_sessions = self.recorder.wrap(self.redis)
+        if cookie:
+            request.cookies['session'] = signed_serialize('id', 'secret')
+        session = RedisSessionFactory('secret', **kw)(request)
+        view(session)
+        response = webob.Response()
+        for callback in request.response_callbacks:
+            callback(request, response)
+
+    def _read(self, session):
+        session.get('user')
+
+    def _write(self, session):
+        session['a'] = 1
+        session['b'] = 2
+
+    def _nothing(self, session):
+        pass
+
+    def test_read(self):
+        # load, and reset the expire time
+        with self.recorder.budget(round_trips=2):
+            self._request(self._read)
+
+    def test_read_with_touch_on_load(self):
+        with self.recorder.budget(round_trips=1):
+            self._request(self._read, touch_on_load=True,
+                          refresh_policy='once')
+
+    def test_read_within_refresh_threshold(self):
+        with self.recorder.budget(round_trips=1, commands=2):
+            self._request(self._read, refresh_policy='threshold')
+
+    def test_write_back(self):
+        with self.recorder.budget(round_trips=2):
+            self._request(self._write, write_back=True)
+
+    def test_new_session(self):
+        with self.recorder.budget(round_trips=1):
+            self._request(self._nothing, cookie=False)
+
+    def test_new_session_written(self):
+        with self.recorder.budget(round_trips=2):
+            self._request(self._write, cookie=False, write_back=True)
+
+    def test_lazy_session_not_stored(self):
+        with self.recorder.budget(round_trips=0):
+            self._request(self._read, cookie=False, lazy_create=True)
+
+    def test_lazy_session_written(self):
+        with self.recorder.budget(round_trips=1):
+            self._request(self._write, cookie=False, lazy_create=True,
+                          write_back=True)
+
+    def test_read_with_activity(self):
+        # activity is recorded in the load's round trip
+        with self.recorder.budget(round_trips=2):
+            self._request(self._read, track_activity=True)
+        with self.recorder.budget(round_trips=1):
+            self._request(self._read, track_activity=True,
+                          touch_on_load=True, refresh_policy='once')
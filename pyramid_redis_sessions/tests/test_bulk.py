@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from ..compat import cPickle
+
+
+def _session(created, timeout=1200, **managed):
+    return {'managed_dict': managed, 'created': created, 'timeout': timeout}
+
+
+class _Base(object):
+    def _makeRedis(self, count=25, storage='string'):
+        from . import DummyRedis
+        from ..session import encode_hash_fields
+        redis = DummyRedis()
+        for i in range(count):
+            session = _session(float(i), timeout=100 * (i % 3), n=i)
+            if storage == 'hash':
+                redis.hset('session:%02d' % i,
+                           mapping=encode_hash_fields(session, cPickle.dumps))
+            else:
+                redis.set('session:%02d' % i, cPickle.dumps(session))
+        redis.set('session:00:version', 3)
+        redis.set('other', b'not a session')
+        return redis
+
+
+class Test_iter_sessions(_Base, unittest.TestCase):
+    def _callFUT(self, redis, **kw):
+        from ..bulk import iter_sessions
+        return list(iter_sessions(redis, prefix='session:', **kw))
+
+    def test_all(self):
+        redis = self._makeRedis()
+        sessions = self._callFUT(redis, batch_size=4)
+        self.assertEqual([sid for sid, _ in sessions],
+                         ['session:%02d' % i for i in range(25)])
+        self.assertEqual(sessions[7][1], _session(7.0, 100, n=7))
+
+    def test_streams_in_batches(self):
+        from ..bulk import iter_sessions
+        from ..testing import RedisRecorder
+        recorder = RedisRecorder()
+        redis = recorder.wrap(self._makeRedis())
+        sessions = iter_sessions(redis, prefix='session:', batch_size=10)
+        next(sessions)
+        # the first scan, then its batch fetched along with the next scan
+        self.assertEqual(recorder.log.round_trips, 2)
+        list(sessions)
+        self.assertEqual(recorder.log.round_trips, 4)
+
+    def test_hash_storage(self):
+        redis = self._makeRedis(storage='hash')
+        sessions = self._callFUT(redis, storage='hash', batch_size=7)
+        self.assertEqual(len(sessions), 25)
+        self.assertEqual(sessions[3][1], _session(3.0, 0, n=3))
+
+    def test_filters(self):
+        redis = self._makeRedis()
+        sessions = self._callFUT(redis, created_after=5, created_before=12,
+                                 min_timeout=100)
+        self.assertEqual([s['created'] for _, s in sessions],
+                         [7.0, 8.0, 10.0, 11.0])
+        sessions = self._callFUT(redis, max_timeout=0)
+        self.assertEqual(len(sessions), 9)
+
+    def test_skips_expired(self):
+        from . import DummyRedis
+        redis = DummyRedis()
+        redis.set('session:a', cPickle.dumps(_session(1.0)))
+        redis.scan = lambda cursor, match, count: (0, ['session:a',
+                                                       'session:gone'])
+        self.assertEqual([sid for sid, _ in self._callFUT(redis)],
+                         ['session:a'])
+
+    def test_codec_payloads(self):
+        from .. import codec
+        redis = self._makeRedis(count=0)
+        redis.set('session:json',
+                  codec.encoder('json')(_session(1.0, a=1)))
+        self.assertEqual(self._callFUT(redis),
+                         [('session:json', _session(1.0, a=1))])
+
+    def _add_companion_keys(self, redis):
+        from ..activity import ActivityTracker
+        from ..index import UserIndex
+        ActivityTracker(last_seen=True).record(redis, 'session:00')
+        UserIndex(redis, 'userid').bind('session:00', 'alice')
+        self.assertTrue(any(key.startswith('session_activity:hll:')
+                            for key in redis.store))
+
+    def test_skips_companion_keys(self):
+        from ..bulk import iter_sessions
+        redis = self._makeRedis(count=3)
+        del redis.store['other']
+        self._add_companion_keys(redis)
+        sessions = list(iter_sessions(redis))
+        self.assertEqual([sid for sid, _ in sessions],
+                         ['session:%02d' % i for i in range(3)])
+
+    def test_skips_companion_keys_hash_storage(self):
+        from ..bulk import iter_sessions
+        redis = self._makeRedis(count=3, storage='hash')
+        del redis.store['other']
+        self._add_companion_keys(redis)
+        sessions = list(iter_sessions(redis, storage='hash'))
+        self.assertEqual(len(sessions), 3)
+
+    def test_sharded(self):
+        from ..sharding import ShardedRedis
+        a, b = self._makeRedis(count=3), self._makeRedis(count=2)
+        redis = ShardedRedis([('a', a), ('b', b)])
+        self.assertEqual(len(self._callFUT(redis)), 5)
+
+
+class Test_scan_session_ids(_Base, unittest.TestCase):
+    def test_it(self):
+        from ..bulk import scan_session_ids
+        redis = self._makeRedis(count=5)
+        self.assertEqual(list(scan_session_ids(redis, 'session:', count=2)),
+                         ['session:%02d' % i for i in range(5)])
+
+
+class Test_fetch_sessions(_Base, unittest.TestCase):
+    def test_it(self):
+        from ..bulk import fetch_sessions
+        redis = self._makeRedis(count=3)
+        self.assertEqual(
+            fetch_sessions(redis, ['session:01', 'missing']),
+            [('session:01', _session(1.0, 100, n=1)), ('missing', None)])
+        self.assertEqual(fetch_sessions(redis, []), [])
+
+    def test_hash_storage(self):
+        from ..bulk import fetch_sessions
+        redis = self._makeRedis(count=3, storage='hash')
+        self.assertEqual(
+            fetch_sessions(redis, ['session:02', 'missing'], storage='hash'),
+            [('session:02', _session(2.0, 200, n=2)), ('missing', None)])
+
+
+    def _fetch_sharded(self, storage):
+        from . import DummyRedis
+        from ..bulk import fetch_sessions
+        from ..session import encode_hash_fields
+        from ..sharding import ShardedRedis
+        redis = ShardedRedis([(name, DummyRedis()) for name in 'ab'])
+        for i, session_id in enumerate(['{a}1', '{b}2', '{a}3']):
+            session = _session(float(i), n=i)
+            if storage == 'hash':
+                redis.hset(session_id, mapping=encode_hash_fields(
+                    session, cPickle.dumps))
+            else:
+                redis.set(session_id, cPickle.dumps(session))
+        self.assertEqual(
+            fetch_sessions(redis, ['{b}2', '{a}1', '{b}missing', '{a}3'],
+                           storage=storage),
+            [('{b}2', _session(1.0, n=1)), ('{a}1', _session(0.0, n=0)),
+             ('{b}missing', None), ('{a}3', _session(2.0, n=2))])
+
+    def test_sharded(self):
+        self._fetch_sharded('string')
+
+    def test_sharded_hash_storage(self):
+        self._fetch_sharded('hash')
+
+class Test_iter_sessions_framed(unittest.TestCase):
+    def test_it(self):
+        from . import DummyRedis
+        from ..bulk import iter_sessions
+        from ..framing import encode_framed
+        redis = DummyRedis()
+        redis.set('session:a', encode_framed(_session(1.0, n=1),
+                                             cPickle.dumps))
+        redis.set('session:b', cPickle.dumps(_session(2.0, n=2)))
+        sessions = dict(iter_sessions(redis, prefix='session:',
+                                      storage='framed'))
+        self.assertEqual(sessions, {'session:a': _session(1.0, n=1),
+                                    'session:b': _session(2.0, n=2)})
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from ..compat import cPickle
+
+
+class TestSessionCache(unittest.TestCase):
+    def _makeOne(self, **kw):
+        from ..cache import SessionCache
+        return SessionCache(**kw)
+
+    def test_checkout_removes_entry(self):
+        cache = self._makeOne()
+        cache.put('id', 1, 'state', 10)
+        entry = cache.checkout('id')
+        self.assertEqual((entry.version, entry.state), (1, 'state'))
+        self.assertIsNone(cache.checkout('id'))
+        self.assertEqual(cache.size, 0)
+
+    def test_evicts_least_recently_used_entry(self):
+        cache = self._makeOne(max_entries=2)
+        cache.put('a', 1, 'a', 1)
+        cache.put('b', 1, 'b', 1)
+        cache.put('c', 1, 'c', 1)
+        self.assertNotIn('a', cache)
+        self.assertEqual(len(cache), 2)
+
+    def test_evicts_to_stay_within_max_bytes(self):
+        cache = self._makeOne(max_bytes=10)
+        cache.put('a', 1, 'a', 6)
+        cache.put('b', 1, 'b', 6)
+        self.assertNotIn('a', cache)
+        self.assertEqual(cache.size, 6)
+
+    def test_oversized_entry_not_cached(self):
+        cache = self._makeOne(max_bytes=10)
+        cache.put('a', 1, 'a', 11)
+        self.assertEqual(len(cache), 0)
+
+
+class Test_load_versioned(unittest.TestCase):
+    def _set_up(self, version=None):
+        from . import DummyRedis
+        from ..cache import SessionCache
+        from ..session import RedisSession
+        redis = DummyRedis()
+        redis.set('id', cPickle.dumps({
+            'managed_dict': {'a': 1}, 'created': 1.0, 'timeout': 300}))
+        if version is not None:
+            redis.set('id:version', version)
+        return SessionCache(), RedisSession, redis
+
+    def _callFUT(self, *arg, **kw):
+        from ..cache import load_versioned
+        return load_versioned(*arg, **kw)
+
+    def test_miss_reads_payload_and_version(self):
+        cache, session_class, redis = self._set_up(version=2)
+        state, serialized, version, ttl = self._callFUT(
+            cache, session_class, redis, 'id')
+        self.assertIsNone(state)
+        self.assertEqual(serialized, redis.store['id'])
+        self.assertEqual(version, 2)
+
+    def test_hit_with_current_version(self):
+        from ..session import _SessionState
+        cache, session_class, redis = self._set_up(version=2)
+        # cached by the request that created the session
+        cached = _SessionState('id', {}, 1.0, 60, new=True)
+        cache.put('id', 2, cached, 1)
+        state, serialized, version, ttl = self._callFUT(
+            cache, session_class, redis, 'id', touch_timeout=60)
+        self.assertEqual((state, serialized, version), (cached, None, 2))
+        self.assertIs(state.new, False)
+        self.assertEqual(redis.ttl('id'), 60)
+        self.assertEqual(redis.ttl('id:version'), 60)
+
+    def test_stale_version_reloads(self):
+        cache, session_class, redis = self._set_up(version=3)
+        cache.put('id', 2, 'state', 1)
+        state, serialized, version, ttl = self._callFUT(
+            cache, session_class, redis, 'id', with_ttl=True)
+        self.assertIsNone(state)
+        self.assertEqual(version, 3)
+
+    def test_missing_version_never_matches(self):
+        cache, session_class, redis = self._set_up()
+        cache.put('id', None, 'state', 1)
+        state, serialized, version, ttl = self._callFUT(
+            cache, session_class, redis, 'id')
+        self.assertIsNone(state)
+        self.assertIsNone(version)
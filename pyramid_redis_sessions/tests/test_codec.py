@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from ..compat import (
+    cPickle,
+    msgpack,
+    )
+
+
+class Test_codecs(unittest.TestCase):
+    def _roundtrip(self, name, data):
+        from ..codec import decode, encoder
+        payload = encoder(name)(data)
+        return payload, decode(payload)
+
+    def _makeSession(self):
+        return {
+            'managed_dict': {'_csrft_': u'abc', 'user_id': 42, 'cart': [1, 2]},
+            'created': 1234.5,
+            'timeout': 1200,
+            }
+
+    def test_pickle(self):
+        data = self._makeSession()
+        payload, result = self._roundtrip('pickle', data)
+        self.assertEqual(payload[:2], b'\x00p')
+        self.assertEqual(result, data)
+
+    def test_marshal(self):
+        data = self._makeSession()
+        payload, result = self._roundtrip('marshal', data)
+        self.assertEqual(payload[:2], b'\x00m')
+        self.assertEqual(result, data)
+
+    def test_json(self):
+        data = self._makeSession()
+        payload, result = self._roundtrip('json', data)
+        self.assertEqual(payload[:2], b'\x00j')
+        self.assertEqual(result, data)
+
+    @unittest.skipIf(msgpack is None, 'msgpack is not installed')
+    def test_msgpack(self):
+        data = self._makeSession()
+        payload, result = self._roundtrip('msgpack', data)
+        self.assertEqual(payload[:2], b'\x00g')
+        self.assertEqual(result, data)
+
+    def test_legacy_payload(self):
+        from ..codec import decode
+        data = self._makeSession()
+        self.assertEqual(decode(cPickle.dumps(data)), data)
+
+    def test_custom_legacy_deserializer(self):
+        from ..codec import decoder
+        deserialize = decoder(legacy=lambda payload: 'legacy')
+        self.assertEqual(deserialize(b'{}'), 'legacy')
+
+    def test_unknown_tag(self):
+        from ..codec import decode
+        self.assertRaises(ValueError, decode, b'\x00?data')
+
+    def test_unknown_codec(self):
+        from ..codec import encoder
+        self.assertRaises(ValueError, encoder, 'nope')
+
+    def test_register_codec(self):
+        from ..codec import (
+            _codecs_by_name,
+            _codecs_by_tag,
+            decode,
+            encoder,
+            register_codec,
+            )
+        register_codec('reversed', b'r', lambda obj: obj[::-1],
+                       lambda data: data[::-1])
+        try:
+            payload = encoder('reversed')(b'abc')
+            self.assertEqual(payload, b'\x00rcba')
+            self.assertEqual(decode(payload), b'abc')
+        finally:
+            del _codecs_by_name['reversed']
+            del _codecs_by_tag[b'r']
+
+    def test_register_codec_bad_tag(self):
+        from ..codec import register_codec
+        self.assertRaises(ValueError, register_codec, 'x', b'xy', None, None)
+        self.assertRaises(ValueError, register_codec, 'x', b'p', None, None)
+
+
+class Test_compression(unittest.TestCase):
+    def _makeSession(self, items=50):
+        return {
+            'managed_dict': {
+                'cart': [{'sku': 'SKU-%06d' % i, 'qty': 1} for i in range(items)],
+                },
+            'created': 1234.5,
+            'timeout': 1200,
+            }
+
+    def test_below_threshold_not_compressed(self):
+        from ..codec import decode, encoder
+        encode = encoder('pickle', compress_threshold=100000)
+        data = self._makeSession()
+        payload = encode(data)
+        self.assertEqual(payload[:2], b'\x00p')
+        self.assertEqual(decode(payload), data)
+
+    def test_above_threshold_compressed(self):
+        from ..codec import decode, encoder
+        encode = encoder('pickle', compress_threshold=100)
+        data = self._makeSession()
+        payload = encode(data)
+        self.assertEqual(payload[:2], b'\x01p')
+        self.assertLess(len(payload), len(encoder('pickle')(data)))
+        self.assertEqual(decode(payload), data)
+
+    def test_incompressible_payload_stored_plain(self):
+        import os
+        from ..codec import decode, encoder
+        encode = encoder('pickle', compress_threshold=1)
+        data = os.urandom(200)
+        payload = encode(data)
+        self.assertEqual(payload[:2], b'\x00p')
+        self.assertEqual(decode(payload), data)
+
+    def test_dictionary(self):
+        from ..codec import decode, encoder
+        data = self._makeSession(items=2)
+        zdict = encoder('pickle')(self._makeSession(items=10))
+        plain = encoder('pickle', compress_threshold=1)(data)
+        with_dict = encoder('pickle', compress_threshold=1, zdict=zdict)(data)
+        self.assertEqual(with_dict[:2], b'\x01p')
+        self.assertLess(len(with_dict), len(plain))
+        self.assertEqual(decode(with_dict), data)
+
+    def test_unknown_dictionary(self):
+        import zlib
+        from ..codec import decode
+        compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS, 9,
+                                      zlib.Z_DEFAULT_STRATEGY,
+                                      b'an unregistered dictionary')
+        payload = b'\x01p' + compressor.compress(b'data') + compressor.flush()
+        self.assertRaises(ValueError, decode, payload)
+
+    def test_train_dictionary(self):
+        from ..codec import (
+            _compress,
+            encoder,
+            train_dictionary,
+            )
+        encode = encoder('pickle')
+        samples = [
+            encode({'managed_dict': {'_csrft_': '%040d' % i,
+                                     'auth.userid': i,
+                                     'locale': 'en_US'},
+                    'created': float(i),
+                    'timeout': 1200})
+            for i in range(20)
+            ]
+        zdict = train_dictionary(samples, size=1024)
+        self.assertTrue(0 < len(zdict) <= 1024)
+        sample = samples[0]
+        self.assertLess(len(_compress(sample, 6, zdict)),
+                        len(_compress(sample, 6, None)))
@@ -46,3 +46,129 @@ class TestConnection(unittest.TestCase):
         self.assertNotIn('host', inst.opts)
         self.assertNotIn('port', inst.opts)
         self.assertNotIn('db', inst.opts)
+
+    def test_get_default_connection_pool_options(self):
+        from . import DummyRedis
+        from ..connection import (
+            BlockingSessionConnectionPool,
+            get_default_connection,
+            )
+        inst = get_default_connection(self.request,
+                                      redis_client=DummyRedis,
+                                      host='localhost',
+                                      port=999,
+                                      max_connections=5,
+                                      socket_keepalive=True,
+                                      pool_timeout=0.5)
+        pool = inst.connection_pool
+        self.assertIsInstance(pool, BlockingSessionConnectionPool)
+        self.assertEqual(pool.max_connections, 5)
+        self.assertEqual(pool.timeout, 0.5)
+        self.assertEqual(pool.connection_kwargs['port'], 999)
+        self.assertIs(pool.connection_kwargs['socket_keepalive'], True)
+
+    def test_get_default_connection_unset_pool_options(self):
+        from . import DummyRedis
+        from ..connection import get_default_connection
+        inst = get_default_connection(self.request,
+                                      redis_client=DummyRedis,
+                                      host='localhost',
+                                      max_connections=None,
+                                      pool_timeout=None)
+        self.assertEqual(inst.host, 'localhost')
+        self.assertFalse(hasattr(inst, 'connection_pool'))
+
+    def test_get_default_connection_with_url_and_pool_options(self):
+        from . import DummyRedis
+        from ..connection import (
+            SessionConnectionPool,
+            get_default_connection,
+            )
+        url = 'redis://localhost:6380/2'
+        inst = get_default_connection(self.request,
+                                      url=url,
+                                      redis_client=DummyRedis,
+                                      host='otherhost',
+                                      health_check_interval=30)
+        pool = inst.connection_pool
+        self.assertIsInstance(pool, SessionConnectionPool)
+        self.assertEqual(pool.connection_kwargs['port'], 6380)
+        self.assertEqual(pool.connection_kwargs['db'], 2)
+        self.assertEqual(pool.connection_kwargs['health_check_interval'], 30)
+
+    def test_get_default_connection_resets_pool_after_fork(self):
+        from . import DummyRedis
+        from ..connection import get_default_connection
+        resets = []
+        redis = DummyRedis(connection_pool=DummyRedis(
+            reset=lambda: resets.append(1)))
+        self.request.registry._redis_sessions = redis
+        self.request.registry._redis_sessions_pid = -1
+        inst = get_default_connection(self.request)
+        self.assertIs(inst, redis)
+        self.assertEqual(resets, [1])
+        get_default_connection(self.request)
+        self.assertEqual(resets, [1])
+
+    def test_get_replica_connections(self):
+        from . import DummyRedis
+        from ..connection import get_replica_connections
+        replicas = get_replica_connections(
+            self.request,
+            'redis://replica1:6379/0 redis://replica2:6379/0',
+            redis_client=DummyRedis,
+            host='localhost',
+            )
+        self.assertEqual([r.url for r in replicas],
+                         ['redis://replica1:6379/0', 'redis://replica2:6379/0'])
+        self.assertNotIn('host', replicas[0].opts)
+        self.assertIs(get_replica_connections(self.request, []), replicas)
+
+
+class TestPoolStats(unittest.TestCase):
+    def test_blocking_pool(self):
+        from redis.exceptions import ConnectionError
+        from ..connection import get_pool_stats, make_connection_pool
+        pool = make_connection_pool(max_connections=2, pool_timeout=0.01)
+        pool.pool.get()
+        conn = pool.make_connection()
+        pool.pool.get()
+        self.assertRaises(ConnectionError, pool.get_connection)
+        pool.pool.put(conn)
+        self.assertEqual(get_pool_stats(pool), {
+            'max_connections': 2,
+            'created': 1,
+            'in_use': 0,
+            'idle': 1,
+            'waiting': 0,
+            'exhausted': 1,
+            })
+
+    def test_non_blocking_pool(self):
+        from redis.exceptions import ConnectionError
+        from . import DummyRedis
+        from ..connection import get_pool_stats, make_connection_pool
+        pool = make_connection_pool(max_connections=1)
+        conn = pool.make_connection()
+        pool._in_use_connections.add(conn)
+        self.assertRaises(ConnectionError, pool.get_connection)
+        stats = get_pool_stats(DummyRedis(connection_pool=pool))
+        self.assertEqual(stats['created'], 1)
+        self.assertEqual(stats['in_use'], 1)
+        self.assertEqual(stats['idle'], 0)
+        self.assertEqual(stats['exhausted'], 1)
+
+    def test_plain_redis_py_pool(self):
+        from redis import ConnectionPool
+        from ..connection import get_pool_stats
+        stats = get_pool_stats(ConnectionPool())
+        self.assertEqual(stats['created'], 0)
+        self.assertEqual(stats['waiting'], 0)
+
+    def test_reset_after_fork(self):
+        from ..connection import _reset_pools_after_fork, make_connection_pool
+        pool = make_connection_pool(max_connections=1)
+        pool._in_use_connections.add(pool.make_connection())
+        _reset_pools_after_fork()
+        self.assertEqual(pool._created_connections, 0)
+        self.assertEqual(len(pool._in_use_connections), 0)
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+
+class Test_serialize_cookie(unittest.TestCase):
+    def _callFUT(self, session_id, secret='secret', format='compact'):
+        from ..cookie import serialize_cookie
+        return serialize_cookie(session_id, secret, format)
+
+    def _deserialize(self, cookieval, secret='secret', **kw):
+        from ..cookie import deserialize_cookie
+        return deserialize_cookie(cookieval, secret, **kw)
+
+    def test_compact_hex_id(self):
+        from ..util import _generate_session_id
+        session_id = _generate_session_id()
+        cookieval = self._callFUT(session_id)
+        self.assertEqual(self._deserialize(cookieval), session_id)
+        # 33 bytes of payload and 32 of signature, base64 encoded
+        self.assertEqual(len(cookieval), 44 + 1 + 43)
+
+    def test_compact_text_id(self):
+        for session_id in ('prefix:abc', 'ABCD', 'abc', u'caf\xe9'):
+            cookieval = self._callFUT(session_id)
+            self.assertEqual(self._deserialize(cookieval), session_id)
+
+    def test_compact_is_url_safe(self):
+        cookieval = self._callFUT('\xff' * 40)
+        for char in '+/=':
+            self.assertNotIn(char, cookieval)
+
+    def test_legacy(self):
+        from pyramid.session import signed_serialize
+        cookieval = self._callFUT('id', format='legacy')
+        self.assertEqual(cookieval, signed_serialize('id', 'secret'))
+        self.assertEqual(self._deserialize(cookieval), 'id')
+
+    def test_unknown_format(self):
+        self.assertRaises(ValueError, self._callFUT, 'id', format='json')
+
+    def test_wrong_secret(self):
+        cookieval = self._callFUT('id')
+        self.assertRaises(ValueError, self._deserialize, cookieval,
+                          secret='other')
+
+    def test_tampered_payload(self):
+        from ..cookie import _b64encode
+        cookieval = self._callFUT('id')
+        signature = cookieval.split('.')[1]
+        forged = _b64encode(b'\x01other') + '.' + signature
+        self.assertRaises(ValueError, self._deserialize, forged)
+
+    def test_malformed(self):
+        for cookieval in ('.', 'abc.', '!!!.???', 'a.b.c'):
+            self.assertRaises(ValueError, self._deserialize, cookieval)
+
+    def test_legacy_not_accepted(self):
+        cookieval = self._callFUT('id', format='legacy')
+        self.assertRaises(ValueError, self._deserialize, cookieval,
+                          accept_legacy=False)
+
+
+class TestVerifiedCookieCache(unittest.TestCase):
+    def _makeOne(self, **kw):
+        from ..cookie import VerifiedCookieCache
+        return VerifiedCookieCache(**kw)
+
+    def test_get(self):
+        cache = self._makeOne()
+        self.assertIsNone(cache.get('cookie'))
+        cache.put('cookie', 'id')
+        self.assertEqual(cache.get('cookie'), 'id')
+
+    def test_evicts_least_recently_used(self):
+        cache = self._makeOne(max_entries=2)
+        cache.put('a', 'a')
+        cache.put('b', 'b')
+        cache.get('a')
+        cache.put('c', 'c')
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 'a')
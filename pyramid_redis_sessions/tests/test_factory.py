@@ -57,6 +57,37 @@ class TestRedisSessionFactory(unittest.TestCase):
         self.assertEqual(session.session_id, session_id_in_cookie)
         self.assertIs(session.new, False)
 
+    def test_compact_cookie_format(self):
+        import webob
+        from ..cookie import deserialize_cookie
+        request = self._make_request()
+        session = self._makeOne(request, cookie_format='compact')
+        response = webob.Response()
+        request.response_callbacks[0](request, response)
+        cookieval = request.cookies['session'] = response.headers[
+            'Set-Cookie'].split(';')[0].split('=', 1)[1]
+        self.assertEqual(deserialize_cookie(cookieval, 'secret',
+                                            accept_legacy=False),
+                         session.session_id)
+        reloaded = self._makeOne(request, cookie_format='compact')
+        self.assertEqual(reloaded.session_id, session.session_id)
+        self.assertIs(reloaded.new, False)
+
+    def test_legacy_cookie_not_accepted(self):
+        request = self._make_request()
+        session_id = self._get_session_id(request)
+        self._set_session_cookie(request=request, session_id=session_id)
+        session = self._makeOne(request, cookie_format='compact',
+                                cookie_accept_legacy=False)
+        self.assertNotEqual(session.session_id, session_id)
+        self.assertIs(session.new, True)
+
+    def test_bad_cookie_format(self):
+        from pyramid.exceptions import ConfigurationError
+        from .. import RedisSessionFactory
+        self.assertRaises(ConfigurationError, RedisSessionFactory, 'secret',
+                          cookie_format='json')
+
     def test_ctor_with_bad_cookie(self):
         request = self._make_request()
         session_id_in_cookie = self._get_session_id(request)
@@ -479,6 +510,18 @@ class TestRedisSessionFactory(unittest.TestCase):
         inst = self._makeOne(request, client_callable=client_callable)
         self.assertEqual(inst.redis, redis)
 
+    def test_client_callable_gets_client_options(self):
+        from redis import StrictRedis
+        request = self._make_request()
+        clients = []
+        def client_callable(request, **redis_options):
+            # StrictRedis only connects once a command is sent
+            clients.append(StrictRedis(**redis_options))
+            return request.registry._redis_sessions
+        self._makeOne(request, client_callable=client_callable,
+                      max_connections=10, pool_timeout=5)
+        self.assertEqual(len(clients), 1)
+
     def test_session_factory_from_settings(self):
         from .. import session_factory_from_settings
         request = self._make_request()
@@ -486,3 +529,554 @@ class TestRedisSessionFactory(unittest.TestCase):
                     'redis.sessions.timeout': '999'}
         inst = session_factory_from_settings(settings)(request)
         self.assertEqual(inst.timeout, 999)
+
+    def test_write_back_persists_once_in_response_callback(self):
+        import webob
+        request = self._make_request()
+        session = request.session = self._makeOne(request, write_back=True)
+        session['a'] = 1
+        session['b'] = 2
+        redis = request.registry._redis_sessions
+        self.assertEqual(session.from_redis()['managed_dict'], {})
+        response = webob.Response()
+        for callback in request.response_callbacks:
+            callback(request, response)
+        persisted = redis.get(session.session_id)
+        from ..compat import cPickle
+        self.assertEqual(cPickle.loads(persisted)['managed_dict'],
+                         {'a': 1, 'b': 2})
+        self.assertIs(session._dirty, False)
+
+    def test_write_back_skipped_on_exception(self):
+        import webob
+        request = self._make_request()
+        session = request.session = self._makeOne(request, write_back=True)
+        session['a'] = 1
+        request.exception = Exception()
+        response = webob.Response()
+        for callback in request.response_callbacks:
+            callback(request, response)
+        self.assertEqual(session.from_redis()['managed_dict'], {})
+        self.assertIs(session._dirty, True)
+
+    def test_write_back_joins_active_transaction(self):
+        hooks = []
+        class DummyTransaction(object):
+            def addAfterCommitHook(self, hook):
+                hooks.append(hook)
+        class DummyTM(object):
+            def get(self):
+                return DummyTransaction()
+        request = self._make_request()
+        request.environ['tm.active'] = True
+        request.tm = DummyTM()
+        session = request.session = self._makeOne(request, write_back=True)
+        self.assertEqual(len(request.response_callbacks), 1)
+        session['a'] = 1
+        hooks[0](False)
+        self.assertEqual(session.from_redis()['managed_dict'], {})
+        hooks[0](True)
+        self.assertEqual(session.from_redis()['managed_dict'], {'a': 1})
+
+    def test_valid_cookie_loads_with_single_get(self):
+        request = self._make_request()
+        session_id = self._get_session_id(request)
+        self._set_session_cookie(request=request, session_id=session_id)
+        redis = request.registry._redis_sessions
+        calls = []
+        get = redis.get
+        def recording_get(key):
+            calls.append(key)
+            return get(key)
+        redis.get = recording_get
+        redis.exists = None  # must not be called
+        session = self._makeOne(request)
+        self.assertEqual(calls, [session_id])
+        self.assertEqual(session.session_id, session_id)
+        self.assertIs(session.new, False)
+
+    def test_touch_on_load(self):
+        request = self._make_request()
+        session_id = self._get_session_id(request)
+        self._set_session_cookie(request=request, session_id=session_id)
+        redis = request.registry._redis_sessions
+        redis.timeouts[session_id] = 1
+        session = self._makeOne(request, timeout=100, touch_on_load=True)
+        self.assertIs(session.new, False)
+        self.assertEqual(redis.ttl(session_id), 100)
+
+    def test_touch_on_load_keeps_adjusted_timeout(self):
+        request = self._make_request()
+        session = self._makeOne(request)
+        session.adjust_timeout_for_session(555)
+        self._set_session_cookie(request=request,
+                                 session_id=session.session_id)
+        redis = request.registry._redis_sessions
+        self._makeOne(request, timeout=500, touch_on_load=True)
+        self.assertEqual(redis.ttl(session.session_id), 555)
+
+    def test_touch_on_load_with_scripts(self):
+        request = self._make_request()
+        session_id = self._get_session_id(request)
+        self._set_session_cookie(request=request, session_id=session_id)
+        redis = request.registry._redis_sessions
+        redis.timeouts[session_id] = 1
+        redis.getex = None  # must not be called
+        session = self._makeOne(request, timeout=100, touch_on_load=True,
+                                use_scripts=True)
+        self.assertIs(session.new, False)
+        self.assertEqual(redis.ttl(session_id), 100)
+        self.assertEqual(len(redis.loaded_scripts), 1)
+
+    def test_touch_on_load_requires_getex(self):
+        from pyramid.exceptions import ConfigurationError
+        request = self._make_request()
+        request.registry._redis_sessions.getex = None
+        self.assertRaises(ConfigurationError, self._makeOne, request,
+                          touch_on_load=True)
+
+    def test_touch_on_load_requires_getex_on_every_shard(self):
+        from pyramid.exceptions import ConfigurationError
+        from . import DummyRedis
+        from ..sharding import ShardedRedis
+        old = DummyRedis()
+        old.getex = None
+        sharded = ShardedRedis([('a', DummyRedis()), ('b', old)])
+        request = self._make_request()
+        self.assertRaises(ConfigurationError, self._makeOne, request,
+                          touch_on_load=True,
+                          client_callable=lambda request, **kw: sharded)
+
+    def test_touch_on_load_without_getex(self):
+        # hash sessions, scripts and the local cache touch with EXPIRE
+        for options in (dict(storage='hash'), dict(use_scripts=True),
+                        dict(local_cache=True)):
+            request = self._make_request()
+            created = self._makeOne(request, **options)
+            self._set_session_cookie(request=request,
+                                     session_id=created.session_id)
+            request.registry._redis_sessions.getex = None
+            session = self._makeOne(request, touch_on_load=True, **options)
+            self.assertEqual(session.session_id, created.session_id)
+            self.assertIs(session.new, False)
+
+    def _touch_existing_session(self, request, ttl, **kw):
+        import webob
+        session_id = self._get_session_id(request)
+        self._set_session_cookie(request=request, session_id=session_id)
+        redis = request.registry._redis_sessions
+        redis.timeouts[session_id] = ttl
+        expires = []
+        expire = redis.expire
+        def recording_expire(key, timeout):
+            expires.append(key)
+            expire(key, timeout)
+        redis.expire = recording_expire
+        session = request.session = self._makeOne(request, **kw)
+        for key in ('a', 'b', 'c'):
+            session.get(key)
+        self.assertEqual(expires, [])
+        response = webob.Response()
+        for callback in request.response_callbacks:
+            callback(request, response)
+        return expires
+
+    def test_refresh_policy_once(self):
+        request = self._make_request()
+        expires = self._touch_existing_session(request, 95,
+                                               refresh_policy='once')
+        self.assertEqual(len(expires), 1)
+
+    def test_refresh_policy_threshold_fresh_ttl(self):
+        request = self._make_request()
+        expires = self._touch_existing_session(request, 95,
+                                               refresh_policy='threshold',
+                                               refresh_threshold=0.5)
+        self.assertEqual(expires, [])
+
+    def test_refresh_policy_threshold_stale_ttl(self):
+        request = self._make_request()
+        expires = self._touch_existing_session(request, 10,
+                                               refresh_policy='threshold',
+                                               refresh_threshold=0.5)
+        self.assertEqual(len(expires), 1)
+        redis = request.registry._redis_sessions
+        self.assertEqual(redis.ttl(expires[0]), 100)
+
+    def test_refresh_policy_once_with_touch_on_load(self):
+        request = self._make_request()
+        expires = self._touch_existing_session(request, 10,
+                                               refresh_policy='once',
+                                               touch_on_load=True,
+                                               timeout=100)
+        self.assertEqual(expires, [])
+
+    def test_refresh_policy_invalid(self):
+        from pyramid.exceptions import ConfigurationError
+        from .. import RedisSessionFactory
+        self.assertRaises(ConfigurationError, RedisSessionFactory, 'secret',
+                          refresh_policy='sometimes')
+
+    def test_lazy_create_without_writes(self):
+        import webob
+        request = self._make_request()
+        session = request.session = self._makeOne(request, lazy_create=True)
+        self.assertEqual(session.get('key'), None)
+        self.assertIs(session.new, True)
+        redis = request.registry._redis_sessions
+        self.assertEqual(redis.store, {})
+        response = webob.Response()
+        request.response_callbacks[0](request, response)
+        self.assertNotIn('Set-Cookie', response.headers)
+
+    def test_lazy_create_first_write_creates_session(self):
+        import webob
+        request = self._make_request()
+        session = request.session = self._makeOne(request, lazy_create=True,
+                                                  timeout=100)
+        session['key'] = 'value'
+        redis = request.registry._redis_sessions
+        self.assertEqual(list(redis.store), [session.session_id])
+        self.assertEqual(redis.ttl(session.session_id), 100)
+        self.assertEqual(session.from_redis()['managed_dict'],
+                         {'key': 'value'})
+        response = webob.Response()
+        request.response_callbacks[0](request, response)
+        set_cookie_headers = response.headers.getall('Set-Cookie')
+        self.assertEqual(len(set_cookie_headers), 1)
+        self._assert_is_a_header_to_set_cookie(set_cookie_headers[0])
+
+    def test_lazy_create_with_write_back(self):
+        import webob
+        request = self._make_request()
+        session = request.session = self._makeOne(request, lazy_create=True,
+                                                  write_back=True)
+        session['a'] = 1
+        session['b'] = 2
+        redis = request.registry._redis_sessions
+        self.assertEqual(redis.store, {})
+        response = webob.Response()
+        for callback in request.response_callbacks:
+            callback(request, response)
+        self.assertEqual(list(redis.store), [session.session_id])
+        self.assertEqual(session.from_redis()['managed_dict'],
+                         {'a': 1, 'b': 2})
+        set_cookie_headers = response.headers.getall('Set-Cookie')
+        self.assertEqual(len(set_cookie_headers), 1)
+        self._assert_is_a_header_to_set_cookie(set_cookie_headers[0])
+
+    def test_lazy_create_existing_session_invalidate(self):
+        import webob
+        request = self._make_request()
+        self._set_session_cookie(request=request,
+                                 session_id=self._get_session_id(request))
+        session = request.session = self._makeOne(request, lazy_create=True)
+        session.invalidate()
+        self.assertIs(session.get('key'), None)
+        response = webob.Response()
+        request.response_callbacks[0](request, response)
+        set_cookie_headers = response.headers.getall('Set-Cookie')
+        self.assertEqual(len(set_cookie_headers), 1)
+        self.assertIn('Max-Age=0', set_cookie_headers[0])
+        redis = request.registry._redis_sessions
+        self.assertEqual(redis.store, {})
+
+    def test_hash_storage(self):
+        import webob
+        request = self._make_request()
+        session = request.session = self._makeOne(request, storage='hash')
+        session['key'] = 'value'
+        redis = request.registry._redis_sessions
+        self.assertIsInstance(redis.store[session.session_id], dict)
+        response = webob.Response()
+        request.response_callbacks[0](request, response)
+        self._set_session_cookie(request=request,
+                                 session_id=session.session_id)
+        existing = self._makeOne(request, storage='hash')
+        self.assertIs(existing.new, False)
+        self.assertEqual(dict(existing), {'key': 'value'})
+
+    def test_storage_invalid(self):
+        from pyramid.exceptions import ConfigurationError
+        from .. import RedisSessionFactory
+        self.assertRaises(ConfigurationError, RedisSessionFactory, 'secret',
+                          storage='list')
+
+    def test_codec(self):
+        request = self._make_request()
+        session = self._makeOne(request, codec='json')
+        session['key'] = 'value'
+        redis = request.registry._redis_sessions
+        self.assertEqual(redis.get(session.session_id)[:2], b'\x00j')
+        self.assertEqual(dict(session.from_redis()['managed_dict']),
+                         {'key': 'value'})
+
+    def test_codec_reads_legacy_sessions(self):
+        request = self._make_request()
+        session_id = self._get_session_id(request)
+        self._set_session_cookie(request=request, session_id=session_id)
+        session = self._makeOne(request, codec='json')
+        self.assertIs(session.new, False)
+        self.assertEqual(session.session_id, session_id)
+
+    def test_codec_invalid(self):
+        from pyramid.exceptions import ConfigurationError
+        from .. import RedisSessionFactory
+        self.assertRaises(ConfigurationError, RedisSessionFactory, 'secret',
+                          codec='nope')
+
+    def test_compression(self):
+        request = self._make_request()
+        session = self._makeOne(request, compress_threshold=50)
+        session['key'] = 'value' * 100
+        redis = request.registry._redis_sessions
+        self.assertEqual(redis.get(session.session_id)[:2], b'\x01p')
+        self.assertEqual(session.from_redis()['managed_dict'],
+                         {'key': 'value' * 100})
+
+    def test_detect_changes(self):
+        import webob
+        request = self._make_request()
+        session_id = self._get_session_id(request)
+        self._set_session_cookie(request=request, session_id=session_id)
+        session = request.session = self._makeOne(request,
+                                                  detect_changes=True)
+        session['cart'] = []
+        session['cart'].append('item')  # no changed() call
+        response = webob.Response()
+        for callback in request.response_callbacks:
+            callback(request, response)
+        self.assertEqual(session.from_redis()['managed_dict'],
+                         {'cart': ['item']})
+
+    def test_detect_changes_unchanged(self):
+        import webob
+        request = self._make_request()
+        session_id = self._get_session_id(request)
+        self._set_session_cookie(request=request, session_id=session_id)
+        redis = request.registry._redis_sessions
+        session = request.session = self._makeOne(request,
+                                                  detect_changes=True)
+        redis.set = None  # must not be called
+        session.get('key')
+        response = webob.Response()
+        for callback in request.response_callbacks:
+            callback(request, response)
+
+    def _cached_request(self, factory, redis, session_id):
+        import webob
+        request = testing.DummyRequest()
+        request.registry._redis_sessions = redis
+        request.exception = None
+        self._set_session_cookie(request=request, session_id=session_id)
+        session = factory(request)
+        def finish():
+            response = webob.Response()
+            for callback in request.response_callbacks:
+                callback(request, response)
+        return session, finish
+
+    def test_local_cache_reuses_current_session(self):
+        from .. import RedisSessionFactory
+        factory = RedisSessionFactory('secret', local_cache=True)
+        request = self._make_request()
+        redis = request.registry._redis_sessions
+        session_id = self._get_session_id(request)
+        session, finish = self._cached_request(factory, redis, session_id)
+        session['key'] = 'value'
+        finish()
+        self.assertEqual(redis.get(session_id + ':version'), 1)
+
+        def no_payload_reads(key):
+            self.assertEqual(key, session_id + ':version')
+            return redis.store.get(key)
+        redis.get = no_payload_reads
+        session, finish = self._cached_request(factory, redis, session_id)
+        self.assertEqual(session['key'], 'value')
+        finish()
+
+    def test_local_cache_reloads_session_written_elsewhere(self):
+        from .. import RedisSessionFactory
+        factory = RedisSessionFactory('secret', local_cache=True)
+        other = RedisSessionFactory('secret', local_cache=True)
+        request = self._make_request()
+        redis = request.registry._redis_sessions
+        session_id = self._get_session_id(request)
+        session, finish = self._cached_request(factory, redis, session_id)
+        session['key'] = 'value'
+        finish()
+        session, finish = self._cached_request(other, redis, session_id)
+        session['key'] = 'other'
+        finish()
+        session, finish = self._cached_request(factory, redis, session_id)
+        self.assertEqual(session['key'], 'other')
+
+    def test_local_cache_skips_unsaved_changes(self):
+        from .. import RedisSessionFactory
+        factory = RedisSessionFactory('secret', local_cache=True)
+        request = self._make_request()
+        redis = request.registry._redis_sessions
+        session_id = self._get_session_id(request)
+        session, finish = self._cached_request(factory, redis, session_id)
+        session['cart'] = []
+        session['cart'].append('item')  # never saved
+        finish()
+        session, finish = self._cached_request(factory, redis, session_id)
+        self.assertEqual(session['cart'], [])
+
+    def test_local_cache_resumed_session_is_not_new(self):
+        import webob
+        from .. import RedisSessionFactory
+        factory = RedisSessionFactory('secret', local_cache=True,
+                                      refresh_policy='once')
+        request = self._make_request()
+        redis = request.registry._redis_sessions
+        session = factory(request)
+        self.assertIs(session.new, True)
+        session['key'] = 'value'
+        response = webob.Response()
+        for callback in request.response_callbacks:
+            callback(request, response)
+        session_id = session.session_id
+
+        expires = []
+        expire = redis.expire
+        def recording_expire(key, timeout):
+            expires.append(key)
+            expire(key, timeout)
+        redis.expire = recording_expire
+        request = testing.DummyRequest()
+        request.registry._redis_sessions = redis
+        request.exception = None
+        self._set_session_cookie(request=request, session_id=session_id)
+        session = factory(request)
+        self.assertIs(session.new, False)
+        self.assertEqual(session['key'], 'value')
+        response = webob.Response()
+        for callback in request.response_callbacks:
+            callback(request, response)
+        self.assertNotIn('Set-Cookie', response.headers)
+        self.assertIn(session_id, expires)
+
+    def test_local_cache_with_scripts_merges_concurrent_writes(self):
+        from .. import RedisSessionFactory
+        factory = RedisSessionFactory('secret', local_cache=True,
+                                      use_scripts=True)
+        request = self._make_request()
+        redis = request.registry._redis_sessions
+        session_id = self._get_session_id(request)
+        first, finish_first = self._cached_request(factory, redis, session_id)
+        second, finish_second = self._cached_request(factory, redis,
+                                                     session_id)
+        first['a'] = 1
+        finish_first()
+        second['b'] = 2
+        finish_second()
+        self.assertEqual(redis.get(session_id + ':version'), 2)
+        session, finish = self._cached_request(factory, redis, session_id)
+        self.assertEqual(dict(session), {'a': 1, 'b': 2})
+
+
+    def test_local_cache_with_scripts_merges_detected_changes(self):
+        from .. import RedisSessionFactory
+        factory = RedisSessionFactory('secret', local_cache=True,
+                                      use_scripts=True, write_back=True,
+                                      detect_changes=True)
+        request = self._make_request()
+        redis = request.registry._redis_sessions
+        session_id = self._get_session_id(request)
+        session, finish = self._cached_request(factory, redis, session_id)
+        session['cart'] = []
+        session['other'] = 1
+        finish()
+        first, finish_first = self._cached_request(factory, redis, session_id)
+        second, finish_second = self._cached_request(factory, redis,
+                                                     session_id)
+        first['a'] = 1
+        finish_first()
+        second['cart'].append('item')  # no changed() call
+        finish_second()
+        session, finish = self._cached_request(factory, redis, session_id)
+        self.assertEqual(dict(session),
+                         {'a': 1, 'cart': ['item'], 'other': 1})
+
+    def test_local_cache_with_scripts_merges_clear(self):
+        from .. import RedisSessionFactory
+        factory = RedisSessionFactory('secret', local_cache=True,
+                                      use_scripts=True)
+        request = self._make_request()
+        redis = request.registry._redis_sessions
+        session_id = self._get_session_id(request)
+        session, finish = self._cached_request(factory, redis, session_id)
+        session['old'] = 1
+        finish()
+        first, finish_first = self._cached_request(factory, redis, session_id)
+        second, finish_second = self._cached_request(factory, redis,
+                                                     session_id)
+        first['a'] = 1
+        finish_first()
+        second.clear()
+        finish_second()
+        session, finish = self._cached_request(factory, redis, session_id)
+        self.assertEqual(dict(session), {'a': 1})
+    def _replica_request(self, replica, written=False):
+        request = self._make_request()
+        request.registry._redis_sessions_replicas = [replica]
+        session_id = self._get_session_id(request)
+        self._set_session_cookie(request=request, session_id=session_id)
+        if written:
+            request.cookies['session_written'] = '1'
+        return request, session_id
+
+    def test_replica_reads(self):
+        from . import DummyRedis
+        replica = DummyRedis()
+        request, session_id = self._replica_request(replica)
+        primary = request.registry._redis_sessions
+        replica.store = dict(primary.store)
+        primary.get = None  # must not be called
+        session = self._makeOne(request, replica_urls='redis://replica')
+        self.assertEqual(session.session_id, session_id)
+        self.assertIs(session.redis, primary)
+
+    def test_replica_miss_falls_back_to_primary(self):
+        from . import DummyRedis
+        request, session_id = self._replica_request(DummyRedis())
+        session = self._makeOne(request, replica_urls='redis://replica')
+        self.assertEqual(session.session_id, session_id)
+        self.assertIs(session.new, False)
+
+    def test_replica_skipped_after_write(self):
+        from . import DummyRedis
+        replica = DummyRedis()
+        replica.get = None  # must not be called
+        request, session_id = self._replica_request(replica, written=True)
+        session = self._makeOne(request, replica_urls='redis://replica')
+        self.assertEqual(session.session_id, session_id)
+
+    def test_replica_written_cookie(self):
+        import webob
+        from . import DummyRedis
+        request, session_id = self._replica_request(DummyRedis())
+        session = self._makeOne(request, replica_urls='redis://replica',
+                                replica_lag=1.5)
+        response = webob.Response()
+        for callback in request.response_callbacks:
+            callback(request, response)
+        self.assertNotIn('session_written', response.headers.get('Set-Cookie',
+                                                                 ''))
+        session['key'] = 'value'
+        for callback in request.response_callbacks:
+            callback(request, response)
+        cookie = response.headers['Set-Cookie']
+        self.assertIn('session_written=1', cookie)
+        self.assertIn('Max-Age=2', cookie)
+
+    def test_replica_invalid_combinations(self):
+        from pyramid.exceptions import ConfigurationError
+        from .. import RedisSessionFactory
+        self.assertRaises(ConfigurationError, RedisSessionFactory, 'secret',
+                          replica_urls='redis://replica', touch_on_load=True)
+        self.assertRaises(ConfigurationError, RedisSessionFactory, 'secret',
+                          replica_urls='redis://replica',
+                          shards='redis://a redis://b')
@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from pyramid import testing
+
+from ..compat import cPickle
+
+
+class CountingCodec(object):
+    def __init__(self):
+        self.dumped = []
+        self.loaded = []
+
+    def dumps(self, value):
+        self.dumped.append(value)
+        return cPickle.dumps(value)
+
+    def loads(self, payload):
+        value = cPickle.loads(payload)
+        self.loaded.append(value)
+        return value
+
+
+def _persisted(**managed):
+    return {'managed_dict': managed, 'created': 1.0, 'timeout': 300}
+
+
+class Test_encode_framed(unittest.TestCase):
+    def _callFUT(self, persisted, serialize=cPickle.dumps):
+        from ..framing import encode_framed
+        return encode_framed(persisted, serialize)
+
+    def test_roundtrip(self):
+        from ..framing import decode_framed, is_framed
+        payload = self._callFUT(_persisted(a=1, b=[1, 2], c=u'\xe9'))
+        self.assertTrue(is_framed(payload))
+        persisted = decode_framed(payload, cPickle.loads)
+        self.assertEqual(persisted['created'], 1.0)
+        self.assertEqual(persisted['timeout'], 300)
+        self.assertEqual(dict(persisted['managed_dict']),
+                         {'a': 1, 'b': [1, 2], 'c': u'\xe9'})
+
+    def test_empty(self):
+        from ..framing import decode_framed
+        persisted = decode_framed(self._callFUT(_persisted()), cPickle.loads)
+        self.assertEqual(len(persisted['managed_dict']), 0)
+
+    def test_json_codec(self):
+        from .. import codec
+        from ..framing import decode_framed
+        payload = self._callFUT(_persisted(a=1), codec.encoder('json'))
+        persisted = decode_framed(payload, codec.decoder())
+        self.assertEqual(persisted['timeout'], 300)
+        self.assertEqual(persisted['managed_dict']['a'], 1)
+
+    def test_non_string_key(self):
+        self.assertRaises(TypeError, self._callFUT,
+                          {'managed_dict': {1: 'a'}, 'created': 1.0,
+                           'timeout': 300})
+
+    def test_reuses_unread_frames(self):
+        from ..framing import decode_framed
+        codec = CountingCodec()
+        payload = self._callFUT(_persisted(small=1, large='x' * 1000))
+        persisted = decode_framed(payload, codec.loads)
+        persisted['managed_dict']['small'] = 2
+        codec.dumped = []
+        rewritten = self._callFUT(persisted, codec.dumps)
+        # only the metadata and the value that was set are serialized
+        self.assertEqual(codec.dumped, [2, (1.0, 300)])
+        self.assertEqual(
+            dict(decode_framed(rewritten, cPickle.loads)['managed_dict']),
+            {'small': 2, 'large': 'x' * 1000})
+
+
+    def test_reading_keeps_payload(self):
+        from ..framing import decode_framed
+        payload = self._callFUT(_persisted(a=1, b=2, c=3))
+        persisted = decode_framed(payload, cPickle.loads)
+        self.assertEqual(persisted['managed_dict']['b'], 2)
+        self.assertEqual(list(persisted['managed_dict']), ['a', 'b', 'c'])
+        self.assertEqual(self._callFUT(persisted), payload)
+
+class Test_decode_framed(unittest.TestCase):
+    def test_not_framed(self):
+        from ..framing import decode_framed
+        self.assertRaises(ValueError, decode_framed,
+                          cPickle.dumps(_persisted()), cPickle.loads)
+
+    def test_decode_either_format(self):
+        from ..framing import decode, encode_framed
+        persisted = _persisted(a=1)
+        self.assertEqual(decode(cPickle.dumps(persisted), cPickle.loads),
+                         persisted)
+        decoded = decode(encode_framed(persisted, cPickle.dumps),
+                         cPickle.loads)
+        self.assertEqual(decoded, persisted)
+        self.assertIs(type(decoded['managed_dict']), dict)
+
+
+class TestLazyDict(unittest.TestCase):
+    def _makeOne(self, **values):
+        from ..framing import decode_framed, encode_framed
+        self.codec = CountingCodec()
+        payload = encode_framed(_persisted(**values), cPickle.dumps)
+        return decode_framed(payload, self.codec.loads)['managed_dict']
+
+    def test_values_decoded_once_on_access(self):
+        inst = self._makeOne(a=1, b=2)
+        self.codec.loaded = []
+        self.assertTrue('a' in inst)
+        self.assertEqual(sorted(inst), ['a', 'b'])
+        self.assertEqual(len(inst), 2)
+        self.assertEqual(self.codec.loaded, [])
+        self.assertEqual(inst['a'], 1)
+        self.assertEqual(inst.get('a'), 1)
+        self.assertEqual(self.codec.loaded, [1])
+
+    def test_missing(self):
+        inst = self._makeOne(a=1)
+        self.assertRaises(KeyError, inst.__getitem__, 'b')
+        self.assertIsNone(inst.get('b'))
+
+    def test_mutations(self):
+        inst = self._makeOne(a=1, b=2, c=3)
+        inst['a'] = 10
+        del inst['b']
+        self.assertEqual(inst.pop('c'), 3)
+        self.assertEqual(inst.setdefault('d', 4), 4)
+        inst.update({'e': 5})
+        self.assertEqual(inst, {'a': 10, 'd': 4, 'e': 5})
+        self.assertEqual(inst.copy(), {'a': 10, 'd': 4, 'e': 5})
+        self.assertRaises(KeyError, inst.__delitem__, 'b')
+
+    def test_encoded_items_are_bytes(self):
+        inst = self._makeOne(a=1, b=2)
+        inst['a']
+        items = dict(inst.encoded_items(cPickle.dumps))
+        self.assertEqual(items, {'a': cPickle.dumps(1), 'b': cPickle.dumps(2)})
+        self.assertIsInstance(items['b'], bytes)
+
+    def test_clear(self):
+        inst = self._makeOne(a=1, b=2)
+        self.codec.loaded = []
+        inst.clear()
+        self.assertEqual(len(inst), 0)
+        self.assertEqual(self.codec.loaded, [])
+
+
+class TestRedisFramedSession(unittest.TestCase):
+    def setUp(self):
+        testing.setUp()
+
+    def tearDown(self):
+        testing.tearDown()
+
+    def _makeFactory(self, redis, **kw):
+        from .. import RedisSessionFactory
+        return RedisSessionFactory(
+            'secret',
+            client_callable=lambda request, **options: redis,
+            storage='framed',
+            **kw
+            )
+
+    def _request(self, factory, session_id):
+        from pyramid.session import signed_serialize
+        request = testing.DummyRequest()
+        request.exception = None
+        request.cookies['session'] = signed_serialize(session_id, 'secret')
+        return factory(request)
+
+    def test_only_used_values_are_decoded(self):
+        from . import DummyRedis
+        from ..framing import encode_framed
+        redis = DummyRedis()
+        redis.set('id', encode_framed(
+            _persisted(_csrft_='token', cache=list(range(1000))),
+            cPickle.dumps))
+        codec = CountingCodec()
+        factory = self._makeFactory(redis, deserialize=codec.loads)
+        session = self._request(factory, 'id')
+        self.assertEqual(session.get_csrf_token(), 'token')
+        session['flag'] = True
+        self.assertEqual(codec.loaded, [(1.0, 300), 'token'])
+        session = self._request(factory, 'id')
+        self.assertEqual(session['cache'], list(range(1000)))
+        self.assertIs(session['flag'], True)
+
+    def test_reads_plain_sessions(self):
+        from . import DummyRedis
+        from ..framing import is_framed
+        redis = DummyRedis()
+        redis.set('id', cPickle.dumps(_persisted(a=1)))
+        session = self._request(self._makeFactory(redis), 'id')
+        self.assertEqual(session['a'], 1)
+        session['b'] = 2
+        self.assertTrue(is_framed(redis.get('id')))
+        session = self._request(self._makeFactory(redis), 'id')
+        self.assertEqual(dict(session), {'a': 1, 'b': 2})
+
+    def test_new_session(self):
+        from . import DummyRedis
+        from ..framing import is_framed
+        redis = DummyRedis()
+        factory = self._makeFactory(redis)
+        request = testing.DummyRequest()
+        session = factory(request)
+        self.assertTrue(is_framed(redis.get(session.session_id)))
+        session['a'] = 1
+        session = self._request(factory, session.session_id)
+        self.assertEqual(session['a'], 1)
+
+    def test_write_back_unchanged_is_not_rewritten(self):
+        from . import DummyRedis
+        from ..framing import encode_framed
+        redis = DummyRedis()
+        payload = encode_framed(_persisted(a=1, b=[1]), cPickle.dumps)
+        redis.set('id', payload)
+        session = self._request(self._makeFactory(redis, write_back=True),
+                                'id')
+        session['a']
+        self.assertIs(session.persist_if_changed(), False)
+
+    def test_read_only_request_is_not_rewritten(self):
+        import webob
+        from pyramid.session import signed_serialize
+        from . import DummyRedis
+        from ..framing import encode_framed
+        redis = DummyRedis()
+        redis.set('id', encode_framed(_persisted(a=1, b=2), cPickle.dumps))
+        factory = self._makeFactory(redis, write_back=True,
+                                    detect_changes=True)
+        request = testing.DummyRequest()
+        request.exception = None
+        request.cookies['session'] = signed_serialize('id', 'secret')
+        session = factory(request)
+        self.assertEqual(session['b'], 2)
+        redis.set = None  # must not be called
+        response = webob.Response()
+        for callback in request.response_callbacks:
+            callback(request, response)
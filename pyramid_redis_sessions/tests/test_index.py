@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from pyramid import testing
+
+
+class TestUserIndex(unittest.TestCase):
+    def _makeOne(self, redis=None, **kw):
+        from . import DummyRedis
+        from ..index import UserIndex
+        if redis is None:
+            redis = DummyRedis()
+        return UserIndex(redis, 'auth.userid', **kw)
+
+    def _addSessions(self, inst, userid, *session_ids):
+        # bound at increasing times, oldest first
+        for score, session_id in enumerate(session_ids):
+            inst.redis.set(session_id, b'value')
+            inst.redis.set(session_id + ':version', 1)
+            inst.redis.zadd(inst.key(userid), {session_id: score})
+
+    def test_key(self):
+        inst = self._makeOne(prefix='idx:')
+        self.assertEqual(inst.key(42), 'idx:42')
+
+    def test_bind(self):
+        inst = self._makeOne()
+        inst.redis.set('a', b'value')
+        self.assertEqual(inst.bind('a', 42), [])
+        self.assertEqual(inst.session_ids(42), ['a'])
+
+    def test_bind_expires_index(self):
+        inst = self._makeOne()
+        inst.redis.set('a', b'value')
+        inst.bind('a', 42, timeout=300)
+        self.assertEqual(inst.redis.ttl(inst.key(42)), 300)
+
+    def test_bind_moves_from_previous(self):
+        inst = self._makeOne()
+        self._addSessions(inst, 1, 'a')
+        inst.bind('a', 2, previous=1)
+        self.assertEqual(inst.session_ids(1), [])
+        self.assertEqual(inst.session_ids(2), ['a'])
+
+    def test_bind_removes_expired(self):
+        inst = self._makeOne()
+        self._addSessions(inst, 42, 'a', 'b')
+        inst.redis.delete('a')
+        inst.redis.set('c', b'value')
+        self.assertEqual(inst.bind('c', 42), [])
+        self.assertEqual(inst.redis.zrange(inst.key(42), 0, -1), ['b', 'c'])
+
+    def test_bind_evicts_oldest(self):
+        inst = self._makeOne(max_sessions=2)
+        self._addSessions(inst, 42, 'a', 'b', 'c')
+        inst.redis.set('d', b'value')
+        self.assertEqual(inst.bind('d', 42), ['a', 'b'])
+        self.assertEqual(inst.session_ids(42), ['c', 'd'])
+        self.assertIsNone(inst.redis.get('a'))
+        self.assertIsNone(inst.redis.get('b:version'))
+        self.assertEqual(inst.redis.get('c'), b'value')
+
+    def test_unbind(self):
+        inst = self._makeOne()
+        self._addSessions(inst, 42, 'a', 'b')
+        inst.unbind('a', 42)
+        self.assertEqual(inst.session_ids(42), ['b'])
+        self.assertEqual(inst.redis.get('a'), b'value')
+
+    def test_session_ids_removes_expired(self):
+        inst = self._makeOne()
+        self._addSessions(inst, 42, 'a', 'b')
+        inst.redis.delete('b')
+        self.assertEqual(inst.session_ids(42), ['a'])
+        self.assertEqual(inst.redis.zrange(inst.key(42), 0, -1), ['a'])
+        self.assertEqual(inst.session_ids(7), [])
+
+    def test_invalidate_user(self):
+        inst = self._makeOne()
+        self._addSessions(inst, 42, 'a', 'b')
+        self._addSessions(inst, 7, 'c')
+        self.assertEqual(inst.invalidate_user(42), 2)
+        self.assertIsNone(inst.redis.get('a'))
+        self.assertIsNone(inst.redis.get('b'))
+        self.assertIsNone(inst.redis.get('a:version'))
+        self.assertNotIn(inst.key(42), inst.redis.store)
+        self.assertEqual(inst.session_ids(7), ['c'])
+        self.assertEqual(inst.invalidate_user(42), 0)
+
+    def test_sharded(self):
+        from . import DummyRedis
+        from ..sharding import ShardedRedis
+        redis = ShardedRedis([('a', DummyRedis()), ('b', DummyRedis())])
+        inst = self._makeOne(redis, max_sessions=1)
+        for session_id in ('{a}1', '{b}2'):
+            redis.set(session_id, b'value')
+        inst.bind('{a}1', 42)
+        self.assertEqual(inst.session_ids(42), ['{a}1'])
+        self.assertEqual(inst.bind('{b}2', 42), ['{a}1'])
+        self.assertIsNone(redis.get('{a}1'))
+
+
+    def test_sharded_with_metrics(self):
+        from . import DummyRedis
+        from ..metrics import InstrumentedRedis, MetricsCollector
+        from ..sharding import ShardedRedis
+        sharded = ShardedRedis([('a', DummyRedis()), ('b', DummyRedis())])
+        redis = InstrumentedRedis(sharded, MetricsCollector())
+        inst = self._makeOne(redis)
+        for session_id in ('{a}1', '{b}2'):
+            sharded.set(session_id, b'value')
+            inst.bind(session_id, 42)
+        self.assertEqual(inst.session_ids(42), ['{a}1', '{b}2'])
+
+class TestFactoryWithUserIndex(unittest.TestCase):
+    def setUp(self):
+        testing.setUp()
+
+    def tearDown(self):
+        testing.tearDown()
+
+    def _makeFactory(self, **kw):
+        from . import DummyRedis
+        from .. import RedisSessionFactory
+        self.redis = DummyRedis()
+        return RedisSessionFactory(
+            'secret',
+            client_callable=lambda request, **kw: self.redis,
+            user_key='auth.userid',
+            **kw
+            )
+
+    def _index(self, userid):
+        from ..index import UserIndex
+        return UserIndex(self.redis, 'auth.userid').session_ids(userid)
+
+    def _request(self, factory, session_id=None):
+        from pyramid.session import signed_serialize
+        request = testing.DummyRequest()
+        request.exception = None
+        if session_id is not None:
+            request.cookies['session'] = signed_serialize(session_id,
+                                                          'secret')
+        return factory(request)
+
+    def test_login_and_logout(self):
+        factory = self._makeFactory()
+        session = self._request(factory)
+        session['auth.userid'] = 42
+        self.assertEqual(self._index(42), [session.session_id])
+        session = self._request(factory, session.session_id)
+        self.assertEqual(session.user_index.user_key, 'auth.userid')
+        del session['auth.userid']
+        self.assertEqual(self._index(42), [])
+
+    def test_index_expires_with_sessions(self):
+        from ..index import UserIndex
+        factory = self._makeFactory(timeout=300)
+        session = self._request(factory)
+        session['auth.userid'] = 42
+        key = UserIndex(self.redis, 'auth.userid').key(42)
+        self.assertEqual(self.redis.ttl(key), 300)
+        self.redis.expire(key, 10)
+        session = self._request(factory, session.session_id)
+        session.do_refresh()
+        self.assertEqual(self.redis.ttl(key), 300)
+
+    def test_index_expires_with_sharded_sessions(self):
+        from . import DummyRedis
+        from .. import RedisSessionFactory
+        from ..index import UserIndex
+        from ..sharding import ShardedRedis
+        redis = ShardedRedis([('a', DummyRedis()), ('b', DummyRedis())])
+        index = UserIndex(redis, 'auth.userid')
+        ids = iter(['{a}1', '{b}2'])
+        factory = RedisSessionFactory(
+            'secret',
+            client_callable=lambda request, **kw: redis,
+            id_generator=lambda: next(ids),
+            user_key='auth.userid',
+            timeout=300,
+            )
+        for _ in range(2):
+            session = self._request(factory)
+            session['auth.userid'] = 42
+            redis.expire(index.key(42), 10)
+            session.do_refresh()
+            self.assertEqual(redis.ttl(index.key(42)), 300)
+        self.assertEqual(index.session_ids(42), ['{a}1', '{b}2'])
+
+    def test_unchanged_user_leaves_index_alone(self):
+        factory = self._makeFactory()
+        session = self._request(factory)
+        session['auth.userid'] = 42
+        session = self._request(factory, session.session_id)
+        calls = []
+        session.user_index.bind = lambda *arg, **kw: calls.append(arg)
+        session['other'] = 'value'
+        self.assertEqual(calls, [])
+
+    def test_switch_user(self):
+        factory = self._makeFactory()
+        session = self._request(factory)
+        session['auth.userid'] = 1
+        session['auth.userid'] = 2
+        self.assertEqual(self._index(1), [])
+        self.assertEqual(self._index(2), [session.session_id])
+
+    def test_invalidate(self):
+        factory = self._makeFactory()
+        session = self._request(factory)
+        session['auth.userid'] = 42
+        session.invalidate()
+        self.assertEqual(self._index(42), [])
+
+    def test_rotate(self):
+        factory = self._makeFactory()
+        session = self._request(factory)
+        session['auth.userid'] = 42
+        new_id = session.rotate()
+        self.assertEqual(self._index(42), [new_id])
+
+    def test_lazy_create_write_back(self):
+        factory = self._makeFactory(lazy_create=True, write_back=True)
+        session = self._request(factory)
+        session['auth.userid'] = 42
+        self.assertEqual(self._index(42), [])
+        session.do_persist()
+        self.assertEqual(self._index(42), [session.session_id])
+
+    def test_max_sessions_per_user(self):
+        factory = self._makeFactory(max_sessions_per_user=2)
+        session_ids = []
+        for _ in range(3):
+            session = self._request(factory)
+            session['auth.userid'] = 42
+            session_ids.append(session.session_id)
+        self.assertEqual(len(self._index(42)), 2)
+        self.assertEqual(sum(1 for session_id in session_ids
+                             if session_id in self.redis.store), 2)
+
+    def test_requires_redis_backend(self):
+        from pyramid.exceptions import ConfigurationError
+        from .. import RedisSessionFactory
+        self.assertRaises(ConfigurationError, RedisSessionFactory, 'secret',
+                          backend='memory', user_key='auth.userid')
@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from pyramid import testing
+
+from ..compat import cPickle
+
+
+class RecordingMetrics(object):
+    def __init__(self):
+        self.events = []
+
+    def __getattr__(self, name):
+        return lambda *arg: self.events.append((name,) + arg)
+
+    def names(self):
+        return [event[0] for event in self.events]
+
+
+class TestInstrumentedRedis(unittest.TestCase):
+    def _makeOne(self, redis=None):
+        from . import DummyRedis
+        from ..metrics import InstrumentedRedis
+        metrics = RecordingMetrics()
+        return InstrumentedRedis(redis or DummyRedis(), metrics), metrics
+
+    def test_command(self):
+        redis, metrics = self._makeOne()
+        self.assertIs(redis.set('key', 'value'), True)
+        self.assertEqual(redis.get('key'), 'value')
+        (name, commands, seconds, sent, received), _ = metrics.events
+        self.assertEqual(commands, ['set'])
+        self.assertEqual((sent, received), (8, 0))
+        self.assertEqual(metrics.events[1][1], ['get'])
+        self.assertEqual(metrics.events[1][4], 5)
+
+    def test_failed_command_is_reported(self):
+        from . import DummyRedis
+        def fail(key):
+            raise ValueError
+        redis, metrics = self._makeOne(DummyRedis(get=fail))
+        self.assertRaises(ValueError, redis.get, 'key')
+        self.assertEqual(metrics.events[0][1], ['get'])
+
+    def test_attribute(self):
+        redis, metrics = self._makeOne()
+        self.assertEqual(redis.store, {})
+        self.assertEqual(metrics.events, [])
+
+    def test_sharded_helpers_are_not_timed(self):
+        from . import DummyRedis
+        from ..sharding import ShardedRedis
+        sharded = ShardedRedis([('a', DummyRedis()), ('b', DummyRedis())])
+        redis, metrics = self._makeOne(sharded)
+        self.assertEqual(redis.node_name('{b}1'), 'b')
+        self.assertEqual(redis.nodes, sharded.nodes)
+        self.assertIs(redis.redis, sharded)
+        self.assertEqual(metrics.events, [])
+        redis.set('{b}1', 'value')
+        self.assertEqual(metrics.names(), ['redis_call'])
+
+    def test_sharded_bulk_fetch(self):
+        from . import DummyRedis
+        from ..bulk import fetch_sessions, iter_sessions
+        from ..sharding import ShardedRedis
+        sharded = ShardedRedis([('a', DummyRedis()), ('b', DummyRedis())])
+        redis, metrics = self._makeOne(sharded)
+        for session_id in ('{a}1', '{b}2'):
+            sharded.set(session_id, cPickle.dumps({'managed_dict': {}}))
+        self.assertEqual(len(fetch_sessions(redis, ['{a}1', '{b}2'])), 2)
+        self.assertEqual(len(list(iter_sessions(redis))), 2)
+
+    def test_pipeline(self):
+        redis, metrics = self._makeOne()
+        with redis.pipeline() as pipe:
+            pipe.set('key', 'value')
+            pipe.expire('key', 10)
+            self.assertEqual(pipe.execute(), [True, None])
+        self.assertEqual(len(metrics.events), 1)
+        self.assertEqual(metrics.events[0][1], ['set', 'expire'])
+        self.assertEqual(metrics.events[0][3], 11)
+
+    def test_pipeline_watch(self):
+        redis, metrics = self._makeOne()
+        with redis.pipeline() as pipe:
+            pipe.watch('key')
+            pipe.exists('key')
+            pipe.multi()
+            pipe.set('key', 'value')
+            pipe.execute()
+        self.assertEqual([event[1] for event in metrics.events],
+                         [['watch'], ['exists'], ['set']])
+
+    def test_empty_pipeline_not_reported(self):
+        redis, metrics = self._makeOne()
+        with redis.pipeline() as pipe:
+            pipe.execute()
+        self.assertEqual(metrics.events, [])
+
+
+class Test_timed_serializer(unittest.TestCase):
+    def test_serializer(self):
+        from ..metrics import timed_serializer
+        metrics = RecordingMetrics()
+        serialize = timed_serializer(lambda data: data * 2, metrics)
+        self.assertEqual(serialize('ab'), 'abab')
+        self.assertEqual(metrics.names(), ['serialized'])
+        self.assertEqual(metrics.events[0][2], 4)
+
+    def test_deserializer(self):
+        from ..metrics import timed_deserializer
+        metrics = RecordingMetrics()
+        deserialize = timed_deserializer(lambda payload: payload[:1], metrics)
+        self.assertEqual(deserialize(b'abc'), b'a')
+        self.assertEqual(metrics.events[0][0], 'deserialized')
+        self.assertEqual(metrics.events[0][2], 3)
+
+
+class Test_timed(unittest.TestCase):
+    def _make_session(self, metrics):
+        from ..metrics import timed
+
+        class Session(object):
+            @timed('persisted')
+            def do_persist(self):
+                """Persist."""
+                return 'result'
+        session = Session()
+        session.metrics = metrics
+        return session
+
+    def test_it(self):
+        metrics = RecordingMetrics()
+        session = self._make_session(metrics)
+        self.assertEqual(session.do_persist(), 'result')
+        self.assertEqual(metrics.names(), ['persisted'])
+        self.assertEqual(session.do_persist.__doc__, 'Persist.')
+
+    def test_without_metrics(self):
+        session = self._make_session(None)
+        self.assertEqual(session.do_persist(), 'result')
+
+
+class TestMetricsCollector(unittest.TestCase):
+    def _makeOne(self):
+        from ..metrics import MetricsCollector
+        return MetricsCollector()
+
+    def test_redis_call(self):
+        inst = self._makeOne()
+        inst.redis_call(['set', 'expire'], 0.002, 10, 0)
+        inst.redis_call(['get'], 0.0001, 3, 100)
+        self.assertEqual(inst.counters['round_trips'], 2)
+        self.assertEqual(inst.counters['commands'], 3)
+        self.assertEqual(inst.counters['bytes_sent'], 13)
+        self.assertEqual(inst.counters['bytes_received'], 100)
+        histogram = inst.histograms['redis_seconds']
+        self.assertEqual(histogram.count, 2)
+        self.assertEqual(histogram.counts[0], 1)
+        self.assertEqual(histogram.counts[2], 1)
+
+    def test_sessions(self):
+        inst = self._makeOne()
+        inst.session_started(True)
+        inst.session_started(False)
+        inst.session_started(False)
+        inst.session_id_collision()
+        self.assertEqual(inst.counters['sessions_new'], 1)
+        self.assertEqual(inst.counters['sessions_resumed'], 2)
+        self.assertEqual(inst.counters['session_id_collisions'], 1)
+
+    def test_payload_size_histogram(self):
+        inst = self._makeOne()
+        inst.serialized(0.00001, 2000000)
+        histogram = inst.histograms['payload_bytes']
+        self.assertEqual(histogram.counts[-1], 1)
+        self.assertEqual(histogram.sum, 2000000)
+
+    def test_reset(self):
+        inst = self._makeOne()
+        inst.session_started(True)
+        inst.reset()
+        self.assertEqual(inst.counters['sessions_new'], 0)
+
+
+class TestFactoryMetrics(unittest.TestCase):
+    def setUp(self):
+        self.config = testing.setUp()
+
+    def tearDown(self):
+        testing.tearDown()
+
+    def _make_request(self, redis, cookie=None):
+        request = testing.DummyRequest()
+        request.registry._redis_sessions = redis
+        request.exception = None
+        if cookie is not None:
+            request.cookies['session'] = cookie
+        return request
+
+    def test_it(self):
+        from . import DummyRedis
+        from .. import RedisSessionFactory
+        from ..metrics import MetricsCollector
+        from pyramid.session import signed_serialize
+        metrics = MetricsCollector()
+        factory = RedisSessionFactory('secret', metrics=metrics)
+        redis = DummyRedis()
+        session = factory(self._make_request(redis))
+        session['key'] = 'value'
+        self.assertEqual(metrics.counters['sessions_new'], 1)
+        cookie = signed_serialize(session.session_id, 'secret')
+        session = factory(self._make_request(redis, cookie))
+        self.assertEqual(session['key'], 'value')
+        session.invalidate()
+        counters = metrics.counters
+        self.assertEqual(counters['sessions_resumed'], 1)
+        # create, write, load, refresh on read, delete
+        self.assertEqual(counters['round_trips'], 5)
+        histograms = metrics.histograms
+        self.assertEqual(histograms['serialize_seconds'].count, 2)
+        self.assertEqual(histograms['deserialize_seconds'].count, 2)
+        self.assertEqual(histograms['load_seconds'].count, 1)
+        self.assertEqual(histograms['persist_seconds'].count, 1)
+        self.assertEqual(histograms['refresh_seconds'].count, 1)
+        self.assertEqual(histograms['invalidate_seconds'].count, 1)
+
+    def test_session_id_collisions(self):
+        from . import DummyRedis
+        from ..metrics import MetricsCollector
+        from ..util import get_unique_session_id
+        metrics = MetricsCollector()
+        redis = DummyRedis()
+        redis.set('taken', 'value')
+        ids = iter(['taken', 'taken', 'free'])
+        session_id = get_unique_session_id(redis, 100, repr,
+                                           generator=lambda: next(ids),
+                                           metrics=metrics)
+        self.assertEqual(session_id, 'free')
+        self.assertEqual(metrics.counters['session_id_collisions'], 2)
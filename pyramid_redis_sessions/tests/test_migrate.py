@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from ..compat import cPickle
+
+
+def _session(**managed):
+    return {'managed_dict': managed, 'created': 1.0, 'timeout': 1200}
+
+
+class TestSessionMigrator(unittest.TestCase):
+    def setUp(self):
+        from . import DummyRedis
+        from .. import codec
+        self.redis = DummyRedis()
+        self.serialize = codec.encoder('json')
+
+    def _makeOne(self, **kw):
+        from ..migrate import SessionMigrator
+        return SessionMigrator(self.redis, self.serialize, **kw)
+
+    def test_migrate(self):
+        self.redis.set('a', cPickle.dumps(_session(x=1)), ex=300)
+        self.redis.set('b', self.serialize(_session(y=2)), ex=300)
+        stats = self._makeOne().migrate(['a', 'b', 'missing'])
+        self.assertEqual((stats.migrated, stats.unchanged, stats.missing),
+                         (1, 1, 1))
+        self.assertEqual(self.redis.get('a'), self.serialize(_session(x=1)))
+        # the time to live is kept
+        self.assertEqual(self.redis.ttl('a'), 300)
+
+    def test_conflict(self):
+        from ..codec import decoder
+        decode = decoder()
+        redis = self.redis
+        redis.set('a', cPickle.dumps(_session(x=1)))
+
+        def deserialize(payload):
+            # a request writes the session while it is being converted
+            redis.set('a', cPickle.dumps(_session(x=2)))
+            return decode(payload)
+        stats = self._makeOne(deserialize=deserialize).migrate(['a'])
+        self.assertEqual(stats.conflicts, 1)
+        self.assertEqual(cPickle.loads(redis.get('a')), _session(x=2))
+
+    def test_hash_storage(self):
+        from ..session import encode_hash_fields
+        self.redis.hset('a', mapping=encode_hash_fields(_session(x=1, y=2),
+                                                        cPickle.dumps))
+        self.redis.hset('a', 'k:y', self.serialize(2))
+        stats = self._makeOne(storage='hash').migrate(['a'])
+        self.assertEqual(stats.migrated, 1)
+        self.assertEqual(self.redis.hgetall('a'),
+                         encode_hash_fields(_session(x=1, y=2),
+                                            self.serialize))
+
+    def test_framed_storage(self):
+        from ..framing import encode_framed
+        self.redis.set('a', encode_framed(_session(x=1), cPickle.dumps))
+        self.redis.set('b', cPickle.dumps(_session(y=2)))
+        stats = self._makeOne(storage='framed').migrate(['a', 'b'])
+        self.assertEqual(stats.migrated, 2)
+        for session_id, session in (('a', _session(x=1)),
+                                    ('b', _session(y=2))):
+            self.assertEqual(self.redis.get(session_id),
+                             encode_framed(session, self.serialize))
+
+    def test_dry_run(self):
+        payload = cPickle.dumps(_session(x=1))
+        self.redis.set('a', payload)
+        stats = self._makeOne(dry_run=True).migrate(['a'])
+        self.assertEqual(stats.migrated, 1)
+        self.assertEqual(self.redis.get('a'), payload)
+
+    def test_empty(self):
+        self.assertEqual(self._makeOne().migrate([]).total, 0)
+
+
+class Test_migrate_sessions(unittest.TestCase):
+    def setUp(self):
+        from . import DummyRedis
+        from .. import codec
+        self.redis = DummyRedis()
+        for i in range(25):
+            self.redis.set('session:%d' % i, cPickle.dumps(_session(n=i)))
+        self.redis.set('other', b'value')
+        self.serialize = codec.encoder('json')
+
+    def _callFUT(self, **kw):
+        from ..migrate import migrate_sessions
+        return migrate_sessions(lambda: self.redis, self.serialize,
+                                prefix='session:', batch_size=4, **kw)
+
+    def test_it(self):
+        seen = []
+        stats = self._callFUT(progress=lambda stats: seen.append(stats.total))
+        self.assertEqual(stats.migrated, 25)
+        self.assertEqual(seen[-1], 25)
+        self.assertEqual(self.redis.get('session:3'),
+                         self.serialize(_session(n=3)))
+        self.assertEqual(self.redis.get('other'), b'value')
+        self.assertEqual(self._callFUT().unchanged, 25)
+
+    def test_skips_companion_keys(self):
+        from ..activity import ActivityTracker
+        from ..migrate import migrate_sessions
+        del self.redis.store['other']
+        ActivityTracker().record(self.redis, 'session:0')
+        stats = migrate_sessions(lambda: self.redis, self.serialize,
+                                 batch_size=4)
+        self.assertEqual(stats.migrated, 25)
+
+    def test_processes(self):
+        # the workers are forked with a copy of the in-memory store, so
+        # only their counts come back
+        stats = self._callFUT(processes=2, dry_run=True)
+        self.assertEqual(stats.migrated, 25)
+
+    def test_rate(self):
+        import time
+        start = time.time()
+        self._callFUT(rate=500)
+        self.assertTrue(time.time() - start >= 0.04)
+
+
+class Test_main(unittest.TestCase):
+    def test_codec_or_serialize_required(self):
+        from ..migrate import main
+        self.assertRaises(SystemExit, main, ['--url', 'redis://nowhere'])
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+try:
+    import pytest
+except ImportError: # pragma: no cover
+    pytest = None
+
+_TEST_MODULE = '''
+import pytest
+
+pytest_plugins = ['pyramid_redis_sessions.pytest_plugin']
+
+
+class Redis(object):
+    def get(self, key):
+        return None
+
+
+@pytest.mark.redis_budget(round_trips=1)
+def test_within_budget(redis_recorder):
+    redis_recorder.wrap(Redis()).get('a')
+
+
+@pytest.mark.redis_budget(round_trips=1)
+def test_over_budget(redis_recorder):
+    redis = redis_recorder.wrap(Redis())
+    redis.get('a')
+    redis.get('b')
+
+
+@pytest.mark.redis_budget(round_trips=1)
+def test_failing(redis_recorder):
+    redis = redis_recorder.wrap(Redis())
+    redis.get('a')
+    redis.get('b')
+    assert False, 'the test failed first'
+
+
+def test_without_marker(redis_recorder):
+    redis = redis_recorder.wrap(Redis())
+    redis.get('a')
+    redis.get('b')
+'''
+
+
+@unittest.skipIf(pytest is None, 'requires pytest')
+class TestPytestPlugin(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _runpytest(self, *args):
+        """Runs pytest on ``_TEST_MODULE`` in a separate process, and returns
+        its output."""
+        with open(os.path.join(self.tmpdir, 'test_budget.py'), 'w') as f:
+            f.write(_TEST_MODULE)
+        here = os.path.dirname(os.path.abspath(__file__))
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(
+            [os.path.dirname(os.path.dirname(here)),
+             env.get('PYTHONPATH', '')])
+        process = subprocess.Popen(
+            [sys.executable, '-m', 'pytest', '-p', 'no:cacheprovider'] +
+            list(args),
+            cwd=self.tmpdir,
+            env=env,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            )
+        return process.communicate()[0].decode('utf-8')
+
+    def test_redis_budget(self):
+        output = self._runpytest('-rfE')
+        self.assertIn('2 failed, 2 passed', output)
+        self.assertIn('2 round trips, expected at most 1', output)
+        self.assertIn('FAILED test_budget.py::test_over_budget', output)
+        self.assertIn('FAILED test_budget.py::test_failing', output)
+        self.assertNotIn('ERROR', output)
+
+    def test_marker_registered(self):
+        output = self._runpytest('-p', 'pyramid_redis_sessions.pytest_plugin',
+                                 '--markers')
+        self.assertIn('@pytest.mark.redis_budget(', output)
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+
+class TestScript(unittest.TestCase):
+    def _makeOne(self, source):
+        from ..scripts import Script
+        return Script(source)
+
+    def test_loads_script_on_noscript(self):
+        from . import DummyRedis
+        from ..scripts import LOAD_SESSION
+        redis = DummyRedis()
+        redis.set('id', 'data')
+        script = self._makeOne(LOAD_SESSION.source)
+        result = script(redis, ['id'], ['string', '', '', ''])
+        self.assertEqual(result, ['data', None, None, 0])
+        self.assertIn(script.sha, redis.loaded_scripts)
+
+    def test_sha(self):
+        from hashlib import sha1
+        script = self._makeOne('return 1')
+        self.assertEqual(script.sha, sha1(b'return 1').hexdigest())
+
+
+class Test_load_session(unittest.TestCase):
+    def _callFUT(self, redis, session_id, **kw):
+        from ..scripts import load_session
+        return load_session(redis, session_id, **kw)
+
+    def _set_up(self):
+        from . import DummyRedis
+        redis = DummyRedis()
+        redis.set('id', 'data', ex=300)
+        redis.set('id:version', 2, ex=300)
+        return redis
+
+    def test_load(self):
+        redis = self._set_up()
+        result = self._callFUT(redis, 'id')
+        self.assertEqual(result, ('data', None, None, False))
+
+    def test_load_missing(self):
+        redis = self._set_up()
+        result = self._callFUT(redis, 'missing')
+        self.assertEqual(result, (None, None, None, False))
+
+    def test_touch_resets_expire_times(self):
+        redis = self._set_up()
+        self._callFUT(redis, 'id', version_key='id:version', touch_timeout=60)
+        self.assertEqual(redis.ttl('id'), 60)
+        self.assertEqual(redis.ttl('id:version'), 60)
+
+    def test_with_ttl(self):
+        redis = self._set_up()
+        result = self._callFUT(redis, 'id', with_ttl=True)
+        self.assertEqual(result[2], 300)
+
+    def test_current_version_skips_payload(self):
+        redis = self._set_up()
+        result = self._callFUT(redis, 'id', version_key='id:version',
+                               cached_version=2)
+        self.assertEqual(result, (None, 2, None, True))
+
+    def test_stale_version_returns_payload(self):
+        redis = self._set_up()
+        result = self._callFUT(redis, 'id', version_key='id:version',
+                               cached_version=1)
+        self.assertEqual(result, ('data', 2, None, False))
+
+    def test_hash(self):
+        from . import DummyRedis
+        redis = DummyRedis()
+        redis.hset('id', mapping={'created': '1', 'k:a': '2'})
+        data, _, _, _ = self._callFUT(redis, 'id', storage='hash')
+        self.assertEqual(data, {'created': '1', 'k:a': '2'})
+
+    def test_hash_missing(self):
+        from . import DummyRedis
+        data, _, _, _ = self._callFUT(DummyRedis(), 'id', storage='hash')
+        self.assertIsNone(data)
+
+
+class Test_write_if_version(unittest.TestCase):
+    def _callFUT(self, redis, **kw):
+        from ..scripts import write_if_version
+        return write_if_version(redis, 'id', 'id:version', 'value', 300, **kw)
+
+    def test_writes_at_expected_version(self):
+        from . import DummyRedis
+        redis = DummyRedis()
+        redis.set('id:version', 2)
+        self.assertEqual(self._callFUT(redis, expected=2), 3)
+        self.assertEqual(redis.get('id'), 'value')
+        self.assertEqual(redis.ttl('id:version'), 300)
+
+    def test_writes_without_version(self):
+        from . import DummyRedis
+        redis = DummyRedis()
+        self.assertEqual(self._callFUT(redis), 1)
+
+    def test_conflict(self):
+        from . import DummyRedis
+        redis = DummyRedis()
+        redis.set('id:version', 3)
+        self.assertIsNone(self._callFUT(redis, expected=2))
+        self.assertNotIn('id', redis.store)
+
+    def test_force(self):
+        from . import DummyRedis
+        redis = DummyRedis()
+        redis.set('id:version', 3)
+        self.assertEqual(self._callFUT(redis, expected=2, force=True), 4)
@@ -9,7 +9,8 @@ from ..compat import cPickle
 
 class TestRedisSession(unittest.TestCase):
     def _makeOne(self, redis, session_id, new, new_session,
-                 serialize=cPickle.dumps, deserialize=cPickle.loads):
+                 serialize=cPickle.dumps, deserialize=cPickle.loads,
+                 **kw):
         from ..session import RedisSession
         return RedisSession(
             redis=redis,
@@ -18,6 +19,7 @@ class TestRedisSession(unittest.TestCase):
             new_session=new_session,
             serialize=serialize,
             deserialize=deserialize,
+            **kw
             )
 
     def _set_up_session_in_redis(self, redis, session_id, timeout,
@@ -37,7 +39,7 @@ class TestRedisSession(unittest.TestCase):
 
     def _set_up_session_in_Redis_and_makeOne(self, session_id=None,
                                              session_dict=None, new=True,
-                                             timeout=300):
+                                             timeout=300, **kw):
         from . import DummyRedis
         redis = DummyRedis()
         id_generator = self._make_id_generator()
@@ -57,6 +59,7 @@ class TestRedisSession(unittest.TestCase):
             session_id=session_id,
             new=new,
             new_session=new_session,
+            **kw
             )
 
     def test_init_new_session(self):
@@ -448,3 +451,380 @@ class TestRedisSession(unittest.TestCase):
         inst.adjust_timeout_for_session(adjusted_timeout)
         self.assertEqual(inst.timeout, adjusted_timeout)
         self.assertEqual(inst.from_redis()['timeout'], adjusted_timeout)
+
+    def test_do_persist(self):
+        inst = self._set_up_session_in_Redis_and_makeOne(timeout=100)
+        inst.managed_dict['key'] = 'value'
+        inst.do_persist()
+        self.assertEqual(inst.from_redis()['managed_dict'], {'key': 'value'})
+        self.assertEqual(inst.redis.ttl(inst.session_id), 100)
+
+    def test_write_back_defers_writes(self):
+        inst = self._set_up_session_in_Redis_and_makeOne(write_back=True)
+        inst['a'] = 1
+        inst.update({'b': 2})
+        inst.changed()
+        self.assertIs(inst._dirty, True)
+        self.assertEqual(inst.from_redis()['managed_dict'], {})
+        inst.do_persist()
+        self.assertIs(inst._dirty, False)
+        self.assertEqual(inst.from_redis()['managed_dict'], {'a': 1, 'b': 2})
+
+    def test_write_back_invalidate_discards_pending_writes(self):
+        inst = self._set_up_session_in_Redis_and_makeOne(write_back=True)
+        inst['a'] = 1
+        inst.invalidate()
+        self.assertIs(inst._dirty, False)
+
+    def test_init_with_serialized(self):
+        from . import DummyRedis
+        redis = DummyRedis()
+        serialized = cPickle.dumps({
+            'managed_dict': {'key': 'value'},
+            'created': 1.0,
+            'timeout': 300,
+            })
+        inst = self._makeOne(redis=redis, session_id='id', new=False,
+                             new_session=None, serialized=serialized)
+        self.assertNotIn('id', redis.store)
+        self.assertEqual(dict(inst), {'key': 'value'})
+
+    def test_lazy_create_after_invalidate(self):
+        inst = self._set_up_session_in_Redis_and_makeOne(lazy_create=True)
+        first_session_id = inst.session_id
+        inst.invalidate()
+        self.assertIs(inst.session_id, None)
+        self.assertIs(inst.new, True)
+        self.assertEqual(inst.timeout, 1200)
+        self.assertEqual(dict(inst), {})
+        self.assertEqual(inst.redis.store, {})
+        self.assertNotEqual(first_session_id, None)
+
+    def test_lazy_create_first_write(self):
+        from . import DummyRedis
+        redis = DummyRedis()
+        def new_session(timeout, value):
+            redis.set('new_id', value, ex=timeout)
+            return 'new_id'
+        inst = self._makeOne(redis=redis, session_id=None, new=True,
+                             new_session=new_session, lazy_create=True,
+                             timeout=100)
+        inst.invalidate()  # nothing to delete yet
+        inst['key'] = 'value'
+        self.assertEqual(inst.session_id, 'new_id')
+        self.assertEqual(redis.ttl('new_id'), 100)
+        self.assertEqual(inst.from_redis()['managed_dict'], {'key': 'value'})
+
+    def _count_sets(self, redis):
+        sets = []
+        set_ = redis.set
+        def recording_set(key, value, **kw):
+            sets.append(key)
+            set_(key, value, **kw)
+        redis.set = recording_set
+        return sets
+
+    def test_unchanged_session_not_written(self):
+        inst = self._set_up_session_in_Redis_and_makeOne(
+            session_dict={'a': 1}, timeout=100)
+        sets = self._count_sets(inst.redis)
+        inst['a'] = 1
+        inst.changed()
+        self.assertEqual(sets, [])
+        self.assertEqual(inst.redis.ttl(inst.session_id), 100)
+        self.assertIs(inst._dirty, False)
+
+    def test_unchanged_session_deferred_refresh(self):
+        inst = self._set_up_session_in_Redis_and_makeOne(
+            session_dict={'a': 1}, defer_refresh=True)
+        sets = self._count_sets(inst.redis)
+        inst.changed()
+        self.assertEqual(sets, [])
+        self.assertIs(inst._touched, True)
+
+    def test_write_after_unchanged_write(self):
+        inst = self._set_up_session_in_Redis_and_makeOne()
+        sets = self._count_sets(inst.redis)
+        inst['a'] = 1
+        inst['a'] = 1
+        inst['a'] = 2
+        self.assertEqual(len(sets), 2)
+        self.assertEqual(inst.from_redis()['managed_dict'], {'a': 2})
+
+    def test_persist_if_changed(self):
+        inst = self._set_up_session_in_Redis_and_makeOne(
+            session_dict={'a': [1]})
+        self.assertIs(inst.persist_if_changed(), False)
+        inst['a'].append(2)
+        self.assertIs(inst.persist_if_changed(), True)
+        self.assertEqual(inst.from_redis()['managed_dict'], {'a': [1, 2]})
+
+    def test_persist_if_changed_lazy_session(self):
+        inst = self._set_up_session_in_Redis_and_makeOne(lazy_create=True)
+        inst.invalidate()
+        self.assertIs(inst.persist_if_changed(), False)
+        self.assertEqual(inst.redis.store, {})
+
+    def _make_scripted(self, redis, version):
+        redis.set('id:version', version)
+        return self._makeOne(redis, 'id', False, None, versioned=True,
+                             version=version, scripted=True)
+
+    def test_scripted_write(self):
+        from . import DummyRedis
+        redis = DummyRedis()
+        self._set_up_session_in_redis(redis, 'id', 300, {'a': 1})
+        inst = self._make_scripted(redis, 1)
+        inst['a'] = 2
+        self.assertEqual(redis.get('id:version'), 2)
+        self.assertEqual(inst._session_state.version, 2)
+        self.assertEqual(cPickle.loads(redis.get('id'))['managed_dict'],
+                         {'a': 2})
+
+    def test_scripted_write_merges_concurrent_write(self):
+        from . import DummyRedis
+        redis = DummyRedis()
+        self._set_up_session_in_redis(redis, 'id', 300, {'a': 1, 'b': 1})
+        inst = self._make_scripted(redis, 1)
+        # another request writes the session after this one loaded it
+        self._set_up_session_in_redis(redis, 'id', 300,
+                                      {'a': 1, 'b': 2, 'c': 3})
+        redis.set('id:version', 2)
+        inst['a'] = 5
+        self.assertEqual(cPickle.loads(redis.get('id'))['managed_dict'],
+                         {'a': 5, 'b': 2, 'c': 3})
+        self.assertEqual(dict(inst), {'a': 5, 'b': 2, 'c': 3})
+        self.assertEqual(inst._session_state.version, 3)
+
+    def test_scripted_write_merges_deleted_key(self):
+        from . import DummyRedis
+        redis = DummyRedis()
+        self._set_up_session_in_redis(redis, 'id', 300, {'a': 1})
+        inst = self._make_scripted(redis, 1)
+        self._set_up_session_in_redis(redis, 'id', 300, {'a': 1, 'b': 2})
+        redis.set('id:version', 2)
+        del inst['a']
+        self.assertEqual(cPickle.loads(redis.get('id'))['managed_dict'],
+                         {'b': 2})
+
+    def test_scripted_write_after_clear_merges(self):
+        from . import DummyRedis
+        redis = DummyRedis()
+        self._set_up_session_in_redis(redis, 'id', 300, {'a': 1})
+        inst = self._make_scripted(redis, 1)
+        self._set_up_session_in_redis(redis, 'id', 300, {'a': 1, 'b': 2})
+        redis.set('id:version', 2)
+        inst.clear()
+        # the keys that were loaded are removed, the concurrent one is kept
+        self.assertEqual(cPickle.loads(redis.get('id'))['managed_dict'],
+                         {'b': 2})
+        self.assertEqual(redis.get('id:version'), 3)
+
+    def test_rotate(self):
+        inst = self._set_up_session_in_Redis_and_makeOne(
+            session_id='old', session_dict={'a': 1}, new=False)
+        inst.redis.set('old:version', 4)
+        calls = []
+        def new_session(**kw):
+            from ..util import get_unique_session_id
+            calls.append(kw)
+            return get_unique_session_id(inst.redis, serialize=repr,
+                                         generator=lambda: 'new', **kw)
+        inst._new_session = new_session
+        inst.versioned = True
+        self.assertEqual(inst.rotate(), 'new')
+        self.assertEqual(calls[0]['replace'], ['old', 'old:version'])
+        self.assertNotIn('old', inst.redis.store)
+        self.assertNotIn('old:version', inst.redis.store)
+        self.assertEqual(cPickle.loads(inst.redis.get('new'))['managed_dict'],
+                         {'a': 1})
+        self.assertEqual(inst.session_id, 'new')
+        self.assertIs(inst.new, True)
+        self.assertIsNone(inst._session_state.version)
+
+    def test_rotate_lazy_session(self):
+        inst = self._set_up_session_in_Redis_and_makeOne(
+            session_id=None, lazy_create=True)
+        inst._session_state.session_id = None
+        self.assertIsNone(inst.rotate())
+
+
+class TestRedisHashSession(unittest.TestCase):
+    def _makeOne(self, redis, session_id='id', new=False, **kw):
+        from ..session import RedisHashSession
+        return RedisHashSession(
+            redis=redis,
+            session_id=session_id,
+            new=new,
+            new_session=None,
+            **kw
+            )
+
+    def _set_up_session_in_redis(self, session_dict=None):
+        from . import DummyRedis
+        from ..session import encode_hash_fields
+        redis = DummyRedis()
+        redis.hset('id', mapping=encode_hash_fields({
+            'managed_dict': session_dict or {},
+            'created': 1.0,
+            'timeout': 300,
+            }, cPickle.dumps))
+        return redis
+
+    def test_init_existing_session(self):
+        redis = self._set_up_session_in_redis({'a': 1, 'b': [2]})
+        inst = self._makeOne(redis)
+        self.assertEqual(dict(inst), {'a': 1, 'b': [2]})
+        self.assertEqual(inst.created, 1.0)
+        self.assertEqual(inst.timeout, 300)
+
+    def test_fields(self):
+        redis = self._set_up_session_in_redis({'a': 1})
+        self.assertEqual(sorted(redis.store['id']),
+                         ['created', 'k:a', 'timeout'])
+
+    def test_setitem_only_writes_changed_field(self):
+        redis = self._set_up_session_in_redis({'a': 1, 'b': 2})
+        inst = self._makeOne(redis)
+        # change b behind the session's back to prove it isn't rewritten
+        redis.store['id']['k:b'] = cPickle.dumps('untouched')
+        inst['a'] = 10
+        persisted = inst.from_redis()['managed_dict']
+        self.assertEqual(persisted, {'a': 10, 'b': 'untouched'})
+        self.assertEqual(redis.ttl('id'), 300)
+
+    def test_delitem_and_pop_delete_fields(self):
+        redis = self._set_up_session_in_redis({'a': 1, 'b': 2, 'c': 3})
+        inst = self._makeOne(redis)
+        del inst['a']
+        self.assertEqual(inst.pop('b'), 2)
+        self.assertEqual(sorted(redis.store['id']),
+                         ['created', 'k:c', 'timeout'])
+
+    def test_update(self):
+        redis = self._set_up_session_in_redis({'a': 1})
+        inst = self._makeOne(redis)
+        inst.update([('b', 2), ('c', 3)])
+        self.assertEqual(inst.from_redis()['managed_dict'],
+                         {'a': 1, 'b': 2, 'c': 3})
+
+    def test_changed_writes_fields_changed_in_place(self):
+        redis = self._set_up_session_in_redis({'a': {'x': 1}, 'b': 2})
+        inst = self._makeOne(redis)
+        redis.store['id']['k:b'] = cPickle.dumps('untouched')
+        inst['a']['y'] = 2
+        inst.changed()
+        self.assertEqual(inst.from_redis()['managed_dict'],
+                         {'a': {'x': 1, 'y': 2}, 'b': 'untouched'})
+
+    def test_unchanged_field_not_written(self):
+        redis = self._set_up_session_in_redis({'a': 1})
+        inst = self._makeOne(redis)
+        hsets = []
+        redis.hset = lambda *arg, **kw: hsets.append(kw)
+        inst['a'] = 1
+        inst.changed()
+        self.assertEqual(hsets, [])
+        self.assertEqual(redis.ttl('id'), 300)
+
+    def test_persist_if_changed(self):
+        redis = self._set_up_session_in_redis({'a': [1]})
+        inst = self._makeOne(redis)
+        self.assertIs(inst.persist_if_changed(), False)
+        inst['a'].append(2)
+        self.assertIs(inst.persist_if_changed(), True)
+        self.assertEqual(inst.from_redis()['managed_dict'], {'a': [1, 2]})
+        self.assertIs(inst.persist_if_changed(), False)
+
+    def test_clear(self):
+        redis = self._set_up_session_in_redis({'a': 1})
+        inst = self._makeOne(redis)
+        inst.clear()
+        self.assertEqual(inst.from_redis()['managed_dict'], {})
+        self.assertEqual(inst.from_redis()['created'], 1.0)
+
+    def test_adjust_timeout_for_session(self):
+        redis = self._set_up_session_in_redis()
+        inst = self._makeOne(redis)
+        inst.adjust_timeout_for_session(600)
+        self.assertEqual(inst.from_redis()['timeout'], 600)
+        self.assertEqual(redis.ttl('id'), 600)
+
+    def test_flash(self):
+        redis = self._set_up_session_in_redis()
+        inst = self._makeOne(redis)
+        inst.flash('message')
+        inst.flash('message 2')
+        self.assertEqual(inst.from_redis()['managed_dict'],
+                         {'_f_': ['message', 'message 2']})
+
+    def test_load(self):
+        from ..session import RedisHashSession
+        redis = self._set_up_session_in_redis({'a': 1})
+        redis.timeouts['id'] = 50
+        fields, ttl = RedisHashSession.load(redis, 'id', with_ttl=True)
+        self.assertEqual(ttl, 50)
+        inst = self._makeOne(redis, serialized=fields)
+        self.assertEqual(dict(inst), {'a': 1})
+
+    def test_load_missing(self):
+        from . import DummyRedis
+        from ..session import RedisHashSession
+        result = RedisHashSession.load(DummyRedis(), 'id', touch_timeout=10)
+        self.assertEqual(result, (None, None))
+
+    def test_first_write_of_lazy_session(self):
+        from . import DummyRedis
+        from ..session import RedisHashSession
+        from ..session import encode_hash_fields
+        from ..util import get_unique_session_id
+        import functools
+        redis = DummyRedis()
+        new_session = functools.partial(
+            get_unique_session_id,
+            redis=redis,
+            timeout=300,
+            serialize=functools.partial(encode_hash_fields,
+                                        serialize=cPickle.dumps),
+            generator=lambda: 'new_id',
+            )
+        inst = RedisHashSession(redis=redis, session_id=None, new=True,
+                                new_session=new_session, lazy_create=True,
+                                timeout=300)
+        inst['a'] = 1
+        self.assertEqual(inst.session_id, 'new_id')
+        self.assertEqual(inst.from_redis()['managed_dict'], {'a': 1})
+
+    def test_versioned_write_increments_version(self):
+        redis = self._set_up_session_in_redis({'a': 1})
+        inst = self._makeOne(redis, versioned=True)
+        inst['a'] = 2
+        self.assertEqual(inst._session_state.version, 1)
+        self.assertEqual(redis.get('id:version'), 1)
+        self.assertEqual(redis.ttl('id:version'), 300)
+        inst['a'] = 2  # unchanged, no write
+        self.assertEqual(redis.get('id:version'), 1)
+
+    def test_versioned_invalidate_deletes_version(self):
+        redis = self._set_up_session_in_redis({'a': 1})
+        redis.set('id:version', 3)
+        inst = self._makeOne(redis, versioned=True)
+        inst.invalidate()
+        self.assertNotIn('id:version', redis.store)
+
+    def test_rotate(self):
+        import functools
+        from ..session import encode_hash_fields
+        from ..util import get_unique_session_id
+        redis = self._set_up_session_in_redis({'a': 1})
+        inst = self._makeOne(redis)
+        inst._new_session = functools.partial(
+            get_unique_session_id,
+            redis=redis,
+            serialize=functools.partial(encode_hash_fields,
+                                        serialize=cPickle.dumps),
+            generator=lambda: 'new_id',
+            )
+        self.assertEqual(inst.rotate(), 'new_id')
+        self.assertNotIn('id', redis.store)
+        self.assertEqual(inst.from_redis()['managed_dict'], {'a': 1})
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from pyramid import testing
+
+
+class TestShardedRedis(unittest.TestCase):
+    def _makeOne(self, names=('a', 'b', 'c')):
+        from . import DummyRedis
+        from ..sharding import ShardedRedis
+        return ShardedRedis([(name, DummyRedis()) for name in names])
+
+    def _distribution(self, sharded, keys):
+        return dict((key, sharded.node_name(key)) for key in keys)
+
+    def test_requires_nodes(self):
+        from ..sharding import ShardedRedis
+        self.assertRaises(ValueError, ShardedRedis, [])
+
+    def test_routes_commands_to_one_node(self):
+        sharded = self._makeOne()
+        sharded.set('key', 'value', ex=10)
+        node = sharded.node_for('key')
+        self.assertEqual(node.store, {'key': 'value'})
+        self.assertEqual(sharded.get('key'), 'value')
+        self.assertEqual(sharded.ttl('key'), 10)
+        others = [n for n in sharded.nodes.values() if n is not node]
+        self.assertEqual([n.store for n in others], [{}, {}])
+
+    def test_spreads_keys(self):
+        sharded = self._makeOne()
+        keys = ['session%d' % i for i in range(300)]
+        counts = {}
+        for name in self._distribution(sharded, keys).values():
+            counts[name] = counts.get(name, 0) + 1
+        self.assertEqual(sorted(counts), ['a', 'b', 'c'])
+        self.assertTrue(min(counts.values()) > 50)
+
+    def test_adding_a_node_moves_few_keys(self):
+        keys = ['session%d' % i for i in range(1000)]
+        before = self._distribution(self._makeOne(('a', 'b', 'c')), keys)
+        after = self._distribution(self._makeOne(('a', 'b', 'c', 'd')), keys)
+        moved = [key for key in keys if before[key] != after[key]]
+        # only keys that now belong to the new node move
+        self.assertEqual(set(after[key] for key in moved), set(['d']))
+        self.assertTrue(len(moved) < 400)
+
+    def test_version_key_follows_session(self):
+        sharded = self._makeOne()
+        for i in range(50):
+            session_id = 'session%d' % i
+            self.assertEqual(sharded.node_name(session_id),
+                             sharded.node_name(session_id + ':version'))
+
+    def test_tag_names_node(self):
+        sharded = self._makeOne()
+        self.assertEqual(sharded.node_name('{b}abc'), 'b')
+        self.assertEqual(sharded.node_name('{b}abc:version'), 'b')
+        self.assertEqual(sharded.node_name(b'{c}abc'), 'c')
+
+    def test_delete_groups_keys_by_node(self):
+        sharded = self._makeOne()
+        sharded.set('{a}x', 1)
+        sharded.set('{b}y', 2)
+        sharded.delete('{a}x', '{b}y')
+        self.assertEqual([n.store for n in sharded.nodes.values()],
+                         [{}, {}, {}])
+
+    def test_pipeline_binds_to_one_node(self):
+        sharded = self._makeOne()
+        with sharded.pipeline() as pipe:
+            pipe.set('{a}x', 1)
+            pipe.expire('{a}x', 10)
+            self.assertEqual(pipe.execute(), [True, None])
+            self.assertRaises(ValueError, pipe.get, '{b}y')
+        self.assertEqual(sharded.nodes['a'].store, {'{a}x': 1})
+
+    def test_unique_session_id(self):
+        from ..compat import cPickle
+        from ..util import get_unique_session_id
+        sharded = self._makeOne()
+        session_id = get_unique_session_id(sharded, timeout=100,
+                                           serialize=cPickle.dumps)
+        stores = [n.store for n in sharded.nodes.values() if n.store]
+        self.assertEqual(len(stores), 1)
+        self.assertIn(session_id, stores[0])
+
+    def test_scripts_run_on_session_node(self):
+        from ..scripts import load_session
+        sharded = self._makeOne()
+        sharded.set('{b}abc', 'data')
+        result = load_session(sharded, '{b}abc', version_key='{b}abc:version')
+        self.assertEqual(result[0], 'data')
+        self.assertRaises(ValueError, sharded.evalsha, 'sha', 2,
+                          '{a}x', '{b}y')
+
+
+class Test_parse_shards(unittest.TestCase):
+    def _callFUT(self, shards):
+        from ..sharding import parse_shards
+        return parse_shards(shards)
+
+    def test_string(self):
+        self.assertEqual(
+            self._callFUT('a=redis://h1:6379/0\n  redis://h2:6379/0'),
+            [('a', 'redis://h1:6379/0'),
+             ('redis://h2:6379/0', 'redis://h2:6379/0')])
+
+    def test_url_with_query(self):
+        url = 'redis://h1:6379/0?socket_timeout=1'
+        self.assertEqual(self._callFUT([url]), [(url, url)])
+
+
+class Test_tagged_id_generator(unittest.TestCase):
+    def test_it(self):
+        from ..sharding import tagged_id_generator
+        generate = tagged_id_generator(['a'], generator=lambda: 'id')
+        self.assertEqual(generate(), '{a}id')
+
+
+class TestShardedConnection(unittest.TestCase):
+    def setUp(self):
+        testing.setUp(self)
+
+    def tearDown(self):
+        testing.tearDown(self)
+
+    def test_get_default_connection_with_shards(self):
+        from . import DummyRedis
+        from ..connection import get_default_connection
+        request = testing.DummyRequest()
+        inst = get_default_connection(
+            request,
+            redis_client=DummyRedis,
+            shards='a=redis://h1:6379/0 b=redis://h2:6379/0',
+            host='localhost',
+            )
+        self.assertEqual(sorted(inst.nodes), ['a', 'b'])
+        self.assertEqual(inst.nodes['a'].url, 'redis://h1:6379/0')
+        self.assertNotIn('host', inst.nodes['b'].opts)
+        self.assertIs(request.registry._redis_sessions, inst)
+
+    def test_session_lifecycle_uses_one_node(self):
+        from . import DummyRedis
+        from .. import RedisSessionFactory
+        from ..sharding import ShardedRedis
+        sharded = ShardedRedis([(name, DummyRedis()) for name in 'abc'])
+        request = testing.DummyRequest()
+        factory = RedisSessionFactory(
+            'secret',
+            client_callable=lambda request, **kw: sharded,
+            local_cache=True,
+            )
+        session = factory(request)
+        session['key'] = 'value'
+        node = sharded.node_for(session.session_id)
+        self.assertEqual(sorted(node.store),
+                         [session.session_id, session.session_id + ':version'])
+        session.invalidate()
+        self.assertEqual([n.store for n in sharded.nodes.values()],
+                         [{}, {}, {}])
+
+    def _rotate_across_nodes(self, storage):
+        from . import DummyRedis
+        from .. import RedisSessionFactory
+        from ..sharding import ShardedRedis
+        sharded = ShardedRedis([(name, DummyRedis()) for name in 'abc'])
+        ids = iter(['{a}1', '{b}2', '{c}3', '{c}4'])
+        factory = RedisSessionFactory(
+            'secret',
+            client_callable=lambda request, **kw: sharded,
+            id_generator=lambda: next(ids),
+            storage=storage,
+            local_cache=True,
+            )
+        session = factory(testing.DummyRequest())
+        session['key'] = 'value'
+        for expected in ('{b}2', '{c}3', '{c}4'):
+            old_id = session.session_id
+            self.assertEqual(session.rotate(), expected)
+            self.assertEqual(session.from_redis()['managed_dict'],
+                             {'key': 'value'})
+            self.assertFalse(sharded.exists(old_id))
+            self.assertFalse(sharded.exists(old_id + ':version'))
+        self.assertEqual([sorted(sharded.nodes[name].store) for name in 'abc'],
+                         [[], [], ['{c}4']])
+
+    def test_rotate_across_nodes(self):
+        self._rotate_across_nodes('string')
+
+    def test_rotate_across_nodes_hash(self):
+        self._rotate_across_nodes('hash')
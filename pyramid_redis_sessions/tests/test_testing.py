@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+
+class TestRedisRecorder(unittest.TestCase):
+    def _makeOne(self):
+        from . import DummyRedis
+        from ..testing import RedisRecorder
+        recorder = RedisRecorder()
+        return recorder, recorder.wrap(DummyRedis())
+
+    def test_records_calls(self):
+        recorder, redis = self._makeOne()
+        redis.set('key', 'value')
+        with redis.pipeline() as pipe:
+            pipe.get('key')
+            pipe.expire('key', 10)
+            pipe.execute()
+        log = recorder.log
+        self.assertEqual(log.round_trips, 2)
+        self.assertEqual(log.commands, 3)
+        self.assertEqual(log.bytes, 8 + 3 + 5 + 3)
+        self.assertEqual([call.commands for call in log.calls],
+                         [['set'], ['get', 'expire']])
+        self.assertEqual(str(log), '  <SET (8 bytes sent, 0 received)>\n'
+                                   '  <GET EXPIRE (6 bytes sent, 5 received)>')
+
+    def test_reset(self):
+        recorder, redis = self._makeOne()
+        redis.get('key')
+        recorder.reset()
+        self.assertEqual(recorder.log.round_trips, 0)
+
+    def test_budget(self):
+        recorder, redis = self._makeOne()
+        redis.get('before')
+        with recorder.budget(round_trips=1, commands=1) as log:
+            redis.get('key')
+        self.assertEqual(log.round_trips, 1)
+
+    def test_budget_exceeded(self):
+        recorder, redis = self._makeOne()
+        try:
+            with recorder.budget(round_trips=1):
+                redis.get('key')
+                redis.expire('key', 10)
+        except AssertionError as e:
+            self.assertEqual(str(e), '2 round trips, expected at most 1:\n'
+                                     '  <GET (3 bytes sent, 0 received)>\n'
+                                     '  <EXPIRE (3 bytes sent, 0 received)>')
+        else:  # pragma: no cover
+            self.fail('budget not enforced')
+
+    def test_bytes_budget(self):
+        recorder, redis = self._makeOne()
+        def exceed():
+            with recorder.budget(bytes=10):
+                redis.set('key', 'a' * 10)
+        self.assertRaises(AssertionError, exceed)
@@ -22,6 +22,7 @@ class Test_parse_settings(unittest.TestCase):
             'redis.sessions.host'          : 'localhost',
             'redis.sessions.port'          : '1234',
             'redis.sessions.socket_timeout': '1234',
+            'redis.sessions.refresh_threshold': '0.25',
             'ignore.this.setting'          : '',
             }
         return settings
@@ -33,6 +34,7 @@ class Test_parse_settings(unittest.TestCase):
         self.assertEqual('localhost', inst['host'])
         self.assertEqual(1234, inst['port'])
         self.assertEqual(1234.0, inst['socket_timeout'])
+        self.assertEqual(0.25, inst['refresh_threshold'])
         self.assertNotIn('ignore.this.setting', inst)
 
     def test_minimal_configuration(self):
@@ -52,6 +54,62 @@ class Test_parse_settings(unittest.TestCase):
                     'redis.sessions.id_generator': 'test'}
         self.assertRaises(ConfigurationError, self._makeOne, settings)
 
+    def test_codec_and_serialize_raises_error(self):
+        from pyramid.exceptions import ConfigurationError
+        settings = {'redis.sessions.secret': 'test',
+                    'redis.sessions.codec': 'json',
+                    'redis.sessions.serialize': 'test'}
+        self.assertRaises(ConfigurationError, self._makeOne, settings)
+
+    def test_compression_and_serialize_raises_error(self):
+        from pyramid.exceptions import ConfigurationError
+        settings = {'redis.sessions.secret': 'test',
+                    'redis.sessions.compress_threshold': '100',
+                    'redis.sessions.serialize': 'test'}
+        self.assertRaises(ConfigurationError, self._makeOne, settings)
+
+    def test_compression_settings(self):
+        import os
+        import tempfile
+        fd, path = tempfile.mkstemp()
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(b'dictionary')
+            settings = {'redis.sessions.secret': 'test',
+                        'redis.sessions.compress_threshold': '100',
+                        'redis.sessions.compress_level': '9',
+                        'redis.sessions.compress_dictionary': path}
+            inst = self._makeOne(settings)
+        finally:
+            os.remove(path)
+        self.assertEqual(inst['compress_threshold'], 100)
+        self.assertEqual(inst['compress_level'], 9)
+        self.assertEqual(inst['compress_dictionary'], b'dictionary')
+
+    def test_pool_settings(self):
+        settings = {'redis.sessions.secret': 'test',
+                    'redis.sessions.max_connections': '50',
+                    'redis.sessions.socket_connect_timeout': '1.5',
+                    'redis.sessions.socket_keepalive': 'true',
+                    'redis.sessions.health_check_interval': '30',
+                    'redis.sessions.pool_timeout': '0.5'}
+        inst = self._makeOne(settings)
+        self.assertEqual(inst['max_connections'], 50)
+        self.assertEqual(inst['socket_connect_timeout'], 1.5)
+        self.assertIs(inst['socket_keepalive'], True)
+        self.assertEqual(inst['health_check_interval'], 30)
+        self.assertEqual(inst['pool_timeout'], 0.5)
+
+    def test_cookie_settings(self):
+        settings = {'redis.sessions.secret': 'test',
+                    'redis.sessions.cookie_format': 'compact',
+                    'redis.sessions.cookie_accept_legacy': 'false',
+                    'redis.sessions.cookie_cache_size': '100'}
+        inst = self._makeOne(settings)
+        self.assertEqual(inst['cookie_format'], 'compact')
+        self.assertIs(inst['cookie_accept_legacy'], False)
+        self.assertEqual(inst['cookie_cache_size'], 100)
+
     def test_prefix_in_options(self):
         settings = {'redis.sessions.secret': 'test',
                     'redis.sessions.prefix': 'testprefix'}
@@ -91,9 +149,56 @@ class Test__insert_session_id_if_unique(unittest.TestCase):
         self.assertEqual(redis.get('id'), original_value)
         self.assertEqual(result, None)
 
+    def test_id_is_unique_with_value(self):
+        from ..util import _insert_session_id_if_unique
+        redis = DummyRedis()
+        result = _insert_session_id_if_unique(redis, 1, 'id', None,
+                                              value='serialized')
+        self.assertEqual(redis.get('id'), 'serialized')
+        self.assertEqual(result, 'id')
+
+    def test_id_is_unique_with_hash_value(self):
+        from ..util import _insert_session_id_if_unique
+        redis = DummyRedis()
+        result = _insert_session_id_if_unique(redis, 1, 'id', None,
+                                              value={'created': '1'})
+        self.assertEqual(redis.hgetall('id'), {'created': '1'})
+        self.assertEqual(redis.ttl('id'), 1)
+        self.assertEqual(result, 'id')
+
+    def test_id_is_unique_uses_single_set(self):
+        redis = DummyRedis()
+        redis.pipeline = None  # must not be called
+        result = self._makeOne(redis, timeout=30, serialize=repr)
+        self.assertEqual(result, 'id')
+        self.assertEqual(redis.ttl('id'), 30)
+
+    def test_replace_deletes_keys(self):
+        from ..util import _insert_session_id_if_unique
+        redis = DummyRedis()
+        redis.set('old', 'value')
+        redis.set('old:version', 1)
+        result = _insert_session_id_if_unique(redis, 1, 'id', None,
+                                              value='serialized',
+                                              replace=['old', 'old:version'])
+        self.assertEqual(result, 'id')
+        self.assertEqual(redis.store, {'id': 'serialized'})
+
+    def test_replace_deletes_keys_with_hash_value(self):
+        from ..util import _insert_session_id_if_unique
+        redis = DummyRedis()
+        redis.hset('old', mapping={'created': '1'})
+        result = _insert_session_id_if_unique(redis, 1, 'id', None,
+                                              value={'created': '2'},
+                                              replace=['old'])
+        self.assertEqual(result, 'id')
+        self.assertEqual(redis.store, {'id': {'created': '2'}})
+
     def test_watcherror_returns_none(self):
+        from ..util import _insert_session_id_if_unique
         redis = DummyRedis(raise_watcherror=True)
-        result = self._makeOne(redis)
+        result = _insert_session_id_if_unique(redis, 1, 'id', None,
+                                              value={'created': '1'})
         self.assertIs(redis.get('id'), None)
         self.assertEqual(result, None)
 
@@ -118,6 +223,40 @@ class Test_get_unique_session_id(unittest.TestCase):
         self.assertEqual(result, 2)
 
 
+class Test_session_id_from_cookie(unittest.TestCase):
+    def _callFUT(self, cookieval, **kw):
+        from ..util import session_id_from_cookie
+        return session_id_from_cookie(cookieval, 'secret', **kw)
+
+    def test_missing(self):
+        self.assertIsNone(self._callFUT(None))
+
+    def test_invalid(self):
+        self.assertIsNone(self._callFUT('garbage'))
+        self.assertIsNone(self._callFUT('garbage.garbage'))
+
+    def test_both_formats(self):
+        from ..cookie import serialize_cookie
+        for format in ('legacy', 'compact'):
+            cookieval = serialize_cookie('id', 'secret', format)
+            self.assertEqual(self._callFUT(cookieval), 'id')
+
+    def test_cache_skips_verification(self):
+        from ..cookie import VerifiedCookieCache, serialize_cookie
+        cache = VerifiedCookieCache()
+        cookieval = serialize_cookie('id', 'secret', 'compact')
+        self.assertEqual(self._callFUT(cookieval, cache=cache), 'id')
+        self.assertEqual(cache.get(cookieval), 'id')
+        cache.put('unsigned', 'other')
+        self.assertEqual(self._callFUT('unsigned', cache=cache), 'other')
+
+    def test_cache_ignores_invalid(self):
+        from ..cookie import VerifiedCookieCache
+        cache = VerifiedCookieCache()
+        self.assertIsNone(self._callFUT('garbage.garbage', cache=cache))
+        self.assertEqual(len(cache), 0)
+
+
 class Test__generate_session_id(unittest.TestCase):
     def _makeOne(self):
         from ..util import _generate_session_id
@@ -127,6 +266,8 @@ class Test__generate_session_id(unittest.TestCase):
         inst = self._makeOne()
         result = inst()
         self.assertEqual(len(result), 64)
+        self.assertNotEqual(result, inst())
+        int(result, 16)
 
 class Test_prefixed_id(unittest.TestCase):
     def _makeOne(self):
@@ -163,6 +304,16 @@ class Test_persist_decorator(unittest.TestCase):
         self.assertEqual(result, 'expected result')
         self.assertEqual(timeout, ttl)
 
+    def test_write_back_only_marks_dirty(self):
+        def wrapped(session, *arg, **kwarg):
+            session.managed_dict['key'] = 'value'
+        inst = self._makeOne(wrapped)
+        session = self._makeSession(300)
+        session.write_back = True
+        inst(session)
+        self.assertIs(session._dirty, True)
+        self.assertNotIn(session.session_id, session.redis.store)
+
 
 class Test_refresh_decorator(unittest.TestCase):
     def _makeOne(self, wrapped):
@@ -187,3 +338,13 @@ class Test_refresh_decorator(unittest.TestCase):
         self.assertEqual(result, 'expected result')
         self.assertEqual(timeout, ttl)
 
+    def test_defer_refresh_only_marks_touched(self):
+        def wrapped(session, *arg, **kwarg):
+            return 'expected result'
+        inst = self._makeOne(wrapped)
+        session = self._makeSession(1)
+        session.defer_refresh = True
+        session.timeout = 300
+        inst(session)
+        self.assertIs(session._touched, True)
+        self.assertEqual(session.redis.ttl(session.session_id), 1)
@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 
+import binascii
 from functools import partial
-from hashlib import sha256
 import os
 import sys
 import time
@@ -10,6 +10,8 @@ from pyramid.exceptions import ConfigurationError
 from pyramid.settings import asbool
 from redis.exceptions import WatchError
 
+from .cookie import deserialize_cookie
+
 
 PY3 = sys.version_info[0] == 3
 
@@ -25,14 +27,13 @@ def to_unicode(value): # pragma: no cover
 
 def _generate_session_id():
     """
-    Produces a random 64 character hex-encoded string. The implementation of
-    `os.urandom` varies by system, but you can always supply your own function
-    in your ini file with:
+    Produces a random 64 character hex-encoded string, straight from 32 bytes
+    of `os.urandom`. The implementation of `os.urandom` varies by system, but
+    you can always supply your own function in your ini file with:
 
         redis.sessions.id_generator = my_random_id_generator
     """
-    rand = os.urandom(20)
-    return sha256(sha256(rand).digest()).hexdigest()
+    return str(binascii.hexlify(os.urandom(32)).decode('ascii'))
 
 def prefixed_id(prefix='session:'):
     """
@@ -43,26 +44,74 @@ def prefixed_id(prefix='session:'):
     prefixed_id = prefix + session_id
     return prefixed_id
 
+def _on_one_node(redis, keys):
+    # only a ShardedRedis has more than one node
+    node_name = getattr(redis, 'node_name', None)
+    if node_name is None:
+        return True
+    return len(set(node_name(key) for key in keys)) == 1
+
+def _has_getex(redis):
+    # GETEX was added in redis-py 4.0; a ShardedRedis needs it on every node
+    nodes = getattr(redis, 'nodes', None)
+    if nodes is not None:
+        return all(_has_getex(node) for node in nodes.values())
+    return callable(getattr(redis, 'getex', None))
+
 def _insert_session_id_if_unique(
     redis,
     timeout,
     session_id,
     serialize,
+    value=None,
+    replace=None,
     ):
     """ Attempt to insert a given ``session_id`` and return the successful id
-    or ``None``."""
+    or ``None``. ``value`` is the serialized session to insert, and defaults
+    to an empty session. A ``dict`` value is stored as the fields of a Redis
+    hash. ``replace`` is a list of keys to delete in the same transaction.
+
+    A string value is inserted with a single ``SET NX EX``, which only
+    succeeds if the key doesn't exist yet. Hashes have no such command, so
+    they are always inserted in a ``MULTI`` transaction guarded by
+    ``WATCH``, which takes two round trips. They don't use a script even
+    with ``use_scripts``, since creating sessions must not depend on it.
+
+    With a ``ShardedRedis``, a transaction can't span two nodes, so keys in
+    ``replace`` that are on another node than ``session_id`` are deleted
+    after the insert instead."""
+    if replace and not _on_one_node(redis, [session_id] + list(replace)):
+        session_id = _insert_session_id_if_unique(
+            redis, timeout, session_id, serialize, value)
+        if session_id is not None:
+            redis.delete(*replace)
+        return session_id
+    if value is None:
+        value = serialize({
+            'managed_dict': {},
+            'created': time.time(),
+            'timeout': timeout,
+            })
+    if not isinstance(value, dict):
+        if not replace:
+            if redis.set(session_id, value, ex=timeout, nx=True):
+                return session_id
+            return None
+        with redis.pipeline() as pipe:
+            pipe.delete(*replace)
+            pipe.set(session_id, value, ex=timeout, nx=True)
+            if pipe.execute()[-1]:
+                return session_id
+            return None
     with redis.pipeline() as pipe:
         try:
             pipe.watch(session_id)
-            value = pipe.get(session_id)
-            if value is not None:
+            if pipe.exists(session_id):
                 return None
             pipe.multi()
-            pipe.set(session_id, serialize({
-                'managed_dict': {},
-                'created': time.time(),
-                'timeout': timeout,
-                }))
+            if replace:
+                pipe.delete(*replace)
+            pipe.hset(session_id, mapping=value)
             pipe.expire(session_id, timeout)
             pipe.execute()
             return session_id
@@ -74,9 +123,15 @@ def get_unique_session_id(
     timeout,
     serialize,
     generator=_generate_session_id,
+    value=None,
+    replace=None,
+    metrics=None,
     ):
     """
     Returns a unique session id after inserting it successfully in Redis.
+    ``value`` is the serialized session to insert, and defaults to an empty
+    session. The keys in ``replace`` are deleted in the same transaction as
+    the insert. ``metrics`` is told about every id that already existed.
     """
     while 1:
         session_id = generator()
@@ -85,9 +140,35 @@ def get_unique_session_id(
             timeout,
             session_id,
             serialize,
+            value,
+            replace,
             )
         if attempt is not None:
             return attempt
+        if metrics is not None:
+            metrics.session_id_collision()
+
+def session_id_from_cookie(cookieval, secret, accept_legacy=True,
+                           cache=None):
+    """
+    Returns the session id stored in the signed session cookie value
+    ``cookieval``, or ``None`` if it is missing or cannot be verified. Both
+    cookie formats are read, unless ``accept_legacy`` is ``False``. ``cache``
+    is an optional ``cookie.VerifiedCookieCache`` of values verified before.
+    """
+    if cookieval is None:
+        return None
+    if cache is not None:
+        session_id = cache.get(cookieval)
+        if session_id is not None:
+            return session_id
+    try:
+        session_id = deserialize_cookie(cookieval, secret, accept_legacy)
+    except ValueError:
+        return None
+    if cache is not None and session_id is not None:
+        cache.put(cookieval, session_id)
+    return session_id
 
 def _parse_settings(settings):
     """
@@ -108,24 +189,45 @@ def _parse_settings(settings):
         raise ConfigurationError('redis.sessions.secret is a required setting')
 
     # coerce bools
-    for b in ('cookie_secure', 'cookie_httponly', 'cookie_on_exception'):
+    for b in ('cookie_secure', 'cookie_httponly', 'cookie_on_exception',
+              'write_back', 'touch_on_load', 'lazy_create', 'detect_changes',
+              'local_cache', 'socket_keepalive', 'use_scripts',
+              'cookie_accept_legacy', 'track_activity',
+              'activity_last_seen'):
         if b in options:
             options[b] = asbool(options[b])
 
     # coerce ints
-    for i in ('timeout', 'port', 'db', 'cookie_max_age'):
+    for i in ('timeout', 'port', 'db', 'cookie_max_age',
+              'compress_threshold', 'compress_level',
+              'local_cache_entries', 'local_cache_bytes', 'max_connections',
+              'health_check_interval', 'cookie_cache_size',
+              'max_sessions_per_user', 'activity_bucket',
+              'activity_retention'):
         if i in options:
             options[i] = int(options[i])
 
-    # coerce float
-    if 'socket_timeout' in options:
-        options['socket_timeout'] = float(options['socket_timeout'])
+    # coerce floats
+    for f in ('socket_timeout', 'refresh_threshold', 'socket_connect_timeout',
+              'pool_timeout', 'replica_lag'):
+        if f in options:
+            options[f] = float(options[f])
 
     # check for settings conflict
     if 'prefix' in options and 'id_generator' in options:
         err = 'cannot specify custom id_generator and a key prefix'
         raise ConfigurationError(err)
 
+    if 'serialize' in options and \
+            ('codec' in options or 'compress_threshold' in options):
+        err = 'cannot specify custom serialize and a codec or compression'
+        raise ConfigurationError(err)
+
+    # the compression dictionary setting is a path to the trained dictionary
+    if 'compress_dictionary' in options:
+        with open(options['compress_dictionary'], 'rb') as f:
+            options['compress_dictionary'] = f.read()
+
     # convenience setting for overriding key prefixes
     if 'prefix' in options:
         prefix = options.pop('prefix')
@@ -136,10 +238,15 @@ def _parse_settings(settings):
 def refresh(wrapped):
     """
     Decorator to reset the expire time for this session's key in Redis.
+    Sessions that defer refreshes are only marked as touched, and the expire
+    time is reset at most once at the end of the request.
     """
     def wrapped_refresh(session, *arg, **kw):
         result = wrapped(session, *arg, **kw)
-        session.redis.expire(session.session_id, session.timeout)
+        if session.defer_refresh:
+            session._touched = True
+        else:
+            session.do_refresh()
         return result
 
     return wrapped_refresh
@@ -147,14 +254,15 @@ def refresh(wrapped):
 def persist(wrapped):
     """
     Decorator to persist in Redis all the data that needs to be persisted for
-    this session and reset the expire time.
+    this session and reset the expire time. Sessions in write-back mode are
+    only marked as dirty, and are written once at the end of the request.
     """
     def wrapped_persist(session, *arg, **kw):
         result = wrapped(session, *arg, **kw)
-        with session.redis.pipeline() as pipe:
-            pipe.set(session.session_id, session.to_redis())
-            pipe.expire(session.session_id, session.timeout)
-            pipe.execute()
+        if session.write_back:
+            session._dirty = True
+        else:
+            session.do_persist()
         return result
 
     return wrapped_persist
@@ -20,10 +20,12 @@ except IOError:
     README = CHANGES = ''
 
 # set up requires
-install_requires = ['redis>=2.10.0', 'pyramid>=1.3']
-testing_requires = ['nose']
+install_requires = ['redis>=3.5.0', 'pyramid>=1.3']
+testing_requires = ['nose', 'pytest']
 testing_extras = testing_requires + ['coverage']
 docs_extras = ['sphinx']
+msgpack_extras = ['msgpack']
+async_extras = ['redis>=4.2']
 
 
 def main():
@@ -56,6 +58,8 @@ def main():
         extras_require = {
             'testing': testing_extras,
             'docs': docs_extras,
+            'msgpack': msgpack_extras,
+            'async': async_extras,
             },
     )
 